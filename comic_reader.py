@@ -19,11 +19,17 @@ import sys
 import re
 import subprocess
 import shutil
+import threading
+import time
 from PyQt5 import QtCore, QtWidgets, QtGui
 try:
     from src.settings import Settings
     from src.comic import Comic
-    from src.viewer import Viewer
+    from src.tracing import tracer
+    from src.storage import prune_cache, storage
+    from src.scheduler import PRUNING, scheduler
+    from src.watchdog import watchdog
+    from src.instance import claim, server_name
     # Set working directory
     os.chdir(os.path.dirname(os.path.realpath(__file__)))
 except ImportError:
@@ -31,7 +37,11 @@ except ImportError:
     os.chdir(os.path.dirname(os.path.realpath(__file__)))
     from src.settings import Settings
     from src.comic import Comic
-    from src.viewer import Viewer
+    from src.tracing import tracer
+    from src.storage import prune_cache, storage
+    from src.scheduler import PRUNING, scheduler
+    from src.watchdog import watchdog
+    from src.instance import claim, server_name
 if os.name == 'nt':
     try:
         import win32api
@@ -39,21 +49,100 @@ if os.name == 'nt':
     except ImportError:
         print('Please install pywin32 from pip.')
         sys.exit(1)
+# Reference of the startup-time report
+START_TIME = time.perf_counter()
 
 
 working_dir = os.path.dirname(os.path.realpath(__file__))
 settings_path = os.path.join(working_dir, 'comic_reader.ini')
 
 
+class LibraryScanner(QtCore.QObject):
+    """Scan the comics directory in a background thread."""
+    finished = QtCore.pyqtSignal(list)
+
+    def __init__(self, comics_dir: str):
+        super().__init__()
+        self.comics_dir = comics_dir
+
+    def start(self):
+        """Start scanning, `finished` is emitted with the comics."""
+        threading.Thread(
+            target=self._run, name='library-scan', daemon=True
+        ).start()
+
+    def _run(self):
+        """Scan, and emit `finished` even if the scan fails (in the scan
+        thread)."""
+        comics = []
+        try:
+            comics = self.scan()
+        except OSError as error:
+            print(f'[ERROR] Cannot scan the library: {error}')
+        finally:
+            self.finished.emit(comics)
+
+    def scan(self) -> list:
+        """List the comics (directories only, and not hidden ones)."""
+        def folder_is_hidden(path):
+            if os.name == 'nt':
+                # Windows
+                attribute = win32api.GetFileAttributes(path)
+                return attribute & (
+                    win32con.FILE_ATTRIBUTE_HIDDEN
+                    | win32con.FILE_ATTRIBUTE_SYSTEM
+                )
+            # Linux and Mac
+            return path.startswith('.')
+
+        with tracer.span('library scan'):
+            # Names and types in one listing, without a stat per comic
+            return [
+                entry.name
+                for entry in storage.scandir(self.comics_dir)
+                if entry.is_dir and not folder_is_hidden(entry.name)
+            ]
+
+
 class MainWindow(QtWidgets.QMainWindow):
     """Main window."""
     def __init__(self):
         super().__init__()
+        self.startup_times = []
+        self._startup_mark('application created')
         self.setWindowTitle('Comic Reader')
         self.setWindowIcon(QtGui.QIcon('images/comic_reader.png'))
         self.resize(1000, 600)
         self.keyPressEvent = self.key_press
         self.settings = Settings(settings_path)
+        tracer.configure(self.settings, working_dir)
+        storage.configure(self.settings, working_dir)
+        scheduler.configure(self.settings)
+        # Keep the caches under their cap, once the viewer is idle
+        scheduler.submit(
+            'cache pruning',
+            prune_cache,
+            [
+                os.path.join(working_dir, 'cache', name)
+                for name in ('thumbnails', 'index', 'hashes')
+            ],
+            int(
+                (self.settings['background'] or {}).get('cache_mb', 1024)
+                * 2**20
+            ),
+            priority=PRUNING
+        )
+        # Report the stalls of the GUI thread
+        watchdog.configure(self.settings)
+        watchdog.start()
+        # Stay resident in the system tray when closed, if enabled
+        self.tray = None
+        self._quitting = False
+        if (
+            (self.settings.get('instance') or {}).get('tray', False)
+            and QtWidgets.QSystemTrayIcon.isSystemTrayAvailable()
+        ):
+            self._create_tray()
 
         self.comic_list = QtWidgets.QListWidget()
         self.comic_list.itemClicked.connect(self.comic_clicked)
@@ -74,11 +163,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.chapter_list.keyPressEvent = self.chapter_list_key_press
         self.chapter_list.setFont(QtGui.QFont('Noto Sans', 12))
 
-        # Image viewer will be in a new window
-        self.viewer = Viewer(
-            working_dir=working_dir,
-            settings=self.settings
-        )
+        # Image viewer will be in a new window, built when first needed
+        self._viewer = None
 
         self.splitter = QtWidgets.QSplitter()
         self.splitter.addWidget(self.comic_list)
@@ -86,32 +172,145 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setCentralWidget(self.splitter)
 
         self.set_theme()
-
-        self.load_comics()
         self.current_comic = None
-        is_comic_found = False
-
-        # Load last read if any
-        if self.settings['last_read']:
-            for i in range(self.comic_list.count()):
-                text = self.comic_list.item(i).text()
-                if text == self.settings['last_read']:
-                    self.comic_list.setCurrentRow(i)
-                    self.comic_clicked()
-                    is_comic_found = True
-                    break
-            if is_comic_found:
-                self.comic_clicked()
 
-        # Show main window
+        # Show main window first, the library is loaded once it is shown
         self.showMaximized()
+        self._startup_mark('window shown')
+        self.scanner = LibraryScanner(self.settings['comics_dir'])
+        self.scanner.finished.connect(self._library_scanned)
+        QtCore.QTimer.singleShot(0, self._start_library_scan)
+
+    @property
+    def viewer(self):
+        """Image viewer, built (and its module imported) on first use."""
+        if self._viewer is None:
+            with tracer.span('viewer construction'):
+                from src.viewer import Viewer
+                self._viewer = Viewer(
+                    working_dir=working_dir,
+                    settings=self.settings
+                )
+        return self._viewer
+
+    def _create_tray(self):
+        """Create the tray icon, with its menu."""
+        self.tray = QtWidgets.QSystemTrayIcon(self.windowIcon(), self)
+        self.tray.setToolTip('Comic Reader')
+        menu = QtWidgets.QMenu(self)
+        menu.addAction('Show', self.show_window)
+        menu.addAction('Quit', self.quit)
+        self.tray.setContextMenu(menu)
+        self.tray.activated.connect(self._tray_activated)
+        self.tray.show()
+        # Closing the window only hides it
+        QtWidgets.QApplication.instance().setQuitOnLastWindowClosed(False)
+
+    def _tray_activated(self, reason):
+        """Show the app when the tray icon is clicked."""
+        if reason in (
+            QtWidgets.QSystemTrayIcon.Trigger,
+            QtWidgets.QSystemTrayIcon.DoubleClick
+        ):
+            self.show_window()
 
-        # Show image viewer if there is a last chapter
-        if self.settings['last_read'] and is_comic_found:
-            # Load last chapter if any
-            last_chapter = self.current_comic.get_last_chapter()
-            if last_chapter:
-                self.chapter_clicked()
+    def show_window(self):
+        """Show the app again, and raise it (the viewer if it is open)."""
+        watchdog.resume()
+        if self._viewer is not None and self._viewer.image_viewer.isVisible():
+            window = self._viewer.image_viewer
+        else:
+            window = self
+            if self.isHidden():
+                self.showMaximized()
+        window.setWindowState(
+            window.windowState() & ~QtCore.Qt.WindowMinimized
+            | QtCore.Qt.WindowActive
+        )
+        window.raise_()
+        window.activateWindow()
+
+    def hide_to_tray(self):
+        """Hide the app to the tray, with its caches still warm."""
+        self._close_viewer()
+        self.hide()
+        # Nothing to watch while hidden
+        watchdog.pause()
+        print('[INFO] Comic Reader is resident in the tray.')
+
+    def _close_viewer(self):
+        """Close the viewer if it is open (its progression is saved)."""
+        if self._viewer is not None and self._viewer.image_viewer.isVisible():
+            self._viewer.close_image_viewer()
+
+    def handle_request(self, request: dict):
+        """Handle a request of another launch of the app."""
+        print('[INFO] Request from another launch:', request.get('command'))
+        if request.get('command') == 'show':
+            self.show_window()
+        else:
+            print(f'[WARNING] Unknown request: {request}')
+
+    def _start_library_scan(self):
+        """Scan the library, in the background if enabled."""
+        self._startup_mark('first event')
+        if self.settings.get('startup', {}).get('background_scan', True):
+            self.scanner.start()
+        else:
+            self._library_scanned(self.scanner.scan())
+
+    def _library_scanned(self, comics: list):
+        """Display the scanned library, then restore the last read."""
+        self._populate_comics(comics)
+        self._startup_mark('library loaded')
+        # Let the list be painted before restoring the last read
+        QtCore.QTimer.singleShot(0, self._restore_last_read)
+
+    def _restore_last_read(self):
+        """Select the last read comic, and open its last chapter."""
+        if self.settings['last_read']:
+            items = self.comic_list.findItems(
+                self.settings['last_read'], QtCore.Qt.MatchExactly
+            )
+            if items:
+                self.comic_list.setCurrentItem(items[0])
+                self.comic_clicked()
+                # Show image viewer if there is a last chapter
+                if self.current_comic.get_last_chapter():
+                    self.chapter_clicked()
+        self._startup_mark('last read restored')
+        self._startup_report()
+
+    def _startup_mark(self, label: str):
+        """Record the time elapsed since the imports."""
+        self.startup_times.append((label, time.perf_counter() - START_TIME))
+
+    def _startup_report(self):
+        """Print the startup-time report, and check it against the budget.
+
+        The budget (`startup.budget_ms` setting) is the time until the
+        library is displayed.
+        """
+        budget = self.settings.get('startup', {}).get('budget_ms', 1000)
+        print("[INFO] Startup times")
+        previous = 0.0
+        for label, elapsed in self.startup_times:
+            print(
+                f"- {label}: {elapsed * 1000:.0f} ms "
+                f"(+{(elapsed - previous) * 1000:.0f} ms)"
+            )
+            tracer.add(
+                f'startup: {label}',
+                START_TIME + previous,
+                elapsed - previous
+            )
+            previous = elapsed
+        library_loaded = dict(self.startup_times)['library loaded']
+        if library_loaded * 1000 > budget:
+            print(
+                f"[WARNING] Startup over budget: {library_loaded * 1000:.0f}"
+                f" ms > {budget} ms"
+            )
 
     def set_theme(self):
         """Set theme."""
@@ -153,36 +352,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.comic_list.verticalScrollBar().setStyleSheet(style_scrollbar)
         self.chapter_list.verticalScrollBar().setStyleSheet(style_scrollbar)
 
-    def load_comics(self):
-        """Load comics from the comic directory."""
+    def _populate_comics(self, comics: list):
+        """Display the comics in the comic list."""
         self.comic_list.clear()
         self.chapter_list.clear()
-
-        def folder_is_hidden(path):
-            if os.name == 'nt':
-                # Windows
-                attribute = win32api.GetFileAttributes(path)
-                return attribute & (
-                    win32con.FILE_ATTRIBUTE_HIDDEN
-                    | win32con.FILE_ATTRIBUTE_SYSTEM
-                )
-            # Linux and Mac
-            return path.startswith('.')
-
-        # List directories only (and not hidden ones)
-        self.comic_list.addItems(
-            [
-                comic
-                for comic in os.listdir(self.settings['comics_dir'])
-                if (
-                    os.path.isdir(os.path.join(
-                        self.settings['comics_dir'],
-                        comic
-                    ))
-                    and not folder_is_hidden(comic)
-                )
-            ]
-        )
+        self.comic_list.addItems(comics)
         # Sort comics
         self.comic_list.sortItems()
         print("[DEBUG] Load comics")
@@ -191,18 +365,20 @@ class MainWindow(QtWidgets.QMainWindow):
     def comic_clicked(self):
         """Load chapters for a comic."""
         self.chapter_list.clear()
-        self.current_comic = Comic(
-            os.path.join(
-                self.settings['comics_dir'],
-                self.comic_list.currentItem().text()
+        with tracer.span('metadata load'):
+            self.current_comic = Comic(
+                storage.join(
+                    self.settings['comics_dir'],
+                    self.comic_list.currentItem().text()
+                )
             )
-        )
         # List .cbz files
-        chapter_list = [
-            chapter
-            for chapter in os.listdir(self.current_comic.path)
-            if chapter.endswith('.cbz')
-        ]
+        with tracer.span('chapter scan', comic=self.current_comic.name):
+            chapter_list = [
+                chapter
+                for chapter in storage.listdir(self.current_comic.path)
+                if chapter.endswith('.cbz')
+            ]
         # Sort chapters
         chapter_list.sort(key=lambda x: int(re.findall(r'\d+', x)[0]))
         # Check if there are chapters in ".5", if so, move them to the
@@ -390,17 +566,65 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             self.key_press(event)
 
+    def closeEvent(self, event):
+        """Hide to the tray instead of closing, if resident."""
+        if self.tray is not None and not self._quitting:
+            event.ignore()
+            self.hide_to_tray()
+        else:
+            super().closeEvent(event)
+
+    def quit(self):
+        """Quit the app, even if resident in the tray."""
+        self._quitting = True
+        self._close_viewer()
+        self.close()
+        QtWidgets.QApplication.instance().quit()
+
     def close(self) -> bool:
-        """Close the Application."""
+        """Close the Application (or hide it, if resident in the tray)."""
+        if self.tray is not None and not self._quitting:
+            self.hide_to_tray()
+            return True
+        if self.tray is not None:
+            self.tray.hide()
+        # Close window, the app quits with its last window
+        return super().close()
+
+    def shutdown(self):
+        """Clean up before the app quits, however it is closed (keys, tray
+        menu, or the button of the window)."""
         # Clear temporary directory
         if os.path.exists(os.path.join(working_dir, 'tmp')):
             shutil.rmtree(os.path.join(working_dir, 'tmp'))
             print('[INFO] Temporary directory cleared.')
-        # Close window
-        return super().close()
+        # Report the stalls, before the trace which records them
+        watchdog.stop()
+        watchdog.report()
+        # Export trace if tracing is enabled
+        if tracer.enabled:
+            tracer.export()
 
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
+    # Hand the launch over to the running instance, if any
+    server = None
+    if (Settings(settings_path).get('instance') or {}).get('single', True):
+        try:
+            server = claim(server_name(working_dir), {'command': 'show'})
+        except TimeoutError as error:
+            print(f'[ERROR] {error}')
+            sys.exit(1)
+        if server is None:
+            print('[INFO] Comic Reader is already running, '
+                  'its window is shown.')
+            sys.exit(0)
     window = MainWindow()
-    sys.exit(app.exec())
+    app.aboutToQuit.connect(window.shutdown)
+    if server is not None:
+        server.requested.connect(window.handle_request)
+    status = app.exec()
+    if server is not None:
+        server.close()
+    sys.exit(status)
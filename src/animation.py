@@ -0,0 +1,172 @@
+"""
+Animation module.
+
+To play the animated pages (GIF, animated WebP, WebM) of a chapter.
+
+Animations only decode frames while their page is visible: they are started
+when the page scrolls into view, and stopped (their decoder and frame
+buffers released) when it scrolls away. The frames of an animation are
+cached only if they fit in the frame-cache cap, otherwise they are decoded
+again on each loop.
+"""
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+try:
+    from PyQt5 import QtMultimedia, QtMultimediaWidgets
+except ImportError:
+    QtMultimedia = None
+    QtMultimediaWidgets = None
+
+
+def is_video(name: str) -> bool:
+    """Tell if a page is a video."""
+    return name.lower().endswith('.webm')
+
+
+def is_animated(data) -> bool:
+    """Tell if an image (GIF, WebP) is animated, from its header only: the
+    looping extension of a GIF, or the animation flag of a WebP."""
+    head = bytes(data[:32])
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        # Extended format (VP8X chunk), with the animation flag
+        return head[12:16] == b'VP8X' and bool(head[20] & 0x02)
+    if head.startswith(b'GIF8'):
+        # The looping extension precedes the first frame
+        head = bytes(data[:64 * 1024])
+        return b'NETSCAPE2.0' in head or b'ANIMEXTS1.0' in head
+    return False
+
+
+def frame_bytes(size: QtCore.QSize) -> int:
+    """Get the memory used by a frame of `size`, in 32 bits per pixel."""
+    return size.width() * size.height() * 4
+
+
+class AnimatedPage:
+    """
+    AnimatedPage class.
+
+    Plays an animated image in the label of its page, with a QMovie.
+    """
+    def __init__(self, label: QtWidgets.QLabel, data, cache_cap: int):
+        self.label = label
+        self.cache_cap = cache_cap
+        self._data = QtCore.QByteArray(bytes(data))
+        self._buffer = None
+        self._movie = None
+        # Memory used by the decoded frames while playing
+        self._frames_bytes = 0
+
+    def is_playing(self) -> bool:
+        """Tell if the animation is playing."""
+        return self._movie is not None
+
+    def nbytes(self) -> int:
+        """Get the memory used by the page: its encoded data, and its frames
+        (the current one only, unless they are cached while playing)."""
+        return self._data.size() + max(
+            self._frames_bytes, frame_bytes(self.label.size())
+        )
+
+    def start(self):
+        """Start playing, from the first frame."""
+        if self._movie is not None:
+            return
+        self._buffer = QtCore.QBuffer(self._data)
+        self._buffer.open(QtCore.QIODevice.ReadOnly)
+        self._movie = QtGui.QMovie(self._buffer, QtCore.QByteArray())
+        size = self.label.size()
+        self._movie.setScaledSize(size)
+        # Cache the frames only if they fit in the cap
+        frames_bytes = max(self._movie.frameCount(), 1) * frame_bytes(size)
+        if frames_bytes <= self.cache_cap:
+            self._movie.setCacheMode(QtGui.QMovie.CacheAll)
+            self._frames_bytes = frames_bytes
+        else:
+            self._movie.setCacheMode(QtGui.QMovie.CacheNone)
+            # The current frame, and the next one being decoded
+            self._frames_bytes = 2 * frame_bytes(size)
+        self.label.setMovie(self._movie)
+        self._movie.start()
+
+    def stop(self):
+        """Stop playing, and release the decoder and its frames."""
+        if self._movie is None:
+            return
+        # Keep the current frame displayed, as a still image
+        frame = self._movie.currentPixmap()
+        self._movie.stop()
+        self.label.setMovie(None)
+        if not frame.isNull():
+            self.label.setPixmap(frame)
+        self._movie.deleteLater()
+        self._buffer.close()
+        self._movie = None
+        self._buffer = None
+        self._frames_bytes = 0
+
+
+class VideoPage:
+    """
+    VideoPage class.
+
+    Plays a video page (muted, looping) in a video widget covering the
+    label of its page.
+    """
+    def __init__(self, label: QtWidgets.QLabel, data):
+        self.label = label
+        self._data = QtCore.QByteArray(bytes(data))
+        self._buffer = None
+        self._player = None
+        self._widget = None
+
+    @staticmethod
+    def available() -> bool:
+        """Tell if videos can be played (QtMultimedia is installed)."""
+        return QtMultimedia is not None
+
+    def is_playing(self) -> bool:
+        """Tell if the video is playing."""
+        return self._player is not None
+
+    def nbytes(self) -> int:
+        """Get the memory used by the page: its encoded data, and a frame
+        while playing."""
+        if self._player is None:
+            return self._data.size()
+        return self._data.size() + frame_bytes(self.label.size())
+
+    def start(self):
+        """Start playing, from the beginning."""
+        if self._player is not None or not self.available():
+            return
+        self._widget = QtMultimediaWidgets.QVideoWidget(self.label)
+        self._widget.setGeometry(self.label.rect())
+        self._widget.show()
+        self._buffer = QtCore.QBuffer(self._data)
+        self._buffer.open(QtCore.QIODevice.ReadOnly)
+        self._player = QtMultimedia.QMediaPlayer()
+        self._player.setMuted(True)
+        self._player.setVideoOutput(self._widget)
+        self._player.mediaStatusChanged.connect(self._loop)
+        self._player.setMedia(QtMultimedia.QMediaContent(), self._buffer)
+        self._player.play()
+
+    def _loop(self, status):
+        """Play again at the end of the video."""
+        if status == QtMultimedia.QMediaPlayer.EndOfMedia:
+            self._player.setPosition(0)
+            self._player.play()
+
+    def stop(self):
+        """Stop playing, and release the player and its buffers."""
+        if self._player is None:
+            return
+        self._player.stop()
+        self._player.setMedia(QtMultimedia.QMediaContent())
+        self._player.deleteLater()
+        self._widget.deleteLater()
+        self._buffer.close()
+        self._player = None
+        self._widget = None
+        self._buffer = None
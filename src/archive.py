@@ -0,0 +1,435 @@
+"""
+Archive module.
+
+To read the pages of a .cbz chapter without copying them.
+
+The archive is memory-mapped: entries stored without compression
+(ZIP_STORED, the usual case for JPEG/PNG/WebP pages) are handed to the image
+decoders as zero-copy `memoryview`s of the mapping, located through their
+local header. Compressed entries fall back to a normal decompression, done in
+parallel by `read_many()` when several pages come into view at once (e.g. on
+opening a chapter).
+
+The pages of an archive (its image entries, in natural order) and their
+locations are cached by `ArchiveIndex`, so that re-opening a chapter skips the
+parsing of its central directory.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from .storage import absolute, is_url, storage
+except ImportError:
+    from storage import absolute, is_url, storage
+
+
+# Local file header: signature, versions, flags, method, time, date, crc,
+# sizes, name length and extra field length
+_LOCAL_HEADER = struct.Struct('<4s5HL2L2H')
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+
+# Extensions of the entries displayed as pages
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.webm')
+
+
+def is_page(name: str) -> bool:
+    """Tell if an entry of an archive is a page."""
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def natural_key(name: str) -> list:
+    """Get the key sorting names in natural order (2 before 10)."""
+    return [
+        int(part) if part.isdigit() else part
+        for part in re.split(r'(\d+)', name.lower())
+    ]
+
+
+class ArchiveEntry:
+    """
+    ArchiveEntry class.
+
+    Location and sizes of an entry of the archive.
+    """
+    __slots__ = (
+        'name', 'header_offset', 'compress_type', 'compress_size',
+        'file_size', 'data_offset'
+    )
+
+    def __init__(
+            self,
+            name: str,
+            header_offset: int,
+            compress_type: int,
+            compress_size: int,
+            file_size: int,
+            data_offset: int = None):
+        self.name = name
+        self.header_offset = header_offset
+        self.compress_type = compress_type
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.data_offset = data_offset
+
+    def __repr__(self):
+        return (
+            f'ArchiveEntry({self.name!r}, offset={self.header_offset}, '
+            f'type={self.compress_type}, size={self.file_size})'
+        )
+
+
+class CbzReader:
+    """
+    CbzReader class.
+
+    Memory-mapped reader of a .cbz archive.
+
+    ----------
+    # Usage
+    with CbzReader(path) as reader:
+        for name in reader.namelist():
+            data = reader.read(name)
+    """
+    def __init__(self, path: str, entries: dict = None):
+        self.path = path
+        self._file = storage.open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except ValueError:
+            # Empty file, which cannot be mapped (and is not a zip)
+            self._file.close()
+            raise zipfile.BadZipFile(f'Empty archive: {path}') from None
+        self.entries = {}
+        if entries is None:
+            self._load_entries()
+        else:
+            self.entries = entries
+
+    def _load_entries(self):
+        """Read the central directory of the archive."""
+        with zipfile.ZipFile(self._file) as zip_file:
+            for info in zip_file.infolist():
+                if info.is_dir():
+                    continue
+                self.entries[info.filename] = ArchiveEntry(
+                    info.filename,
+                    info.header_offset,
+                    info.compress_type,
+                    info.compress_size,
+                    info.file_size
+                )
+
+    def namelist(self) -> list:
+        """Get the names of the entries, in archive order."""
+        return list(self.entries)
+
+    def pages(self) -> list:
+        """Get the names of the pages, in reading (natural) order."""
+        return sorted(filter(is_page, self.entries), key=natural_key)
+
+    def _data_offset(self, entry: ArchiveEntry) -> int:
+        """Get the offset of the data of an entry, from its local header."""
+        if entry.data_offset is None:
+            header = _LOCAL_HEADER.unpack_from(
+                self._read_at(entry.header_offset, _LOCAL_HEADER.size)
+            )
+            if header[0] != _LOCAL_SIGNATURE:
+                raise zipfile.BadZipFile(
+                    f'Bad local header for {entry.name} in {self.path}'
+                )
+            name_length, extra_length = header[-2:]
+            entry.data_offset = (
+                entry.header_offset + _LOCAL_HEADER.size
+                + name_length + extra_length
+            )
+        return entry.data_offset
+
+    def _read_at(self, offset: int, length: int):
+        """Read `length` bytes of the archive from `offset`."""
+        return memoryview(self._mmap)[offset:offset + length]
+
+    def _read_with_zipfile(self, name: str) -> bytes:
+        """Read an entry with zipfile (any compression method)."""
+        with zipfile.ZipFile(self.path) as zip_file:
+            return zip_file.read(name)
+
+    def read(self, name: str):
+        """Read an entry.
+
+        ----------
+        # Parameters
+        name: The name of the entry to read.
+
+        ----------
+        # Returns
+        A read-only `memoryview` of the mapping for stored entries, `bytes`
+        for compressed ones.
+        """
+        entry = self.entries[name]
+        data = self._read_at(self._data_offset(entry), entry.compress_size)
+        if entry.compress_type == zipfile.ZIP_STORED:
+            return data
+        if entry.compress_type == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -zlib.MAX_WBITS, entry.file_size)
+        # Other methods (bzip2, lzma, ...) through zipfile
+        if isinstance(data, memoryview):
+            data.release()
+        return self._read_with_zipfile(name)
+
+    def read_head(self, name: str, length: int = 64 * 1024) -> bytes:
+        """Read the first `length` bytes of an entry (e.g. the header of an
+        image), inflating only what is needed."""
+        entry = self.entries[name]
+        if entry.compress_type == zipfile.ZIP_STORED:
+            return bytes(self._read_at(
+                self._data_offset(entry), min(length, entry.file_size)
+            ))
+        if entry.compress_type == zipfile.ZIP_DEFLATED:
+            # Deflated images barely shrink: a few more compressed bytes
+            # than `length` inflate to at least `length` bytes
+            data = self._read_at(
+                self._data_offset(entry),
+                min(length + 1024, entry.compress_size)
+            )
+            return zlib.decompressobj(-zlib.MAX_WBITS).decompress(
+                data, length
+            )
+        return bytes(self.read(name)[:length])
+
+    def read_many(self, names: list, workers: int = None):
+        """Read entries, inflating compressed ones in parallel.
+
+        zlib releases the GIL while inflating, so compressed entries are
+        inflated by a pool of threads, each with its own handle on the
+        archive. Entries are yielded in order as soon as they are ready, so
+        that the decoding of the first pages overlaps with the inflating of
+        the next ones.
+
+        ----------
+        # Parameters
+        names: The names of the entries to read.
+        workers: The number of inflating threads (default: CPU count).
+
+        ----------
+        # Returns
+        A generator of `(name, data)` tuples, in the order of `names`.
+        """
+        workers = workers or os.cpu_count() or 1
+        compressed = [
+            name for name in names
+            if self.entries[name].compress_type != zipfile.ZIP_STORED
+        ]
+        if workers == 1 or len(compressed) < 2:
+            for name in names:
+                yield name, self.read(name)
+            return
+        local = threading.local()
+        handles = []
+        handles_lock = threading.Lock()
+
+        def inflate(name):
+            # One handle per worker: no shared file position nor mapping
+            if not hasattr(local, 'reader'):
+                local.reader = type(self)(self.path, self.entries)
+                with handles_lock:
+                    handles.append(local.reader)
+            return local.reader.read(name)
+
+        executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='inflate'
+        )
+        # Bound the pages inflated ahead of the consumer
+        pending = deque()
+        try:
+            queue = iter(compressed)
+            for name in queue:
+                pending.append(executor.submit(inflate, name))
+                if len(pending) >= 2 * workers:
+                    break
+            for name in names:
+                if self.entries[name].compress_type == zipfile.ZIP_STORED:
+                    yield name, self.read(name)
+                    continue
+                data = pending.popleft().result()
+                for next_name in queue:
+                    pending.append(executor.submit(inflate, next_name))
+                    break
+                yield name, data
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            for handle in handles:
+                handle.close()
+
+    def close(self):
+        """Close the archive.
+
+        Views returned by `read()` keep the mapping alive until they are
+        released.
+        """
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Still exported: unmapped once the last view is released
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class ArchiveIndex:
+    """
+    ArchiveIndex class.
+
+    Cache of the pages of the archives, with their offsets, compression
+    types and sizes. Archives are identified by their path, size and
+    modification time, so that a modified archive is indexed again.
+
+    The index of each archive is kept in memory, and in a small JSON file of
+    `cache_dir` to be reused by the next sessions.
+    """
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir
+        self._indexes = {}
+        self._lock = threading.Lock()
+        # Archives opened from their cached index, or indexed
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, path: str) -> CbzReader:
+        """Open an archive, using its cached index if it is up to date.
+
+        ----------
+        # Parameters
+        path: The path of the archive.
+
+        ----------
+        # Returns
+        A CbzReader whose entries are the pages, in reading order.
+        """
+        # Not the cached status: an archive rewritten within the TTL (e.g.
+        # by the optimizer) must not be read with its previous index
+        stat = storage.stat(path, fresh=True)
+        identity = [absolute(path), stat.st_size, stat.st_mtime_ns]
+        with self._lock:
+            entries = self._indexes.get(identity[0])
+            if entries is not None and entries[0] != identity:
+                entries = None
+        if entries is None:
+            entries = self._load(identity)
+        if entries is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        reader_class = CbzReader
+        if is_url(path):
+            try:
+                from .remote import RemoteCbzReader
+            except ImportError:
+                from remote import RemoteCbzReader
+            reader_class = RemoteCbzReader
+        if entries is not None:
+            return reader_class(path, dict(entries[1]))
+        # Not indexed yet: parse the central directory
+        reader = reader_class(path)
+        pages = {}
+        for name in reader.pages():
+            entry = reader.entries[name]
+            # Remote offsets are read along with the pages
+            if not is_url(path):
+                reader._data_offset(entry)
+            pages[name] = entry
+        reader.entries = pages
+        self._store(identity, pages)
+        return reader
+
+    def _cache_path(self, path: str) -> str:
+        """Get the path of the cache file of an archive."""
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{digest}.json')
+
+    def _load(self, identity: list):
+        """Load the index of an archive from the cache directory."""
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(
+                self._cache_path(identity[0]), 'r', encoding='utf-8'
+            ) as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if cached.get('identity') != identity:
+            return None
+        try:
+            # Recently used, for the cache pruning
+            os.utime(self._cache_path(identity[0]))
+        except OSError:
+            pass
+        entries = (
+            identity,
+            {
+                values[0]: ArchiveEntry(*values)
+                for values in cached['entries']
+            }
+        )
+        with self._lock:
+            self._indexes[identity[0]] = entries
+        return entries
+
+    def _store(self, identity: list, pages: dict):
+        """Store the index of an archive, in memory and on disk."""
+        with self._lock:
+            self._indexes[identity[0]] = (identity, dict(pages))
+        if self.cache_dir is None:
+            return
+        cached = {
+            'identity': identity,
+            'entries': [
+                [
+                    entry.name, entry.header_offset, entry.compress_type,
+                    entry.compress_size, entry.file_size, entry.data_offset
+                ]
+                for entry in pages.values()
+            ],
+        }
+        path = self._cache_path(identity[0])
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write atomically, a concurrent reader never sees half a file
+            with open(path + '.tmp', 'w', encoding='utf-8') as file:
+                json.dump(cached, file)
+            os.replace(path + '.tmp', path)
+        except OSError as error:
+            print(f'[WARNING] Cannot cache the index of {identity[0]}:',
+                  error)
+
+    def invalidate(self, path: str):
+        """Forget the index of an archive."""
+        path = absolute(path)
+        with self._lock:
+            self._indexes.pop(path, None)
+        if self.cache_dir is not None:
+            try:
+                os.remove(self._cache_path(path))
+            except OSError:
+                pass
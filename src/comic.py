@@ -5,11 +5,12 @@ This class contains utility methods about the comic.
 """
 
 
-import os
 try:
     from .metadata import Metadata
+    from .storage import storage
 except ImportError:
     from metadata import Metadata
+    from storage import storage
 
 
 class Comic:
@@ -20,8 +21,8 @@ class Comic:
     """
     def __init__(self, path):
         self.path = path
-        self.name = os.path.basename(path)
-        self.metadata = Metadata(os.path.join(path, '.metadata.json'))
+        self.name = storage.basename(path)
+        self.metadata = Metadata(storage.metadata_path(path))
 
     def get_last_chapter(self) -> str:
         """Get the last chapter for a comic."""
@@ -33,7 +34,7 @@ class Comic:
 
     def get_chapter_path(self, chapter: str) -> str:
         """Get the path to a chapter."""
-        return os.path.join(self.path, chapter)
+        return storage.join(self.path, chapter)
 
     def get_chapter_last_position(self) -> int:
         """Get the last page for a chapter."""
@@ -43,6 +44,22 @@ class Comic:
         """Set the last page for a chapter."""
         self.metadata['last_position'] = position
 
+    def get_chapter_last_page(self) -> list:
+        """Get the last page for a chapter, as [page index, fraction]."""
+        return self.metadata['last_page']
+
+    def set_chapter_progression(self, position: int, page: list):
+        """Set the last position and page for a chapter."""
+        self.metadata.update({'last_position': position, 'last_page': page})
+
+    def get_filler_pages(self, chapter: str) -> list:
+        """Get the filler pages (credits, ...) of a chapter."""
+        return (self.metadata.get('filler_pages') or {}).get(chapter, [])
+
+    def set_filler_pages(self, pages: dict):
+        """Set the filler pages of the chapters, as {chapter: [pages]}."""
+        self.metadata['filler_pages'] = pages
+
     def save(self):
         """Save the metadata to the JSON file."""
         self.metadata.save()
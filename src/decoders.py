@@ -0,0 +1,301 @@
+"""
+Decoders module.
+
+To decode the pages with the fastest available backend.
+
+Two backends are available:
+- `qt`: QImage, always available,
+- `pillow`: Pillow, which can use the DCT scaling of libjpeg-turbo (draft
+  mode) to decode large JPEG pages directly at a reduced size.
+
+Backends return a QImage, so decoding can run outside of the GUI thread.
+The backend used for each format is chosen by a quick benchmark, on the first
+pages decoded, and saved in the `decoders` setting, where it can be
+overridden (e.g. `"decoders": {"jpeg": "pillow", "png": "qt"}`).
+
+Decoded pages are stored in the most compact pixel format: grayscale pages
+(most manga pages, up to some JPEG color noise) in 8 bits per pixel, and
+opaque color pages in 24 bits, instead of 32 bits.
+"""
+
+import abc
+import io
+import os
+import time
+from PyQt5 import QtCore, QtGui
+try:
+    from .tracing import tracer
+except ImportError:
+    from tracing import tracer
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Formats of the page extensions
+EXTENSION_FORMATS = {
+    '.jpg': 'jpeg',
+    '.jpeg': 'jpeg',
+    '.png': 'png',
+    '.webp': 'webp',
+    '.gif': 'gif',
+}
+
+
+def sniff_format(data) -> str:
+    """Get the format of an image from its first bytes.
+
+    ----------
+    # Returns
+    `jpeg`, `png`, `webp`, `gif`, or None if the format is unknown.
+    """
+    head = bytes(data[:12])
+    if head.startswith(b'\xff\xd8'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG'):
+        return 'png'
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'webp'
+    if head.startswith(b'GIF8'):
+        return 'gif'
+    return None
+
+
+def scaled_size(data, width: int) -> QtCore.QSize:
+    """Get the size of an image scaled to `width`, from its header only.
+
+    ----------
+    # Returns
+    The scaled size, invalid if the header cannot be read.
+    """
+    buffer = QtCore.QBuffer()
+    # The size is at the start of the image, but may follow large metadata
+    for length in (64 * 1024, len(data)):
+        buffer.setData(QtCore.QByteArray(bytes(data[:length])))
+        size = QtGui.QImageReader(buffer).size()
+        if size.isValid() and size.width() > 0:
+            return QtCore.QSize(
+                width, max(round(size.height() * width / size.width()), 1)
+            )
+    return QtCore.QSize()
+
+
+def is_grayscale(image: QtGui.QImage, tolerance: int = 8) -> bool:
+    """Tell if an opaque image is grayscale, up to `tolerance` (the
+    difference between the channels of a pixel) for 99.9% of its pixels."""
+    if np is None:
+        # Exact test only
+        return image.allGray()
+    image = image.convertToFormat(QtGui.QImage.Format_RGB888)
+    pointer = image.constBits()
+    pointer.setsize(image.sizeInBytes())
+    pixels = np.frombuffer(pointer, np.uint8).reshape(
+        image.height(), image.bytesPerLine()
+    )[:, :image.width() * 3].reshape(image.height(), image.width(), 3)
+    # One pixel out of four is enough
+    pixels = pixels[::2, ::2]
+    spread = pixels.max(axis=2) - pixels.min(axis=2)
+    return np.count_nonzero(spread > tolerance) <= spread.size * 0.001
+
+
+def compact(image: QtGui.QImage, tolerance: int = 8) -> QtGui.QImage:
+    """Convert an image to its most compact pixel format: 8 bits for
+    grayscale images, 24 bits for opaque color images."""
+    # Transparent images are kept as is, and 8-bit ones are compact already
+    if image.isNull() or image.hasAlphaChannel() or image.depth() <= 8:
+        return image
+    if is_grayscale(image, tolerance):
+        return image.convertToFormat(QtGui.QImage.Format_Grayscale8)
+    return image.convertToFormat(QtGui.QImage.Format_RGB888)
+
+
+def to_pixmap(image: QtGui.QImage) -> QtGui.QPixmap:
+    """Convert an image to a pixmap, keeping its pixel format."""
+    return QtGui.QPixmap.fromImage(image, QtCore.Qt.NoFormatConversion)
+
+
+class Decoder(abc.ABC):
+    """
+    Decoder class.
+
+    Base class of the decoder backends.
+    """
+    name = None
+
+    def available(self) -> bool:
+        """Tell if the backend can be used."""
+        return True
+
+    @abc.abstractmethod
+    def decode(self, data, width: int) -> QtGui.QImage:
+        """Decode an image and scale it to `width`.
+
+        ----------
+        # Parameters
+        data: The encoded image (bytes-like object).
+        width: The width of the decoded image.
+
+        ----------
+        # Returns
+        The decoded image, null if it cannot be decoded.
+        """
+
+
+class QtDecoder(Decoder):
+    """Decoder using QImage."""
+    name = 'qt'
+
+    def decode(self, data, width: int) -> QtGui.QImage:
+        with tracer.span('decode', backend=self.name):
+            image = QtGui.QImage.fromData(data)
+        if image.isNull():
+            return image
+        # Fit image to width
+        with tracer.span('scale', width=width):
+            return image.scaledToWidth(width)
+
+
+class PillowDecoder(Decoder):
+    """Decoder using Pillow, with the draft mode for JPEG."""
+    name = 'pillow'
+
+    def available(self) -> bool:
+        return Image is not None
+
+    def decode(self, data, width: int) -> QtGui.QImage:
+        with tracer.span('decode', backend=self.name):
+            try:
+                image = Image.open(io.BytesIO(data))
+                # Let libjpeg decode at the smallest scale above width
+                image.draft(
+                    'RGB',
+                    (width, image.height * width // max(image.width, 1))
+                )
+                image.load()
+            except (OSError, ValueError):
+                return QtGui.QImage()
+        # Fit image to width
+        with tracer.span('scale', width=width):
+            if image.width != width:
+                height = round(image.height * width / image.width)
+                image = image.resize((width, max(height, 1)), Image.BILINEAR)
+            if image.mode == 'L':
+                qt_format = QtGui.QImage.Format_Grayscale8
+            elif image.mode in ('RGBA', 'LA', 'PA') or (
+                image.mode == 'P' and 'transparency' in image.info
+            ):
+                image = image.convert('RGBA')
+                qt_format = QtGui.QImage.Format_RGBA8888
+            else:
+                image = image.convert('RGB')
+                qt_format = QtGui.QImage.Format_RGB888
+            pixels = image.tobytes()
+            bytes_per_line = len(pixels) // image.height
+            # Copy, so that the QImage owns its pixels
+            return QtGui.QImage(
+                pixels, image.width, image.height, bytes_per_line, qt_format
+            ).copy()
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (QtDecoder(), PillowDecoder())
+    if backend.available()
+}
+
+
+class DecoderSelector:
+    """
+    DecoderSelector class.
+
+    Decodes images with the backend chosen for their format.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+
+    def choices(self) -> dict:
+        """Get the backend chosen for each format."""
+        return self.settings.get('decoders') or {}
+
+    def backend(self, image_format: str) -> Decoder:
+        """Get the backend of a format (Qt if none was chosen)."""
+        return BACKENDS.get(
+            self.choices().get(image_format), BACKENDS['qt']
+        )
+
+    def decode(self, data, width: int) -> QtGui.QImage:
+        """Decode an image and scale it to `width`, see `Decoder.decode`.
+
+        The image is converted to its most compact pixel format, unless the
+        `viewer.compact_pixels` setting is false.
+        """
+        image = self.backend(sniff_format(data)).decode(data, width)
+        viewer = self.settings.get('viewer') or {}
+        if not viewer.get('compact_pixels', True):
+            return image
+        with tracer.span('compact'):
+            return compact(image, viewer.get('gray_tolerance', 8))
+
+    def uncalibrated(self, names: list) -> list:
+        """Get a page of each format with no backend chosen yet (from the
+        extensions, so that no page is read once all are chosen)."""
+        choices = self.choices()
+        pages = {}
+        for name in names:
+            image_format = EXTENSION_FORMATS.get(
+                os.path.splitext(name)[1].lower()
+            )
+            if image_format is not None and image_format not in choices:
+                pages.setdefault(image_format, name)
+        return list(pages.values())
+
+    def choose(self, choices: dict):
+        """Save the backends chosen for some formats (in the GUI thread)."""
+        self.settings['decoders'] = {**self.choices(), **choices}
+
+    def benchmark(self, samples: list, width: int, repeat: int = 3) -> dict:
+        """Time the backends on the formats not chosen yet.
+
+        ----------
+        # Parameters
+        samples: Encoded images, of any formats.
+        width: The width the images are decoded at.
+        repeat: The number of decodings timed per backend.
+
+        ----------
+        # Returns
+        The fastest backend of each of these formats.
+        """
+        choices = self.choices()
+        # One sample per format still to choose
+        by_format = {}
+        for data in samples:
+            image_format = sniff_format(data)
+            if image_format is not None and image_format not in choices:
+                by_format.setdefault(image_format, data)
+        chosen = {}
+        for image_format, data in by_format.items():
+            timings = {}
+            for name, backend in BACKENDS.items():
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    image = backend.decode(data, width)
+                if not image.isNull():
+                    timings[name] = time.perf_counter() - start
+            if timings:
+                chosen[image_format] = min(timings, key=timings.get)
+                print(f"[INFO] Decoder for {image_format}: "
+                      f"{chosen[image_format]} ({timings})")
+        return chosen
+
+    def calibrate(self, samples: list, width: int, repeat: int = 3):
+        """Choose the fastest backend for the formats not chosen yet, see
+        `benchmark`."""
+        chosen = self.benchmark(samples, width, repeat)
+        if chosen:
+            self.choose(chosen)
@@ -0,0 +1,414 @@
+"""
+Duplicates module.
+
+To find the duplicated chapters and the recurring filler pages (credits,
+recruitment pages, ...) of the library.
+
+Every page is given a 64-bit difference hash (dHash): the page is decoded in
+grayscale at a reduced size (JPEG draft mode), downscaled to 9x8 by area
+averaging, and each bit tells if a pixel is brighter than its right
+neighbour. Downscaling and hashing are vectorized with NumPy over all the
+pages of a chapter, and chapters are hashed in parallel by a pool of
+processes. Hashes are cached by archive (path, size and modification time).
+
+Pages whose hashes differ by a few bits at most are considered the same.
+- Chapters sharing most of their pages are reported as duplicates.
+- Pages found in many chapters of a comic are reported as filler pages, and
+  can be recorded in the metadata of the comic (`filler_pages`) so that the
+  viewer skips them (`viewer.skip_filler` setting).
+
+Usage:
+    python -m src.duplicates [--mark-filler] [--output report.json]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+try:
+    from .archive import ArchiveIndex, natural_key
+    from .comic import Comic
+    from .settings import Settings
+except ImportError:
+    from archive import ArchiveIndex, natural_key
+    from comic import Comic
+    from settings import Settings
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+
+# Size of the thumbnails hashed (one more column for the differences)
+HASH_HEIGHT = 8
+HASH_WIDTH = 9
+# Memory of a block of the distance matrix, in bytes
+BLOCK_BYTES = 64 * 2**20
+# Bits set in each byte value, without `np.bitwise_count` (NumPy < 2)
+POPCOUNT = None if np is None else np.array(
+    [bin(value).count('1') for value in range(256)], dtype=np.uint8
+)
+
+
+def _thumbnail(data):
+    """Decode a page in grayscale, downscaled to HASH_HEIGHT x HASH_WIDTH.
+
+    ----------
+    # Returns
+    The thumbnail as a float32 array, or None if the page cannot be decoded.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Let libjpeg decode at a reduced size
+        image.draft('L', (HASH_WIDTH * 8, HASH_HEIGHT * 8))
+        pixels = np.asarray(image.convert('L'), dtype=np.uint32)
+    except (OSError, ValueError):
+        return None
+    if pixels.shape[0] < HASH_HEIGHT or pixels.shape[1] < HASH_WIDTH:
+        return None
+    # Area averaging: sum of the blocks, divided by their sizes
+    rows = np.linspace(0, pixels.shape[0], HASH_HEIGHT + 1).astype(int)
+    cols = np.linspace(0, pixels.shape[1], HASH_WIDTH + 1).astype(int)
+    sums = np.add.reduceat(
+        np.add.reduceat(pixels, rows[:-1], axis=0), cols[:-1], axis=1
+    )
+    return (sums / np.outer(np.diff(rows), np.diff(cols))).astype(np.float32)
+
+
+def dhash(thumbnails) -> list:
+    """Hash a batch of thumbnails.
+
+    ----------
+    # Parameters
+    thumbnails: An array of shape (N, HASH_HEIGHT, HASH_WIDTH).
+
+    ----------
+    # Returns
+    The N 64-bit hashes, as integers.
+    """
+    bits = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(thumbnails), -1), axis=1)
+    return [int(value) for value in packed.view('>u8').ravel()]
+
+
+def hash_chapter(path: str) -> tuple:
+    """Hash the pages of a chapter.
+
+    ----------
+    # Returns
+    The path of the chapter, and the names and hashes of its pages (the
+    pages which cannot be decoded are left out).
+    """
+    with ArchiveIndex().open(path) as reader:
+        names = []
+        thumbnails = []
+        for name in reader.namelist():
+            if name.lower().endswith('.webm'):
+                continue
+            thumbnail = _thumbnail(reader.read(name))
+            if thumbnail is not None:
+                names.append(name)
+                thumbnails.append(thumbnail)
+    if not thumbnails:
+        return path, [], []
+    return path, names, dhash(np.stack(thumbnails))
+
+
+def hamming(hashes, others) -> object:
+    """Get the Hamming distances between two arrays of uint64 hashes.
+
+    ----------
+    # Returns
+    An array of shape (len(hashes), len(others)), of uint8.
+    """
+    xor = np.bitwise_xor.outer(hashes, others)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    return POPCOUNT[xor.view(np.uint8)].reshape(*xor.shape, 8).sum(
+        axis=-1, dtype=np.uint8
+    )
+
+
+def _clusters(hashes: list, distance: int) -> list:
+    """Group hashes differing by at most `distance` bits.
+
+    ----------
+    # Returns
+    The cluster of each hash (the index of its first similar hash).
+    """
+    values = np.array(hashes, dtype=np.uint64)
+    clusters = list(range(len(values)))
+    # Blocks of rows, to bound the memory of the distance matrix (16 bytes
+    # per distance, at most, while computing it)
+    rows = max(BLOCK_BYTES // (16 * max(len(values), 1)), 1)
+    for start in range(0, len(values), rows):
+        block = hamming(values[start:start + rows], values)
+        for offset, row in enumerate(block):
+            index = start + offset
+            if clusters[index] != index:
+                continue
+            for similar in np.nonzero(row <= distance)[0]:
+                if similar > index and clusters[similar] == similar:
+                    clusters[similar] = index
+    return clusters
+
+
+class DuplicateFinder:
+    """
+    DuplicateFinder class.
+
+    Hashes the pages of the library, and finds duplicates in them.
+    """
+    def __init__(self, comics_dir: str, cache_dir: str = None,
+                 workers: int = None):
+        self.comics_dir = comics_dir
+        self.cache_dir = cache_dir
+        self.workers = workers
+        # Names and hashes of the pages, by chapter path
+        self.hashes = {}
+
+    def _cache_path(self, path: str) -> str:
+        """Get the path of the cached hashes of a chapter."""
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{digest}.json')
+
+    @staticmethod
+    def _identity(path: str) -> list:
+        """Get the identity of a chapter."""
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+    def _load_cached(self, path: str) -> bool:
+        """Load the cached hashes of a chapter, if up to date."""
+        if self.cache_dir is None:
+            return False
+        try:
+            with open(self._cache_path(path), 'r', encoding='utf-8') as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if cached.get('identity') != self._identity(path):
+            return False
+        try:
+            # Recently used, for the cache pruning
+            os.utime(self._cache_path(path))
+        except OSError:
+            pass
+        self.hashes[path] = (
+            cached['names'], [int(value, 16) for value in cached['hashes']]
+        )
+        return True
+
+    def _store(self, path: str, names: list, hashes: list):
+        """Cache the hashes of a chapter."""
+        self.hashes[path] = (names, hashes)
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = self._cache_path(path)
+        with open(cache_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({
+                'identity': self._identity(path),
+                'names': names,
+                'hashes': [f'{value:016x}' for value in hashes],
+            }, file)
+        os.replace(cache_path + '.tmp', cache_path)
+
+    def chapters(self) -> dict:
+        """List the chapters of the library, by comic."""
+        chapters = {}
+        for comic in sorted(os.listdir(self.comics_dir), key=natural_key):
+            comic_path = os.path.join(self.comics_dir, comic)
+            if comic.startswith('.') or not os.path.isdir(comic_path):
+                continue
+            chapters[comic] = [
+                os.path.join(comic_path, chapter)
+                for chapter in sorted(os.listdir(comic_path), key=natural_key)
+                if chapter.endswith('.cbz')
+            ]
+        return chapters
+
+    def hash_library(self):
+        """Hash the pages of all the chapters not cached yet."""
+        paths = [
+            path
+            for paths in self.chapters().values()
+            for path in paths
+            if not self._load_cached(path)
+        ]
+        print(f'[INFO] {len(paths)} chapters to hash.')
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(hash_chapter, path) for path in paths]
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    path, names, hashes = future.result()
+                except Exception as error:
+                    # e.g. a corrupt archive: the other chapters go on
+                    print(f'[ERROR] {error}')
+                    continue
+                self._store(path, names, hashes)
+                print(f'[INFO] ({done}/{len(paths)}) {path}')
+
+    def hash_chapters(self, paths: list):
+        """Hash the pages of chapters not cached yet, in this process.
+
+        A generator, one chapter per step, to run as a background job of
+        the viewer.
+        """
+        for path in paths:
+            if not self._load_cached(path):
+                try:
+                    self._store(*hash_chapter(path))
+                except Exception as error:
+                    # e.g. a corrupt archive: the other chapters go on
+                    print(f'[WARNING] Cannot hash {path}: {error}')
+            yield
+
+    def duplicate_chapters(self, distance: int = 4,
+                           ratio: float = 0.9) -> list:
+        """Find the chapters sharing most of their pages.
+
+        ----------
+        # Returns
+        Pairs of chapters, with the ratio of their pages in common.
+        """
+        paths = [path for path in self.hashes if self.hashes[path][1]]
+        all_hashes = [
+            value for path in paths for value in self.hashes[path][1]
+        ]
+        if not all_hashes:
+            return []
+        clusters = _clusters(all_hashes, distance)
+        # Chapters of each cluster of pages
+        chapter_clusters = []
+        position = 0
+        for path in paths:
+            count = len(self.hashes[path][1])
+            chapter_clusters.append(set(clusters[position:position + count]))
+            position += count
+        by_cluster = {}
+        for index, page_clusters in enumerate(chapter_clusters):
+            for cluster in page_clusters:
+                by_cluster.setdefault(cluster, set()).add(index)
+        # Count the clusters shared by each pair of chapters
+        shared = {}
+        for indexes in by_cluster.values():
+            indexes = sorted(indexes)
+            for position, first in enumerate(indexes):
+                for second in indexes[position + 1:]:
+                    shared[first, second] = shared.get((first, second), 0) + 1
+        duplicates = []
+        for (first, second), count in shared.items():
+            common = count / max(
+                min(len(chapter_clusters[first]),
+                    len(chapter_clusters[second])),
+                1
+            )
+            if common >= ratio:
+                duplicates.append([paths[first], paths[second], common])
+        return sorted(duplicates)
+
+    def filler_pages(self, distance: int = 4,
+                     min_chapters: int = 3) -> dict:
+        """Find the pages recurring in many chapters of each comic.
+
+        ----------
+        # Returns
+        The filler pages of each comic, as {comic: {chapter: [pages]}}.
+        """
+        fillers = {}
+        for comic, paths in self.chapters().items():
+            pages = [
+                (os.path.basename(path), name, value)
+                for path in paths if path in self.hashes
+                for name, value in zip(*self.hashes[path])
+            ]
+            if not pages:
+                continue
+            clusters = _clusters([page[2] for page in pages], distance)
+            chapters_of = {}
+            for (chapter, _, _), cluster in zip(pages, clusters):
+                chapters_of.setdefault(cluster, set()).add(chapter)
+            for (chapter, name, _), cluster in zip(pages, clusters):
+                if len(chapters_of[cluster]) >= min_chapters:
+                    fillers.setdefault(comic, {}).setdefault(
+                        chapter, []
+                    ).append(name)
+        return fillers
+
+    def mark_filler(self, fillers: dict):
+        """Record the filler pages in the metadata of the comics."""
+        for comic, pages in fillers.items():
+            Comic(os.path.join(self.comics_dir, comic)).set_filler_pages(
+                pages
+            )
+
+
+def main(argv: list = None):
+    """Find duplicates in the library from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Find duplicated chapters and filler pages.'
+    )
+    parser.add_argument(
+        'comics_dir', nargs='?',
+        help='comics directory (default: comics_dir of comic_reader.ini)'
+    )
+    parser.add_argument(
+        '--distance', type=int, default=4,
+        help='maximum number of different bits of similar pages (default: 4)'
+    )
+    parser.add_argument(
+        '--min-chapters', type=int, default=3,
+        help='minimum number of chapters of a filler page (default: 3)'
+    )
+    parser.add_argument(
+        '--workers', type=int,
+        help='number of processes (default: CPU count)'
+    )
+    parser.add_argument(
+        '--mark-filler', action='store_true',
+        help='record the filler pages, for the viewer to skip them'
+    )
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args(argv)
+    if np is None:
+        print('Please install numpy and Pillow from pip.')
+        sys.exit(1)
+    working_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    comics_dir = args.comics_dir
+    if comics_dir is None:
+        comics_dir = Settings(
+            os.path.join(working_dir, 'comic_reader.ini')
+        )['comics_dir']
+    finder = DuplicateFinder(
+        comics_dir, os.path.join(working_dir, 'cache', 'hashes'), args.workers
+    )
+    finder.hash_library()
+    report = {
+        'duplicate_chapters': finder.duplicate_chapters(args.distance),
+        'filler_pages': finder.filler_pages(
+            args.distance, args.min_chapters
+        ),
+    }
+    print('[INFO] Duplicate chapters')
+    for first, second, common in report['duplicate_chapters']:
+        print(f'- {first} = {second} ({common:.0%})')
+    print('[INFO] Filler pages')
+    for comic, chapters in report['filler_pages'].items():
+        count = sum(len(pages) for pages in chapters.values())
+        print(f'- {comic}: {count} pages in {len(chapters)} chapters')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+    if args.mark_filler:
+        finder.mark_filler(report['filler_pages'])
+        print('[INFO] Filler pages recorded in the metadata of the comics.')
+
+
+if __name__ == '__main__':
+    main()
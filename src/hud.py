@@ -0,0 +1,116 @@
+"""
+HUD module.
+
+To show live performance figures over the viewer.
+
+The overlay tells where the time goes while reading: the frame rate and the
+longest frame of the last second of scrolling, and the figures given by the
+viewer (time to first page, pages queued for cropping and levels, cache hit
+rates, resident memory).
+It is refreshed twice a second while shown. Hidden, it costs nothing: its
+timer is stopped and the frames are not counted.
+"""
+
+import time
+from collections import deque
+from PyQt5 import QtCore, QtWidgets
+
+
+def hit_rate(hits: int, misses: int) -> str:
+    """Format a cache hit rate, with the number of lookups."""
+    lookups = hits + misses
+    if not lookups:
+        return '-'
+    return f'{100 * hits // lookups}% of {lookups}'
+
+
+class PerformanceHud:
+    """
+    PerformanceHud class.
+
+    Overlay in the bottom-left corner of `parent`. Frames are counted from
+    the changes of `scrollbar`, and `stats()` gives the other lines, as
+    (name, value) tuples.
+    """
+    def __init__(self, parent: QtWidgets.QWidget,
+                 scrollbar: QtWidgets.QScrollBar, stats,
+                 interval: int = 500):
+        self.scrollbar = scrollbar
+        self.stats = stats
+        # Timestamps of the last frames
+        self._frames = deque(maxlen=512)
+
+        self.label = QtWidgets.QLabel(parent)
+        self.label.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.label.setStyleSheet(
+            'background-color: rgba(0, 0, 0, 160); color: #ffffff;'
+            'font-family: monospace; padding: 6px;'
+        )
+        self.label.hide()
+        self._timer = QtCore.QTimer()
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self.refresh)
+
+    def is_shown(self) -> bool:
+        """Tell if the overlay is shown."""
+        return not self.label.isHidden()
+
+    def toggle(self):
+        """Show or hide the overlay."""
+        if self.is_shown():
+            self.hide()
+        else:
+            self.show()
+
+    def show(self):
+        """Show the overlay, and start counting the frames."""
+        if self.is_shown():
+            return
+        self._frames.clear()
+        self.scrollbar.valueChanged.connect(self._frame)
+        self._timer.start()
+        self.label.show()
+        self.label.raise_()
+        self.refresh()
+
+    def hide(self):
+        """Hide the overlay, and stop counting the frames."""
+        if not self.is_shown():
+            return
+        self._timer.stop()
+        self.scrollbar.valueChanged.disconnect(self._frame)
+        self.label.hide()
+
+    def _frame(self, _value: int):
+        """Count a frame (the scroller moved)."""
+        self._frames.append(time.perf_counter())
+
+    def frame_rate(self) -> tuple:
+        """Get the frame rate of the last second of scrolling.
+
+        ----------
+        # Returns
+        The frames per second and the longest frame (in ms), or None if
+        the viewer did not scroll.
+        """
+        now = time.perf_counter()
+        frames = [frame for frame in self._frames if now - frame <= 1.0]
+        if len(frames) < 2:
+            return None
+        longest = max(
+            after - before for before, after in zip(frames, frames[1:])
+        )
+        return (len(frames) - 1) / (frames[-1] - frames[0]), longest * 1000
+
+    def refresh(self):
+        """Update the figures."""
+        rate = self.frame_rate()
+        if rate is None:
+            lines = ['FPS: idle']
+        else:
+            lines = [f'FPS: {rate[0]:.0f} (longest frame {rate[1]:.0f} ms)']
+        lines += [f'{name}: {value}' for name, value in self.stats()]
+        self.label.setText('\n'.join(lines))
+        self.label.adjustSize()
+        parent = self.label.parentWidget()
+        self.label.move(8, parent.height() - self.label.height() - 8)
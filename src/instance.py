@@ -0,0 +1,157 @@
+"""
+Instance module.
+
+To run a single instance of the app per working directory.
+
+A launch first takes a lock file. If another instance holds it, the launch
+sends its request (`show` for now) to the local server of that instance (a
+Unix socket, or a named pipe on Windows) and exits: the running instance
+raises its window, with its library, index and caches still warm, and no two
+instances race on the settings or the metadata files. The lock, and not the
+server, tells which instance runs: Windows lets several servers listen on
+the same pipe name. The lock of a crashed instance is stale (its process is
+gone) and taken over; the server of a running one never is, even when it is
+too busy to answer at once.
+
+Requests are JSON objects, one per line.
+"""
+
+import getpass
+import hashlib
+import json
+import os
+import tempfile
+import time
+from PyQt5 import QtCore, QtNetwork
+
+
+# Time to wait for the running instance, in ms
+TIMEOUT = 5000
+# Interval of the attempts to reach a running instance starting its server,
+# in seconds
+RETRY_INTERVAL = 0.1
+
+
+def server_name(working_dir: str) -> str:
+    """Get the name of the local server, per user and working directory."""
+    digest = hashlib.sha1(working_dir.encode('utf-8')).hexdigest()[:12]
+    return f'comic_reader-{getpass.getuser()}-{digest}'
+
+
+def forward(name: str, request: dict, timeout: int = TIMEOUT) -> bool:
+    """Send a request to the running instance.
+
+    ----------
+    # Returns
+    True if the running instance got the request, False if there is none
+    (no server, or the server of a crashed instance). Raises TimeoutError if
+    it does not answer in time.
+    """
+    socket = QtNetwork.QLocalSocket()
+    socket.connectToServer(name)
+    if socket.waitForConnected(timeout):
+        socket.write(json.dumps(request).encode('utf-8') + b'\n')
+        if socket.waitForBytesWritten(timeout):
+            socket.disconnectFromServer()
+            return True
+    if socket.error() == QtNetwork.QLocalSocket.SocketTimeoutError:
+        raise TimeoutError(
+            f'The running instance does not answer: {socket.errorString()}'
+        )
+    return False
+
+
+def claim(name: str, request: dict, timeout: int = TIMEOUT):
+    """Become the running instance, or hand `request` over to it.
+
+    ----------
+    # Returns
+    The started server if this process is the running instance, None if
+    the running instance got the request. Raises TimeoutError if the
+    running instance does not answer in time.
+    """
+    lock = QtCore.QLockFile(
+        os.path.join(tempfile.gettempdir(), name + '.lock')
+    )
+    # Held as long as the instance runs: only a dead holder makes it stale
+    lock.setStaleLockTime(0)
+    deadline = time.monotonic() + timeout / 1000
+    while True:
+        if lock.tryLock(0):
+            server = InstanceServer(name, lock)
+            # Left by a crashed instance, since the lock was free
+            QtNetwork.QLocalServer.removeServer(name)
+            break
+        if lock.error() != QtCore.QLockFile.LockFailedError:
+            print('[WARNING] Cannot create the instance lock, several '
+                  'instances may run.')
+            server = InstanceServer(name)
+            break
+        if forward(name, request, timeout):
+            return None
+        # The running instance is still starting its server (or quitting)
+        if time.monotonic() > deadline:
+            raise TimeoutError('The running instance does not listen.')
+        time.sleep(RETRY_INTERVAL)
+    if not server.listen():
+        print(f'[WARNING] Cannot start the instance server: '
+              f'{server.server.errorString()}')
+    return server
+
+
+class InstanceServer(QtCore.QObject):
+    """
+    InstanceServer class.
+
+    Local server of the running instance; emits `requested` with each
+    request of another launch (in the GUI thread). Holds the instance lock
+    until it is closed.
+    """
+    requested = QtCore.pyqtSignal(dict)
+
+    def __init__(self, name: str, lock: QtCore.QLockFile = None):
+        super().__init__()
+        self.name = name
+        self.lock = lock
+        self.server = QtNetwork.QLocalServer()
+        self.server.newConnection.connect(self._connection)
+        # Data received from each connection, until its end of line
+        self._buffers = {}
+
+    def listen(self) -> bool:
+        """Start the server."""
+        return self.server.listen(self.name)
+
+    def close(self):
+        """Stop the server, and release the instance lock."""
+        self.server.close()
+        if self.lock is not None:
+            self.lock.unlock()
+
+    def _connection(self):
+        """Read the requests of a new connection."""
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            self._buffers[socket] = b''
+            socket.readyRead.connect(lambda s=socket: self._read(s))
+            socket.disconnected.connect(lambda s=socket: self._close(s))
+
+    def _read(self, socket: QtNetwork.QLocalSocket):
+        """Emit the complete requests received from a connection."""
+        self._buffers[socket] += bytes(socket.readAll())
+        *lines, self._buffers[socket] = self._buffers[socket].split(b'\n')
+        for line in lines:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                print(f'[WARNING] Invalid instance request: {line!r}')
+                continue
+            if isinstance(request, dict):
+                self.requested.emit(request)
+
+    def _close(self, socket: QtNetwork.QLocalSocket):
+        """Forget a closed connection."""
+        if socket.bytesAvailable():
+            self._read(socket)
+        self._buffers.pop(socket, None)
+        socket.deleteLater()
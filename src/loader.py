@@ -0,0 +1,177 @@
+"""
+Loader module.
+
+To open chapters in a worker thread, as cancellable jobs.
+
+Opening a chapter reads its archive and the start of each of its pages (the
+header giving the size of the page, to lay the pages out before they are
+decoded), which can take a while on slow
+disks, network shares or remote libraries. A chapter is loaded in a worker
+thread, and only the latest chapter requested is displayed: requesting
+another chapter cancels the job in flight, which stops between two pages,
+closes its archive and drops the pages it read.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore
+try:
+    from .tracing import tracer
+except ImportError:
+    from tracing import tracer
+
+
+class LoadCancelled(Exception):
+    """The chapter load was cancelled by a newer one."""
+
+
+class ChapterLoad:
+    """
+    ChapterLoad class.
+
+    A chapter being loaded, and its results once loaded: the open `archive`,
+    the `sizes` of its pages (None in the paged mode), and the `decoders`
+    chosen for formats with no decoder yet.
+
+    Everything the worker needs is captured here, in the GUI thread (e.g.
+    the `filler` pages to skip), so that it never reads the state of the
+    viewer, which may have moved on to another comic.
+    """
+    def __init__(self, chapter: str, chapter_path: str, at_start: bool,
+                 with_sizes: bool, at_end: bool = True,
+                 filler: set = frozenset()):
+        self.chapter = chapter
+        self.chapter_path = chapter_path
+        self.filler = filler
+        # Open at the first page, instead of the last page read
+        self.at_start = at_start
+        self.with_sizes = with_sizes
+        # Added after (or before) the chapters in view, in continuous mode
+        self.at_end = at_end
+        self.start = tracer.now()
+        self.archive = None
+        self.sizes = None
+        self.decoders = {}
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Stop the load as soon as possible."""
+        self._cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        """Tell if the load was cancelled."""
+        return self._cancelled.is_set()
+
+    def check(self):
+        """Raise LoadCancelled if the load was cancelled."""
+        if self._cancelled.is_set():
+            raise LoadCancelled()
+
+
+class ChapterLoader(QtCore.QObject):
+    """
+    ChapterLoader class.
+
+    Loads the chapters in a worker thread, and sends them back to the GUI
+    thread with the `loaded` signal (load), or the `failed` signal (load,
+    error). `open_archive(chapter_path, filler)` opens the archive of a
+    chapter without its filler pages, `page_size(image, data)` gets the size
+    of a page (None if unknown), and `choose_decoders(archive)` benchmarks
+    the decoders on the pages of formats with no decoder yet.
+    """
+    loaded = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, open_archive, page_size, choose_decoders=None):
+        super().__init__()
+        self.open_archive = open_archive
+        self.page_size = page_size
+        self.choose_decoders = choose_decoders
+        # Chapter in flight
+        self.current = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='loader'
+        )
+
+    def load(self, chapter: str, chapter_path: str, at_start: bool = False,
+             with_sizes: bool = True, at_end: bool = True,
+             filler: set = frozenset()) -> ChapterLoad:
+        """Load a chapter, cancelling the chapter in flight."""
+        self.cancel()
+        load = ChapterLoad(
+            chapter, chapter_path, at_start, with_sizes, at_end, filler
+        )
+        self.current = load
+        self._executor.submit(self._load, load)
+        return load
+
+    def cancel(self):
+        """Cancel the chapter in flight, if any."""
+        if self.current is not None:
+            self.current.cancel()
+            self.current = None
+
+    def is_loading(self) -> bool:
+        """Tell if a chapter is in flight."""
+        return self.current is not None
+
+    def finish(self, load: ChapterLoad) -> bool:
+        """Take a loaded chapter (in the GUI thread).
+
+        ----------
+        # Returns
+        False if the chapter was superseded in the meantime (its archive is
+        then closed).
+        """
+        if load is not self.current or load.is_cancelled():
+            if load.archive is not None:
+                load.archive.close()
+            return False
+        self.current = None
+        return True
+
+    def _load(self, load: ChapterLoad):
+        """Open a chapter and read the sizes of its pages (in the worker
+        thread)."""
+        try:
+            load.check()
+            with tracer.span('archive open', path=load.chapter_path):
+                load.archive = self.open_archive(
+                    load.chapter_path, load.filler
+                )
+            if self.choose_decoders is not None:
+                load.check()
+                load.decoders = self.choose_decoders(load.archive)
+            if load.with_sizes:
+                with tracer.span('page sizes', chapter=load.chapter):
+                    load.sizes = self._page_sizes(load)
+            load.check()
+        except LoadCancelled:
+            print(f'[DEBUG] Chapter load cancelled: {load.chapter}')
+            self._discard(load)
+            return
+        except Exception as error:
+            self._discard(load)
+            self.failed.emit(load, error)
+            return
+        self.loaded.emit(load)
+
+    def _page_sizes(self, load: ChapterLoad) -> list:
+        """Read the sizes of the pages of a chapter, from their headers."""
+        sizes = []
+        archive = load.archive
+        for image in archive.namelist():
+            load.check()
+            size = self.page_size(image, archive.read_head(image))
+            if size is None:
+                # Header after large metadata
+                size = self.page_size(image, archive.read(image))
+            sizes.append(size)
+        return sizes
+
+    @staticmethod
+    def _discard(load: ChapterLoad):
+        """Drop the pages read, and close the archive."""
+        if load.archive is not None:
+            load.archive.close()
+            load.archive = None
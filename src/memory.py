@@ -0,0 +1,99 @@
+"""
+Memory module.
+
+To account for the memory used by the pages displayed in the viewer, and to
+enforce a hard memory budget on it.
+"""
+
+from collections import OrderedDict
+
+
+class MemoryBudget:
+    """
+    MemoryBudget class.
+
+    Keeps track of the bytes resident for each page, in least recently used
+    order, and tells which pages must be evicted to stay under the cap.
+
+    Pages are identified by a `(chapter, image name)` key, stable when
+    chapters are added to or dropped from the viewer.
+    """
+    def __init__(self, cap: int):
+        self.cap = cap
+        self._resident = OrderedDict()
+
+    def add(self, key: tuple, nbytes: int):
+        """Record `nbytes` resident for the page `key`."""
+        self._resident[key] = nbytes
+        self._resident.move_to_end(key)
+
+    def resize(self, key: tuple, nbytes: int):
+        """Update the bytes resident for the page `key`, keeping its place
+        in the least recently used order."""
+        if key in self._resident:
+            self._resident[key] = nbytes
+
+    def remove(self, key: tuple):
+        """Forget the page `key` (its pixel data was released)."""
+        self._resident.pop(key, None)
+
+    def touch(self, key: tuple):
+        """Mark the page `key` as recently used."""
+        if key in self._resident:
+            self._resident.move_to_end(key)
+
+    def clear(self, chapter: str = None):
+        """Forget all the pages, or only the pages of `chapter`."""
+        if chapter is None:
+            self._resident.clear()
+            return
+        for key in [key for key in self._resident if key[0] == chapter]:
+            del self._resident[key]
+
+    def is_resident(self, key: tuple) -> bool:
+        """Tell if the pixel data of the page `key` is resident."""
+        return key in self._resident
+
+    def total(self) -> int:
+        """Return the number of bytes resident."""
+        return sum(self._resident.values())
+
+    def victims(self, protected: set = frozenset()) -> list:
+        """Return the pages to evict to get back under the cap.
+
+        ----------
+        # Parameters
+        protected: The pages that must not be evicted (e.g. visible ones).
+
+        ----------
+        # Returns
+        The keys of the pages to evict, least recently used first.
+        """
+        excess = self.total() - self.cap
+        victims = []
+        for key, nbytes in self._resident.items():
+            if excess <= 0:
+                break
+            if key in protected:
+                continue
+            victims.append(key)
+            excess -= nbytes
+        return victims
+
+    def usage(self) -> dict:
+        """Return the current memory usage.
+
+        ----------
+        # Returns
+        A dictionary with the total bytes resident, the cap, the bytes
+        resident per chapter and per page.
+        """
+        chapters = {}
+        for (chapter, _), nbytes in self._resident.items():
+            chapters[chapter] = chapters.get(chapter, 0) + nbytes
+        return {
+            'total': self.total(),
+            'cap': self.cap,
+            'chapters': chapters,
+            'pages': dict(self._resident),
+        }
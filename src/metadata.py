@@ -6,9 +6,12 @@ This class contains utility methods about the metadata.
 For the comics and its chapters.
 """
 
-import os
 import json
 from datetime import datetime
+try:
+    from .storage import storage
+except ImportError:
+    from storage import storage
 
 
 class Metadata:
@@ -26,21 +29,23 @@ class Metadata:
 
     def load(self):
         """Load the metadata from the JSON file."""
-        if not os.path.exists(self._path):
+        # Open directly, a missing file costs no extra round trip
+        try:
+            with storage.open(self._path, 'r', encoding='utf-8') as file:
+                self.metadata = json.load(file)
+        except FileNotFoundError:
             self.metadata = {
                 'last_chapter': None,
                 'last_position': None,
                 'last_updated': datetime.now().isoformat()
             }
             self.save()
-        with open(self._path, 'r', encoding='utf-8') as file:
-            self.metadata = json.load(file)
 
     def save(self):
         """Save the metadata to the JSON file."""
         # Update the last updated time
         self.metadata['last_updated'] = datetime.now().isoformat()
-        with open(self._path, 'w', encoding='utf-8') as file:
+        with storage.open(self._path, 'w', encoding='utf-8') as file:
             json.dump(self.metadata, file, indent=4)
 
     def get(self, key, default=None) -> object:
@@ -69,6 +74,16 @@ class Metadata:
         self.metadata[key] = value
         self.save()
 
+    def update(self, values: dict):
+        """Set several metadata at once, saving only once.
+
+        ----------
+        # Parameters
+        values: The metadata to set, by key.
+        """
+        self.metadata.update(values)
+        self.save()
+
     def __getitem__(self, key):
         return self.get(key)
 
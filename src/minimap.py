@@ -0,0 +1,230 @@
+"""
+Minimap module.
+
+To jump anywhere in a chapter, from a strip of page thumbnails.
+
+The strip lists every page of the chapter in view. Thumbnails are only
+generated once the strip is shown, as a background job, from the current
+page outwards: JPEG pages are decoded directly at the thumbnail
+size (Qt asks libjpeg for a scaled decoding). Thumbnails are cached on disk
+per archive, until the archive changes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from PyQt5 import QtCore, QtGui, QtWidgets
+try:
+    from .scheduler import THUMBNAILS, scheduler
+    from .storage import absolute, storage
+    from .tracing import tracer
+except ImportError:
+    from scheduler import THUMBNAILS, scheduler
+    from storage import absolute, storage
+    from tracing import tracer
+
+
+def thumbnail(data, height: int) -> QtGui.QImage:
+    """Decode an image directly at a reduced size.
+
+    ----------
+    # Returns
+    The image scaled to `height`, null if it cannot be decoded.
+    """
+    buffer = QtCore.QBuffer()
+    buffer.setData(QtCore.QByteArray(bytes(data)))
+    reader = QtGui.QImageReader(buffer)
+    size = reader.size()
+    if size.isValid() and size.height() > height:
+        reader.setScaledSize(size.scaled(
+            QtCore.QSize(size.width(), height), QtCore.Qt.KeepAspectRatio
+        ))
+    return reader.read()
+
+
+class ThumbnailCache:
+    """
+    ThumbnailCache class.
+
+    Thumbnails of the pages on disk, in a directory per archive.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def directory(self, path: str) -> str:
+        """Get the directory of the thumbnails of an archive, emptied if
+        the archive changed since they were generated."""
+        directory = os.path.join(
+            self.cache_dir, hashlib.sha1(path.encode('utf-8')).hexdigest()
+        )
+        stat = storage.stat(path, fresh=True)
+        identity = [absolute(path), stat.st_size, stat.st_mtime_ns]
+        identity_path = os.path.join(directory, 'identity.json')
+        try:
+            with open(identity_path, 'r', encoding='utf-8') as file:
+                is_current = json.load(file) == identity
+            if is_current:
+                # Recently used, for the cache pruning
+                os.utime(identity_path)
+                return directory
+        except (OSError, ValueError):
+            pass
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+        with open(identity_path, 'w', encoding='utf-8') as file:
+            json.dump(identity, file)
+        return directory
+
+    @staticmethod
+    def _path(directory: str, name: str) -> str:
+        """Get the path of the thumbnail of a page."""
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(directory, f'{digest}.jpg')
+
+    def load(self, directory: str, name: str) -> QtGui.QImage:
+        """Get the thumbnail of a page, or None if it is not cached."""
+        path = self._path(directory, name)
+        if not os.path.exists(path):
+            return None
+        image = QtGui.QImage(path)
+        return None if image.isNull() else image
+
+    def store(self, directory: str, name: str, image: QtGui.QImage):
+        """Cache the thumbnail of a page."""
+        path = self._path(directory, name)
+        if image.save(path + '.tmp', 'JPG', 80):
+            os.replace(path + '.tmp', path)
+
+
+class Minimap(QtCore.QObject):
+    """
+    Minimap class.
+
+    Strip of the thumbnails of the pages of a chapter. The `page_clicked`
+    signal gives the index of the page clicked.
+    """
+    page_clicked = QtCore.pyqtSignal(int)
+    # Thumbnail generated: index of the page, image, generation
+    _thumbnail_ready = QtCore.pyqtSignal(int, object, int)
+
+    def __init__(self, cache_dir: str, height: int):
+        super().__init__()
+        self.cache = ThumbnailCache(cache_dir)
+        self.height = height
+        self.path = None
+        self.entries = None
+        self.names = []
+        self._reader_class = None
+        # Incremented to stop generating the thumbnails of a chapter
+        self.generation = 0
+        self._job = None
+
+        self.widget = QtWidgets.QListWidget()
+        self.widget.setViewMode(QtWidgets.QListView.IconMode)
+        self.widget.setFlow(QtWidgets.QListView.LeftToRight)
+        self.widget.setWrapping(False)
+        self.widget.setMovement(QtWidgets.QListView.Static)
+        self.widget.setUniformItemSizes(True)
+        self.widget.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.widget.setHorizontalScrollBarPolicy(
+            QtCore.Qt.ScrollBarAlwaysOff
+        )
+        self.widget.setIconSize(QtCore.QSize(height * 3 // 4, height))
+        # Thumbnail, page number, and margins
+        self.widget.setFixedHeight(
+            height + self.widget.fontMetrics().height() + 12
+        )
+        self.widget.itemClicked.connect(
+            lambda item: self.page_clicked.emit(self.widget.row(item))
+        )
+        self._thumbnail_ready.connect(self._set_thumbnail)
+
+    def set_chapter(self, archive):
+        """List the pages of a chapter (the thumbnails are generated once
+        the strip is shown)."""
+        self.clear()
+        self.path = archive.path
+        self.entries = archive.entries
+        # Local or remote archive
+        self._reader_class = type(archive)
+        self.names = archive.namelist()
+        for index in range(len(self.names)):
+            item = QtWidgets.QListWidgetItem(str(index + 1))
+            item.setTextAlignment(QtCore.Qt.AlignCenter)
+            self.widget.addItem(item)
+
+    def clear(self):
+        """Forget the chapter, and stop generating its thumbnails."""
+        self.generation += 1
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        self.widget.clear()
+        self.path = None
+        self.entries = None
+        self.names = []
+
+    def start(self, current: int = 0):
+        """Generate the missing thumbnails, from the page `current`."""
+        if self._job is not None or self.path is None:
+            return
+        self._job = scheduler.submit(
+            'thumbnails',
+            self._generate,
+            self._reader_class,
+            self.path,
+            self.entries,
+            list(self.names),
+            current,
+            self.generation,
+            priority=THUMBNAILS
+        )
+
+    def set_current(self, index: int):
+        """Highlight a page, and scroll the strip to it."""
+        if index == self.widget.currentRow() or index >= self.widget.count():
+            return
+        self.widget.setCurrentRow(index)
+        self.widget.scrollToItem(
+            self.widget.item(index),
+            QtWidgets.QAbstractItemView.PositionAtCenter
+        )
+
+    def _generate(self, reader_class, path: str, entries: dict, names: list,
+                  current: int, generation: int):
+        """Load or generate the thumbnails, one per step (in a background
+        job)."""
+        try:
+            directory = self.cache.directory(path)
+        except OSError as error:
+            print(f'[WARNING] Thumbnails not cached: {error}')
+            return
+        reader = reader_class(path, entries)
+        # From the current page outwards
+        order = sorted(range(len(names)), key=lambda i: abs(i - current))
+        with reader:
+            for index in order:
+                if generation != self.generation:
+                    return
+                name = names[index]
+                if name.lower().endswith('.webm'):
+                    continue
+                image = self.cache.load(directory, name)
+                if image is None:
+                    with tracer.span('thumbnail', entry=name):
+                        image = thumbnail(reader.read(name), self.height)
+                    if image.isNull():
+                        continue
+                    self.cache.store(directory, name, image)
+                self._thumbnail_ready.emit(index, image, generation)
+                yield
+
+    def _set_thumbnail(self, index: int, image: QtGui.QImage,
+                       generation: int):
+        """Display a thumbnail (in the GUI thread)."""
+        if generation != self.generation or index >= self.widget.count():
+            return
+        self.widget.item(index).setIcon(
+            QtGui.QIcon(QtGui.QPixmap.fromImage(image))
+        )
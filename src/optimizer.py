@@ -0,0 +1,321 @@
+"""
+Optimizer module.
+
+To repack the chapters of the library so that they open fast:
+- pages are stored without compression (ZIP_STORED), the images being
+  already compressed,
+- entries are written in reading order,
+- pages can be downscaled to a maximum width, and transcoded to another
+  format (both need Pillow).
+
+Chapters are optimized in parallel by a pool of processes. Each chapter is
+written to a temporary file, verified, then atomically renamed over the
+original. Optimized chapters are recorded in `.optimized.json` in the comics
+directory, so an interrupted run resumes where it stopped.
+
+Usage:
+    python -m src.optimizer [--max-width 1200] [--format webp] [comics_dir]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+try:
+    from .archive import CbzReader, is_page, natural_key
+    from .settings import Settings
+except ImportError:
+    from archive import CbzReader, is_page, natural_key
+    from settings import Settings
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+STATE_FILE = '.optimized.json'
+TMP_SUFFIX = '.optimizing'
+# Pillow format and extension of the transcoding formats
+FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+}
+
+
+def _identity(path: str) -> list:
+    """Get the size and modification time of a file."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _options_key(options: dict) -> str:
+    """Get a short key of the options, to redo chapters if they change."""
+    return hashlib.sha1(
+        json.dumps(options, sort_keys=True).encode('utf-8')
+    ).hexdigest()[:12]
+
+
+def _convert_page(name: str, data, options: dict) -> tuple:
+    """Downscale and/or transcode a page.
+
+    ----------
+    # Returns
+    The (maybe renamed) name of the page and its data.
+    """
+    max_width = options.get('max_width')
+    image_format = options.get('format')
+    if Image is None or name.lower().endswith('.webm'):
+        return name, data
+    image = Image.open(io.BytesIO(data))
+    pil_format = image.format
+    is_too_wide = max_width is not None and image.width > max_width
+    if not is_too_wide and image_format is None:
+        return name, data
+    if is_too_wide:
+        height = round(image.height * max_width / image.width)
+        image = image.resize((max_width, height), Image.LANCZOS)
+    if image_format is not None:
+        pil_format, extension = FORMATS[image_format]
+        name = os.path.splitext(name)[0] + extension
+    if pil_format == 'JPEG' and image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, pil_format, quality=options.get('quality', 90))
+    return name, output.getvalue()
+
+
+def _free_name(name: str, original: str, taken: set) -> str:
+    """Get a name for a renamed page that no other entry has (e.g.
+    `001_png.webp` when `001.png` and `001.jpg` are both transcoded)."""
+    if name == original or name not in taken:
+        return name
+    stem, extension = os.path.splitext(name)
+    stem += '_' + os.path.splitext(original)[1].lstrip('.').lower()
+    name = stem + extension
+    count = 1
+    while name in taken:
+        count += 1
+        name = f'{stem}{count}{extension}'
+    return name
+
+
+def _verify(path: str, entries: list):
+    """Check that a written chapter is readable and holds all the entries.
+
+    ----------
+    # Parameters
+    path: The path of the written chapter.
+    entries: The expected names and sizes of the entries, in order.
+    """
+    with zipfile.ZipFile(path) as zip_file:
+        bad_entry = zip_file.testzip()
+        if bad_entry is not None:
+            raise zipfile.BadZipFile(f'Bad CRC for {bad_entry}')
+        written = [
+            (info.filename, info.file_size) for info in zip_file.infolist()
+        ]
+    if written != entries:
+        raise zipfile.BadZipFile('Entries missing in the optimized chapter')
+
+
+def optimize_chapter(path: str, options: dict) -> tuple:
+    """Repack a chapter.
+
+    ----------
+    # Parameters
+    path: The path of the chapter (.cbz).
+    options: The `max_width`, `format` and `quality` of the pages.
+
+    ----------
+    # Returns
+    The path of the chapter, its size before and after.
+    """
+    size_before = os.path.getsize(path)
+    tmp_path = path + TMP_SUFFIX
+    entries = []
+    try:
+        with CbzReader(path) as reader, zipfile.ZipFile(
+            tmp_path, 'w', zipfile.ZIP_STORED
+        ) as output:
+            names = reader.pages()
+            # Other entries (e.g. ComicInfo.xml) are kept after the pages
+            names += [name for name in reader.namelist() if not is_page(name)]
+            # Names of the entries, so that a renamed page replaces none
+            taken = set(names)
+            for original in names:
+                name, data = original, reader.read(original)
+                if is_page(name):
+                    name, data = _convert_page(name, data, options)
+                    name = _free_name(name, original, taken)
+                    taken.add(name)
+                output.writestr(name, bytes(data))
+                entries.append((name, len(data)))
+        _verify(tmp_path, entries)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path, size_before, os.path.getsize(path)
+
+
+class LibraryOptimizer:
+    """
+    LibraryOptimizer class.
+
+    Optimizes all the chapters of a comics directory, resuming from the
+    chapters already optimized with the same options.
+    """
+    def __init__(self, comics_dir: str, options: dict, workers: int = None):
+        self.comics_dir = comics_dir
+        self.options = options
+        self.workers = workers
+        self._state_path = os.path.join(comics_dir, STATE_FILE)
+        self.state = {}
+        self._load_state()
+
+    def _load_state(self):
+        """Load the chapters already optimized."""
+        try:
+            with open(self._state_path, 'r', encoding='utf-8') as file:
+                self.state = json.load(file)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def _save_state(self):
+        """Save the chapters already optimized, atomically."""
+        with open(self._state_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.state, file, indent=4)
+        os.replace(self._state_path + '.tmp', self._state_path)
+
+    def chapters(self, clean: bool = False) -> list:
+        """List the chapters still to optimize.
+
+        ----------
+        # Parameters
+        clean: Remove the temporary files of interrupted runs.
+        """
+        key = _options_key(self.options)
+        chapters = []
+        for comic in sorted(os.listdir(self.comics_dir), key=natural_key):
+            comic_path = os.path.join(self.comics_dir, comic)
+            if comic.startswith('.') or not os.path.isdir(comic_path):
+                continue
+            for chapter in sorted(os.listdir(comic_path), key=natural_key):
+                path = os.path.join(comic_path, chapter)
+                # Leftover of an interrupted run
+                if chapter.endswith('.cbz' + TMP_SUFFIX):
+                    if clean:
+                        os.remove(path)
+                    continue
+                if not chapter.endswith('.cbz'):
+                    continue
+                done = self.state.get(os.path.relpath(path, self.comics_dir))
+                if done != [key] + _identity(path):
+                    chapters.append(path)
+        return chapters
+
+    def run(self, dry_run: bool = False) -> dict:
+        """Optimize the chapters.
+
+        ----------
+        # Returns
+        The number of chapters optimized and failed, and the sizes of the
+        chapters before and after.
+        """
+        key = _options_key(self.options)
+        chapters = self.chapters(clean=not dry_run)
+        report = {'done': 0, 'failed': 0, 'before': 0, 'after': 0}
+        print(f'[INFO] {len(chapters)} chapters to optimize.')
+        if dry_run:
+            for path in chapters:
+                print(f'- {path}')
+            return report
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(optimize_chapter, path, self.options): path
+                for path in chapters
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    _, size_before, size_after = future.result()
+                except Exception as error:
+                    # e.g. a corrupt archive, or a decompression bomb
+                    report['failed'] += 1
+                    print(f'[ERROR] {path}: {error}')
+                    continue
+                report['done'] += 1
+                report['before'] += size_before
+                report['after'] += size_after
+                self.state[os.path.relpath(path, self.comics_dir)] = (
+                    [key] + _identity(path)
+                )
+                # Save after each chapter, to resume if interrupted
+                self._save_state()
+                print(
+                    f'[INFO] ({report["done"]}/{len(chapters)}) {path}: '
+                    f'{size_before // 1024} KiB -> {size_after // 1024} KiB'
+                )
+        return report
+
+
+def main(argv: list = None):
+    """Optimize the library from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Repack the chapters of the library for fast opening.'
+    )
+    parser.add_argument(
+        'comics_dir', nargs='?',
+        help='comics directory (default: comics_dir of comic_reader.ini)'
+    )
+    parser.add_argument(
+        '--max-width', type=int,
+        help='downscale pages wider than this width'
+    )
+    parser.add_argument(
+        '--format', choices=sorted(FORMATS),
+        help='transcode pages to this format'
+    )
+    parser.add_argument(
+        '--quality', type=int, default=90,
+        help='quality of the transcoded pages (default: 90)'
+    )
+    parser.add_argument(
+        '--workers', type=int,
+        help='number of processes (default: CPU count)'
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='only list the chapters to optimize'
+    )
+    args = parser.parse_args(argv)
+    comics_dir = args.comics_dir
+    if comics_dir is None:
+        working_dir = os.path.dirname(
+            os.path.dirname(os.path.realpath(__file__))
+        )
+        comics_dir = Settings(
+            os.path.join(working_dir, 'comic_reader.ini')
+        )['comics_dir']
+    options = {'max_width': args.max_width, 'format': args.format}
+    if args.format is not None:
+        options['quality'] = args.quality
+    if Image is None and (args.max_width or args.format):
+        print('Please install Pillow from pip.')
+        sys.exit(1)
+    report = LibraryOptimizer(comics_dir, options, args.workers).run(
+        args.dry_run
+    )
+    print(
+        f'[INFO] Optimized: {report["done"]}, failed: {report["failed"]}, '
+        f'{report["before"] // 2**20} MiB -> {report["after"] // 2**20} MiB'
+    )
+
+
+if __name__ == '__main__':
+    main()
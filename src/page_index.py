@@ -0,0 +1,81 @@
+"""
+Page index module.
+
+To map the scroll position of the viewer to pages, and back.
+
+The index keeps the prefix sums of the page heights (the offset of the top of
+each page), so that a scroll offset is mapped to a page by binary search.
+Positions are expressed as (page index, fraction of the page), which stay
+valid when the width of the pages (and so their heights) changes.
+"""
+
+from bisect import bisect_right
+
+
+class PageIndex:
+    """
+    PageIndex class.
+
+    Offsets of the pages of a vertical layout.
+    """
+    def __init__(self):
+        self.offsets = [0]
+        self.spacing = 0
+
+    def build(self, heights: list, top: int = 0, spacing: int = 0):
+        """Build the index.
+
+        ----------
+        # Parameters
+        heights: The heights of the pages, in order.
+        top: The offset of the first page (top margin of the layout).
+        spacing: The space between two pages.
+        """
+        self.spacing = spacing
+        self.offsets = [top]
+        for height in heights:
+            self.offsets.append(self.offsets[-1] + height + spacing)
+
+    def update(self, index: int, height: int):
+        """Change the height of a page, shifting the next pages."""
+        delta = height - self.height(index)
+        for i in range(index + 1, len(self.offsets)):
+            self.offsets[i] += delta
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def height(self, index: int) -> int:
+        """Get the height of a page."""
+        return self.offsets[index + 1] - self.offsets[index] - self.spacing
+
+    def page_at(self, offset: int) -> tuple:
+        """Get the page at a scroll offset.
+
+        ----------
+        # Returns
+        The index of the page and the fraction of the page above the offset,
+        (0, 0.0) if there is no page.
+        """
+        if not len(self):
+            return 0, 0.0
+        index = bisect_right(self.offsets, offset) - 1
+        index = min(max(index, 0), len(self) - 1)
+        height = max(self.height(index), 1)
+        fraction = (offset - self.offsets[index]) / height
+        return index, min(max(fraction, 0.0), 1.0)
+
+    def offset_of(self, index: int, fraction: float = 0.0) -> int:
+        """Get the scroll offset of a position in a page."""
+        if not len(self):
+            return 0
+        index = min(max(index, 0), len(self) - 1)
+        return self.offsets[index] + round(fraction * self.height(index))
+
+    def pages_between(self, top: int, bottom: int) -> range:
+        """Get the pages overlapping the offsets from `top` to `bottom`."""
+        if not len(self):
+            return range(0)
+        first, _ = self.page_at(top)
+        last, _ = self.page_at(bottom)
+        return range(first, last + 1)
@@ -0,0 +1,210 @@
+"""
+Paged module.
+
+To read a chapter one page, or one two-page spread, at a time.
+
+Only the pages of the current spread are displayed, and a small ring of
+decoded pages is kept ahead and behind for instant flipping: the memory used
+stays the same whatever the length of the chapter.
+"""
+
+from collections import OrderedDict
+from PyQt5 import QtCore, QtGui, QtWidgets
+try:
+    from .decoders import scaled_size, to_pixmap
+except ImportError:
+    from decoders import scaled_size, to_pixmap
+
+
+class PagedView:
+    """
+    PagedView class.
+
+    Displays the current page, or spread, fitted in the widget.
+    """
+    def __init__(self, decoders, memory, ahead: int = 2, behind: int = 1):
+        self.decoders = decoders
+        self.memory = memory
+        self.ahead = ahead
+        self.behind = behind
+        self.chapter = None
+        self.archive = None
+        self.images = []
+        self.spreads = []
+        self._spread_sizes = {}
+        self.index = 0
+        # Decoded pages, by page index
+        self.ring = OrderedDict()
+
+        self.widget = QtWidgets.QWidget()
+        layout = QtWidgets.QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
+        layout.setAlignment(QtCore.Qt.AlignCenter)
+        self.widget.setLayout(layout)
+        self.labels = [QtWidgets.QLabel(), QtWidgets.QLabel()]
+        for label in self.labels:
+            label.setAlignment(QtCore.Qt.AlignCenter)
+            layout.addWidget(label)
+        self.widget.resizeEvent = self._resize_event
+        self._prefetch_timer = QtCore.QTimer()
+        self._prefetch_timer.setSingleShot(True)
+        self._prefetch_timer.timeout.connect(self._prefetch)
+
+    def set_chapter(self, chapter: str, archive, spread: bool):
+        """Display a chapter, from its first page.
+
+        ----------
+        # Parameters
+        chapter: The name of the chapter.
+        archive: The open archive of the chapter.
+        spread: Show two pages at a time (the cover alone).
+        """
+        self.clear()
+        self.chapter = chapter
+        self.archive = archive
+        self.images = archive.namelist()
+        count = len(self.images)
+        if spread and count:
+            self.spreads = [[0]] + [
+                list(range(index, min(index + 2, count)))
+                for index in range(1, count, 2)
+            ]
+        else:
+            self.spreads = [[index] for index in range(count)]
+        self._spread_sizes = {
+            page: len(spread) for spread in self.spreads for page in spread
+        }
+        self.index = 0
+
+    def clear(self):
+        """Forget the chapter, and release the decoded pages."""
+        self._prefetch_timer.stop()
+        for page in list(self.ring):
+            self._release(page)
+        for label in self.labels:
+            label.clear()
+        self.chapter = None
+        self.archive = None
+        self.images = []
+        self.spreads = []
+        self._spread_sizes = {}
+
+    def page(self) -> int:
+        """Get the first page of the current spread."""
+        return self.spreads[self.index][0] if self.spreads else 0
+
+    def go_to_page(self, page: int):
+        """Display the spread of a page."""
+        for index, spread in enumerate(self.spreads):
+            if page in spread:
+                self.index = index
+                break
+        self.show_current()
+
+    def at_start(self) -> bool:
+        """Tell if the first spread is displayed."""
+        return self.index == 0
+
+    def at_end(self) -> bool:
+        """Tell if the last spread is displayed."""
+        return self.index >= len(self.spreads) - 1
+
+    def flip(self, step: int) -> bool:
+        """Display the spread `step` spreads after (or before) this one.
+
+        ----------
+        # Returns
+        False if there is no such spread.
+        """
+        index = self.index + step
+        if index < 0 or index >= len(self.spreads):
+            return False
+        self.index = index
+        self.show_current()
+        return True
+
+    def show_current(self):
+        """Display the current spread, then prefetch its neighbours."""
+        if not self.spreads:
+            return
+        spread = self.spreads[self.index]
+        for position, label in enumerate(self.labels):
+            if position < len(spread):
+                label.setPixmap(self._pixmap(spread[position]))
+                label.show()
+            else:
+                label.clear()
+                label.hide()
+        self._trim_ring()
+        self._prefetch_timer.start(0)
+
+    def _ring_pages(self) -> list:
+        """Get the pages to keep decoded, current spread first."""
+        pages = list(self.spreads[self.index])
+        for step in range(1, max(self.ahead, self.behind) + 1):
+            for index in (self.index + step, self.index - step):
+                is_ahead = index > self.index
+                if (
+                    0 <= index < len(self.spreads)
+                    and step <= (self.ahead if is_ahead else self.behind)
+                ):
+                    pages += self.spreads[index]
+        return pages
+
+    def _fit_width(self, page: int, data) -> int:
+        """Get the width fitting a page in its part of the widget."""
+        count = self._spread_sizes.get(page, 1)
+        width = max(self.widget.width() // count, 1)
+        height = max(self.widget.height(), 1)
+        size = scaled_size(data, width)
+        if size.isValid() and size.height() > height:
+            width = max(width * height // size.height(), 1)
+        return width
+
+    def _pixmap(self, page: int) -> QtGui.QPixmap:
+        """Get a decoded page, from the ring or decoding it."""
+        if page in self.ring:
+            self.ring.move_to_end(page)
+            self.memory.touch((self.chapter, self.images[page]))
+            return self.ring[page]
+        data = self.archive.read(self.images[page])
+        pixmap = to_pixmap(
+            self.decoders.decode(data, self._fit_width(page, data))
+        )
+        self.ring[page] = pixmap
+        self.memory.add(
+            (self.chapter, self.images[page]),
+            pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        )
+        return pixmap
+
+    def _release(self, page: int):
+        """Release a decoded page."""
+        self.ring.pop(page, None)
+        if self.chapter is not None:
+            self.memory.remove((self.chapter, self.images[page]))
+
+    def _trim_ring(self):
+        """Release the pages out of the ring."""
+        keep = set(self._ring_pages())
+        for page in list(self.ring):
+            if page not in keep:
+                self._release(page)
+
+    def _prefetch(self):
+        """Decode the pages ahead and behind, one per event loop turn."""
+        if not self.spreads:
+            return
+        for page in self._ring_pages():
+            if page not in self.ring:
+                self._pixmap(page)
+                self._prefetch_timer.start(0)
+                return
+
+    def _resize_event(self, event):
+        """Decode the pages again at the new size."""
+        QtWidgets.QWidget.resizeEvent(self.widget, event)
+        for page in list(self.ring):
+            self._release(page)
+        self.show_current()
@@ -0,0 +1,278 @@
+"""
+Processing module.
+
+To crop the margins of the pages, and to stretch their levels.
+
+Scanned pages often have thick white (or black) borders, which take screen
+width from the art, and washed-out levels. Once a page is displayed, it is
+processed in a worker thread:
+- the bounding box of its content is found with NumPy, and the page is
+  decoded again so that the content alone fills the width,
+- its levels are stretched to the full range (ignoring 0.5% of outliers at
+  each end).
+
+The processed page is sent back to the GUI thread, which only swaps the
+pixmap. The crop box and levels of each page are kept, so that a page
+coming back into view is decoded and processed in a worker directly.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore, QtGui
+try:
+    from .tracing import tracer
+except ImportError:
+    from tracing import tracer
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _array(image: QtGui.QImage, channels: int):
+    """Get the pixels of an image as an array of shape (height, width *
+    channels), without copying them."""
+    pointer = image.constBits()
+    pointer.setsize(image.sizeInBytes())
+    pixels = np.frombuffer(pointer, np.uint8).reshape(
+        image.height(), image.bytesPerLine()
+    )
+    return pixels[:, :image.width() * channels]
+
+
+def content_box(pixels, tolerance: int) -> tuple:
+    """Find the content of a page, inside its margins.
+
+    ----------
+    # Parameters
+    pixels: The page in grayscale, as an array of shape (height, width).
+    tolerance: The maximum difference between the margins and their color.
+
+    ----------
+    # Returns
+    The (left, top, right, bottom) box of the content, as fractions of the
+    page, or None if there is no margin to crop.
+    """
+    height, width = pixels.shape
+    border = np.concatenate(
+        (pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1])
+    )
+    background = int(np.median(border))
+    # Only white or black margins
+    if 55 < background < 200:
+        return None
+    content = np.abs(pixels.astype(np.int16) - background) > tolerance
+    # Ignore scan noise: rows and columns with almost no content
+    rows = np.flatnonzero(content.mean(axis=1) > 0.005)
+    cols = np.flatnonzero(content.mean(axis=0) > 0.005)
+    if not rows.size or not cols.size:
+        return None
+    padding = round(width * 0.01)
+    left = max(cols[0] - padding, 0)
+    right = min(cols[-1] + 1 + padding, width)
+    top = max(rows[0] - padding, 0)
+    bottom = min(rows[-1] + 1 + padding, height)
+    # Not worth it, or too much (e.g. an almost blank page)
+    if right - left > width * 0.97 and bottom - top > height * 0.97:
+        return None
+    if right - left < width * 0.5 or bottom - top < height * 0.5:
+        return None
+    return left / width, top / height, right / width, bottom / height
+
+
+def levels(pixels) -> tuple:
+    """Find the levels of a page.
+
+    ----------
+    # Parameters
+    pixels: The page in grayscale, as an array of any shape.
+
+    ----------
+    # Returns
+    The (black, white) levels to stretch to the full range, or None if the
+    page already uses it (or is too flat to be stretched).
+    """
+    cumulated = np.cumsum(np.bincount(pixels.ravel(), minlength=256))
+    total = cumulated[-1]
+    black = int(np.searchsorted(cumulated, total * 0.005))
+    white = int(np.searchsorted(cumulated, total * 0.995))
+    if white - black < 64 or (black <= 2 and white >= 253):
+        return None
+    return black, white
+
+
+def apply_levels(image: QtGui.QImage, black: int,
+                 white: int) -> QtGui.QImage:
+    """Stretch the (black, white) levels of an image to the full range."""
+    table = np.clip(
+        (np.arange(256) - black) * 255.0 / (white - black), 0, 255
+    ).astype(np.uint8)
+    if image.format() == QtGui.QImage.Format_Grayscale8:
+        channels = 1
+    elif image.hasAlphaChannel():
+        image = image.convertToFormat(QtGui.QImage.Format_RGBA8888)
+        channels = 4
+    else:
+        image = image.convertToFormat(QtGui.QImage.Format_RGB888)
+        channels = 3
+    pixels = _array(image, channels)
+    stretched = table[pixels]
+    if channels == 4:
+        # Keep the alpha channel as is
+        stretched[:, 3::4] = pixels[:, 3::4]
+    # Copy, so that the QImage owns its pixels
+    return QtGui.QImage(
+        stretched.tobytes(), image.width(), image.height(),
+        image.width() * channels, image.format()
+    ).copy()
+
+
+class PageProcessor(QtCore.QObject):
+    """
+    PageProcessor class.
+
+    Processes the pages in worker threads, and sends them back to the GUI
+    thread with the `processed` signal (key, image, generation).
+    """
+    processed = QtCore.pyqtSignal(object, object, int)
+
+    def __init__(self, decoders, settings):
+        super().__init__()
+        self.decoders = decoders
+        self.crop = False
+        self.levels = False
+        self.tolerance = 24
+        self.workers = 2
+        # Incremented to discard the pages of the previous chapters
+        self.generation = 0
+        # Crop box and levels of the pages, by (chapter, image) key
+        self.params = {}
+        self._executor = None
+        self._futures = set()
+        self._lock = threading.Lock()
+        self.configure(settings)
+
+    def configure(self, settings):
+        """Read the processing settings."""
+        viewer = settings['viewer']
+        self.crop = viewer.get('crop_margins', False)
+        self.levels = viewer.get('auto_levels', False)
+        self.tolerance = viewer.get('crop_tolerance', 24)
+        self.workers = viewer.get('processing_workers', 2)
+        if (self.crop or self.levels) and np is None:
+            print('[WARNING] Please install numpy from pip to crop the '
+                  'margins and adjust the levels of the pages.')
+
+    def enabled(self) -> bool:
+        """Tell if the pages are processed."""
+        return (self.crop or self.levels) and np is not None
+
+    def is_known(self, key: tuple) -> bool:
+        """Tell if a page was already analyzed."""
+        return key in self.params
+
+    def submit(self, key: tuple, data, image: QtGui.QImage, width: int):
+        """Process a page in a worker thread.
+
+        ----------
+        # Parameters
+        key: The (chapter, image) key of the page.
+        data: The encoded page.
+        image: The page decoded at `width`, None to decode it in the worker
+        (only if the page was already analyzed).
+        width: The width of the processed page.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='processing'
+            )
+        # The analysis is captured now: the worker may run after `forget`
+        future = self._executor.submit(
+            self._process, key, bytes(data), image, width,
+            self.params.get(key), self.generation
+        )
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+
+    def pending(self) -> int:
+        """Get the number of pages queued or being processed."""
+        with self._lock:
+            return len(self._futures)
+
+    def _done(self, future):
+        """Forget a finished job."""
+        with self._lock:
+            self._futures.discard(future)
+
+    def cancel(self):
+        """Cancel the pending jobs, and discard the running ones (the
+        analysis of the pages is kept, see `forget`)."""
+        self.generation += 1
+        with self._lock:
+            for future in self._futures:
+                future.cancel()
+            self._futures.clear()
+
+    def forget(self, chapter: str = None):
+        """Forget the analysis of the pages of a chapter, or of all the
+        pages."""
+        if chapter is None:
+            self.params.clear()
+            return
+        for key in [key for key in list(self.params) if key[0] == chapter]:
+            del self.params[key]
+
+    def _analyze(self, image: QtGui.QImage) -> tuple:
+        """Get the crop box and the levels of a page."""
+        gray = image.convertToFormat(QtGui.QImage.Format_Grayscale8)
+        pixels = _array(gray, 1)
+        box = content_box(pixels, self.tolerance) if self.crop else None
+        if box is not None:
+            left, top, right, bottom = box
+            pixels = pixels[
+                round(top * gray.height()):round(bottom * gray.height()),
+                round(left * gray.width()):round(right * gray.width())
+            ]
+        return box, levels(pixels) if self.levels else None
+
+    def _process(self, key: tuple, data: bytes, image: QtGui.QImage,
+                 width: int, params: tuple, generation: int):
+        """Process a page (in a worker thread)."""
+        if generation != self.generation:
+            return
+        if params is None and image is None:
+            # Not analyzed, and no decoded page to analyze
+            return
+        with tracer.span('process', entry=key[1]):
+            if params is None:
+                params = self._analyze(image)
+                self.params[key] = params
+            box, page_levels = params
+            if box is None and page_levels is None and image is not None:
+                # Nothing to change
+                return
+            result = image
+            if box is not None:
+                left, top, right, bottom = box
+                # Decode again, so that the content alone fills the width
+                decoded = self.decoders.decode(
+                    data, max(round(width / (right - left)), 1)
+                )
+                rect = QtCore.QRect(
+                    round(left * decoded.width()),
+                    round(top * decoded.height()),
+                    width,
+                    round((bottom - top) * decoded.height())
+                )
+                result = decoded.copy(rect.intersected(decoded.rect()))
+                if not result.isNull() and result.width() != width:
+                    result = result.scaledToWidth(width)
+            elif result is None:
+                result = self.decoders.decode(data, width)
+            if result.isNull():
+                return
+            if page_levels is not None:
+                result = apply_levels(result, *page_levels)
+        if generation == self.generation:
+            self.processed.emit(key, result, generation)
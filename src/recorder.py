@@ -0,0 +1,144 @@
+"""
+Recorder module.
+
+To record the input events of the viewer (key presses and releases, mouse
+wheel, mouse clicks) to a JSON file, to be replayed by `src.replay`.
+
+Recording is off by default. It is enabled by the `record_input` setting
+or by the `COMIC_READER_RECORD` environment variable, set to the path of
+the session file (or `1` for `session.json` in the working directory). The
+session is saved each time the viewer is closed. Mouse positions are
+recorded as fractions of the viewer, to be replayed at any window size.
+"""
+
+import json
+import os
+import time
+from PyQt5 import QtCore, QtGui
+
+
+ENV_VAR = 'COMIC_READER_RECORD'
+
+
+def recording_path(settings, working_dir: str) -> str:
+    """Get the path of the session file, or None if recording is off."""
+    path = os.environ.get(ENV_VAR, '') or settings.get('record_input')
+    if not path or path == '0':
+        return None
+    if path in ('1', True):
+        return os.path.join(working_dir, 'session.json')
+    return path
+
+
+class InputRecorder:
+    """
+    InputRecorder class.
+
+    Records the input events of the viewer, with their time since the
+    first chapter was opened.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.chapter_row = None
+        self.events = []
+        self._start = None
+
+    def start(self, chapter_row: int):
+        """Start the session, from the chapter at `chapter_row`."""
+        if self._start is None:
+            self._start = time.perf_counter()
+            self.chapter_row = chapter_row
+
+    def record(self, kind: str, event, size: QtCore.QSize = None):
+        """Record an event.
+
+        ----------
+        # Parameters
+        kind: `key_press`, `key_release`, `wheel` or `mouse_press`.
+        event: The Qt event.
+        size: The size of the viewer (for mouse events).
+        """
+        if self._start is None:
+            return
+        record = {
+            't': round(time.perf_counter() - self._start, 4),
+            'type': kind,
+            'modifiers': int(event.modifiers()),
+        }
+        if kind in ('key_press', 'key_release'):
+            record.update(
+                key=event.key(),
+                text=event.text(),
+                auto_repeat=event.isAutoRepeat()
+            )
+        elif kind == 'wheel':
+            record['delta'] = event.angleDelta().y()
+        elif kind == 'mouse_press':
+            record.update(
+                x=round(event.pos().x() / max(size.width(), 1), 4),
+                y=round(event.pos().y() / max(size.height(), 1), 4),
+                button=int(event.button())
+            )
+        self.events.append(record)
+
+    def save(self):
+        """Save the session to its JSON file."""
+        if self._start is None:
+            return
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({
+                'version': 1,
+                'chapter_row': self.chapter_row,
+                'events': self.events,
+            }, file)
+        os.replace(self.path + '.tmp', self.path)
+        print(f'[INFO] Input session saved to {self.path} '
+              f'({len(self.events)} events).')
+
+
+def load_session(path: str) -> dict:
+    """Load a session saved by an InputRecorder."""
+    with open(path, 'r', encoding='utf-8') as file:
+        session = json.load(file)
+    if session.get('version') != 1:
+        raise ValueError(f'Unknown session version in {path}')
+    return session
+
+
+def to_event(record: dict, size: QtCore.QSize) -> QtCore.QEvent:
+    """Build the Qt event of a recorded event, for a viewer of `size`."""
+    modifiers = QtCore.Qt.KeyboardModifiers(record['modifiers'])
+    kind = record['type']
+    if kind in ('key_press', 'key_release'):
+        return QtGui.QKeyEvent(
+            QtCore.QEvent.KeyPress if kind == 'key_press'
+            else QtCore.QEvent.KeyRelease,
+            record['key'],
+            modifiers,
+            record['text'],
+            record['auto_repeat']
+        )
+    center = QtCore.QPointF(size.width() / 2, size.height() / 2)
+    if kind == 'wheel':
+        return QtGui.QWheelEvent(
+            center,
+            center,
+            QtCore.QPoint(0, 0),
+            QtCore.QPoint(0, record['delta']),
+            QtCore.Qt.NoButton,
+            modifiers,
+            QtCore.Qt.NoScrollPhase,
+            False
+        )
+    if kind == 'mouse_press':
+        button = QtCore.Qt.MouseButton(record['button'])
+        return QtGui.QMouseEvent(
+            QtCore.QEvent.MouseButtonPress,
+            QtCore.QPointF(
+                record['x'] * size.width(), record['y'] * size.height()
+            ),
+            button,
+            QtCore.Qt.MouseButtons(button),
+            modifiers
+        )
+    raise ValueError(f'Unknown event type: {kind}')
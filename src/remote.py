@@ -0,0 +1,486 @@
+"""
+Remote module.
+
+To read a library served by a plain static HTTP server, without
+downloading whole archives.
+
+`comics_dir` can be the URL of a directory listing (e.g. served by
+`python -m src.remote /path/to/comics`). Comics and chapters are listed from
+the links of the listings, and archives are read with Range requests:
+- the end of the archive, then its central directory, are fetched to list
+  the pages (and cached by the archive index, like local archives),
+- only the entries of the pages displayed are fetched afterwards.
+
+Requests go through a pool of keep-alive connections, and the blocks
+fetched are kept in a memory cache shared by all the archives.
+
+Usage:
+    python -m src.remote [--port 8000] [directory]
+"""
+
+import argparse
+import functools
+import http.client
+import io
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+try:
+    from .archive import CbzReader
+    from .storage import Entry, LocalFileSystem, storage
+except ImportError:
+    from archive import CbzReader
+    from storage import Entry, LocalFileSystem, storage
+
+
+class ConnectionPool:
+    """
+    ConnectionPool class.
+
+    Keep-alive HTTP(S) connections, reused between requests and threads.
+    """
+    def __init__(self, size: int = 4, timeout: float = 30):
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme: str, netloc: str):
+        """Get an idle connection to a server, or a new one."""
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _release(self, scheme: str, netloc: str, connection):
+        """Keep a connection for the next requests, if there is room."""
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method: str, url: str, headers: dict = None) -> tuple:
+        """Send a request.
+
+        ----------
+        # Returns
+        The status, the headers and the body of the response.
+        """
+        parts = urlsplit(url)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        # A kept connection may have been closed by the server: retry once
+        for attempt in range(2):
+            connection = self._connection(parts.scheme, parts.netloc)
+            try:
+                connection.request(method, target, headers=headers or {})
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(parts.scheme, parts.netloc, connection)
+            return response.status, response.headers, body
+
+
+class BlockCache:
+    """
+    BlockCache class.
+
+    Least recently used cache of the blocks of the remote files, bounded in
+    bytes, shared between threads.
+    """
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes:
+        """Get a block, or None if it is not cached."""
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self.hits += 1
+                self._blocks.move_to_end(key)
+            else:
+                self.misses += 1
+            return block
+
+    def put(self, key: tuple, block: bytes):
+        """Cache a block, evicting the oldest ones."""
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = block
+            self.size += len(block)
+            while self.size > self.cap:
+                _, evicted = self._blocks.popitem(last=False)
+                self.size -= len(evicted)
+
+    def forget(self, url: str):
+        """Forget the blocks of a file."""
+        with self._lock:
+            for key in [key for key in self._blocks if key[0] == url]:
+                self.size -= len(self._blocks.pop(key))
+
+
+class HttpFileSystem(LocalFileSystem):
+    """
+    HttpFileSystem class.
+
+    Read-only file system over HTTP: directories are listings of links,
+    files are read by blocks with Range requests.
+    """
+    def __init__(self, block_size: int = 256 * 1024,
+                 cache_cap: int = 64 * 2**20, connections: int = 4):
+        super().__init__()
+        self.block_size = block_size
+        self.pool = ConnectionPool(connections)
+        self.blocks = BlockCache(cache_cap)
+        # Size and modification time of the files, to detect changes
+        self._versions = {}
+
+    def scandir(self, path: str) -> list:
+        status, _, body = self.pool.request('GET', path.rstrip('/') + '/')
+        if status == HTTPStatus.NOT_FOUND:
+            raise FileNotFoundError(path)
+        if status != HTTPStatus.OK:
+            raise OSError(f'HTTP {status} for {path}')
+        entries = []
+        seen = set()
+        for link in re.findall(r'href="([^"?#]+)"', body.decode('utf-8')):
+            # Only the entries of the directory
+            if link.startswith(('/', '.')) or '://' in link:
+                continue
+            name = unquote(link.rstrip('/'))
+            if name and '/' not in name and name not in seen:
+                seen.add(name)
+                entries.append(Entry(name, link.endswith('/')))
+        return entries
+
+    def stat(self, path: str) -> os.stat_result:
+        status, headers, _ = self.pool.request('HEAD', path)
+        if status == HTTPStatus.NOT_FOUND:
+            raise FileNotFoundError(path)
+        if status != HTTPStatus.OK:
+            raise OSError(f'HTTP {status} for {path}')
+        size = int(headers.get('Content-Length') or 0)
+        try:
+            mtime = parsedate_to_datetime(
+                headers.get('Last-Modified')
+            ).timestamp()
+        except (TypeError, ValueError):
+            mtime = 0
+        version = (size, mtime)
+        if self._versions.setdefault(path, version) != version:
+            # Modified: its cached blocks are stale
+            self._versions[path] = version
+            self.blocks.forget(path)
+        return os.stat_result(
+            (0o100444, 0, 0, 1, 0, 0, size, mtime, mtime, mtime),
+            {'st_mtime_ns': int(mtime * 10**9)}
+        )
+
+    def open(self, path: str, mode: str = 'r', **kwargs):
+        if any(flag in mode for flag in 'wax+'):
+            raise PermissionError(f'Read-only: {path}')
+        file = RemoteFile(self, path)
+        if 'b' in mode:
+            return file
+        return io.TextIOWrapper(io.BufferedReader(file), **kwargs)
+
+    def read_range(self, path: str, offset: int, length: int) -> bytes:
+        """Read `length` bytes of a file from `offset`, through the cache.
+
+        Missing consecutive blocks are fetched with a single request.
+        """
+        if length <= 0:
+            return b''
+        size = self.block_size
+        first = offset // size
+        last = (offset + length - 1) // size
+        blocks = {}
+        missing = []
+        for index in range(first, last + 1):
+            block = self.blocks.get((path, index))
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+        # Consecutive runs of missing blocks
+        runs = []
+        for index in missing:
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        for start, end in runs:
+            data = self._fetch(path, start * size, (end + 1) * size - 1)
+            for index in range(start, end + 1):
+                block = data[(index - start) * size:(index - start + 1) * size]
+                blocks[index] = block
+                self.blocks.put((path, index), block)
+        data = b''.join(
+            blocks[index] for index in range(first, last + 1)
+        )
+        return data[offset - first * size:offset - first * size + length]
+
+    def _fetch(self, path: str, start: int, end: int) -> bytes:
+        """Fetch the bytes from `start` to `end` (included) of a file."""
+        status, _, body = self.pool.request(
+            'GET', path, {'Range': f'bytes={start}-{end}'}
+        )
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            return body
+        if status == HTTPStatus.OK:
+            # The server ignores ranges: the whole file was sent
+            return body[start:end + 1]
+        if status == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+            return b''
+        raise OSError(f'HTTP {status} for {path}')
+
+
+class RemoteFile(io.RawIOBase):
+    """Read-only, seekable file over HTTP."""
+    def __init__(self, filesystem: HttpFileSystem, path: str):
+        super().__init__()
+        self.filesystem = filesystem
+        self.path = path
+        self._size = None
+        self._position = 0
+
+    @property
+    def size(self) -> int:
+        """The size of the file (one request, the first time)."""
+        if self._size is None:
+            self._size = self.filesystem.stat(self.path).st_size
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(offset, 0)
+        return self._position
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        """Read `length` bytes from `offset`, without moving the position
+        (safe between threads)."""
+        return self.filesystem.read_range(self.path, offset, length)
+
+    def readinto(self, buffer) -> int:
+        data = self.read_at(self._position, len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class RemoteCbzReader(CbzReader):
+    """
+    RemoteCbzReader class.
+
+    Reads the entries of an archive over HTTP, see `CbzReader`.
+    """
+    def __init__(self, path: str, entries: dict = None):
+        self.path = path
+        self._mmap = None
+        self._file = storage.open(path, 'rb')
+        self.entries = {}
+        if entries is None:
+            self._load_entries()
+        else:
+            self.entries = entries
+
+    def _prefetch(self, entry, length: int):
+        """Fetch the local header of an entry (30 bytes, the name and an
+        extra field rarely longer than 64 bytes) with the first `length`
+        bytes of its data, in one request."""
+        if entry.data_offset is None:
+            self._read_at(
+                entry.header_offset,
+                30 + len(entry.name.encode('utf-8')) + 64 + length
+            )
+
+    def read(self, name: str):
+        entry = self.entries[name]
+        self._prefetch(entry, entry.compress_size)
+        return super().read(name)
+
+    def read_head(self, name: str, length: int = 64 * 1024) -> bytes:
+        entry = self.entries[name]
+        self._prefetch(entry, min(length + 1024, entry.compress_size))
+        return super().read_head(name, length)
+
+    def _read_at(self, offset: int, length: int) -> bytes:
+        return self._file.read_at(offset, length)
+
+    def _read_with_zipfile(self, name: str) -> bytes:
+        with zipfile.ZipFile(self._file) as zip_file:
+            return zip_file.read(name)
+
+    def read_many(self, names: list, workers: int = None):
+        """Read entries, fetching the next ones in parallel.
+
+        ----------
+        # Returns
+        A generator of `(name, data)` tuples, in the order of `names`.
+        """
+        workers = workers or self._file.filesystem.pool.size
+        executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='fetch'
+        )
+        # Bound the pages fetched ahead of the consumer
+        pending = deque()
+        try:
+            queue = iter(names)
+            for name in queue:
+                pending.append((name, executor.submit(self.read, name)))
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                name, future = pending.popleft()
+                data = future.result()
+                for next_name in queue:
+                    pending.append(
+                        (next_name, executor.submit(self.read, next_name))
+                    )
+                    break
+                yield name, data
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def close(self):
+        self._file.close()
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file server supporting single byte ranges, to serve a
+    library for testing."""
+    protocol_version = 'HTTP/1.1'
+
+    def send_head(self):
+        self._remaining = None
+        path = self.translate_path(self.path)
+        match = re.fullmatch(
+            r'bytes=(\d+)-(\d*)', self.headers.get('Range', '').strip()
+        )
+        if match is None or os.path.isdir(path):
+            return super().send_head()
+        try:
+            file = open(path, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return None
+        stat = os.fstat(file.fileno())
+        start = int(match[1])
+        end = min(int(match[2]) if match[2] else stat.st_size - 1,
+                  stat.st_size - 1)
+        if start > end:
+            file.close()
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{stat.st_size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header(
+            'Content-Range', f'bytes {start}-{end}/{stat.st_size}'
+        )
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header(
+            'Last-Modified', self.date_time_string(stat.st_mtime)
+        )
+        self.end_headers()
+        file.seek(start)
+        self._remaining = end - start + 1
+        return file
+
+    def copyfile(self, source, outputfile):
+        if self._remaining is None:
+            super().copyfile(source, outputfile)
+            return
+        while self._remaining > 0:
+            chunk = source.read(min(self._remaining, 64 * 1024))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            self._remaining -= len(chunk)
+
+    def log_message(self, format, *args):
+        """Log requests as the rest of the application does."""
+        print(f"[DEBUG] {self.address_string()} - {format % args}")
+
+
+def make_server(directory: str, host: str = '127.0.0.1',
+                port: int = 8000) -> ThreadingHTTPServer:
+    """Create a static server of a directory (`port` 0 picks a free
+    port)."""
+    server = ThreadingHTTPServer(
+        (host, port),
+        functools.partial(RangeRequestHandler, directory=directory)
+    )
+    server.daemon_threads = True
+    return server
+
+
+def main(argv: list = None):
+    """Serve a directory, with byte ranges, from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Serve a library as static files, with byte ranges.'
+    )
+    parser.add_argument(
+        'directory', nargs='?', default='.',
+        help='directory to serve (default: current directory)'
+    )
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on (default: 8000)')
+    args = parser.parse_args(argv)
+    server = make_server(args.directory, args.host, args.port)
+    print(f'[INFO] Serving {args.directory} on '
+          f'http://{args.host}:{args.port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
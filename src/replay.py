@@ -0,0 +1,322 @@
+"""
+Replay module.
+
+To replay an input session recorded by the viewer (see the `recorder`
+module) against a synthetic library, headlessly, and report how smooth
+reading was.
+
+The library is generated from scratch for each replay (same chapters, same
+pages, cold caches), so that replays of a session are comparable between
+two versions of the app. The events are sent to the input handlers of the
+viewer at their recorded times, once the first chapter is displayed.
+
+- Frame times are measured by a 60 Hz timer of the GUI thread: a frame
+  takes longer than 16.7 ms when the GUI thread is busy (decoding, layout,
+  painting, ...), and each 16.7 ms missed is a dropped frame.
+- Chapter transitions are measured from the chapter request (N, P, end of a
+  chapter) to its pages in view.
+
+Usage:
+    python -m src.replay session.json [--chapters 8] [--pages 24]
+        [--speed 1.0] [--output report.json] [--max-p99-ms 50]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from PyQt5 import QtCore, QtGui, QtWidgets
+try:
+    from .comic import Comic
+    from .recorder import load_session, to_event
+    from .scheduler import scheduler
+    from .settings import Settings
+    from .storage import storage
+    from .viewer import Viewer
+except ImportError:
+    from comic import Comic
+    from recorder import load_session, to_event
+    from scheduler import scheduler
+    from settings import Settings
+    from storage import storage
+    from viewer import Viewer
+
+
+# Frame budget at 60 Hz, in ms
+FRAME_MS = 1000 / 60
+
+
+def make_page(chapter: int, page: int, width: int, height: int) -> bytes:
+    """Draw a page of the synthetic library, as JPEG."""
+    image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+    image.fill(QtGui.QColor(250, 250, 245))
+    painter = QtGui.QPainter(image)
+    gradient = QtGui.QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QtGui.QColor.fromHsv(chapter * 40 % 360, 90, 230))
+    gradient.setColorAt(1, QtGui.QColor.fromHsv(page * 15 % 360, 160, 90))
+    # Panels, with details to decode
+    margin = width // 20
+    panel_height = (height - 4 * margin) // 3
+    for row in range(3):
+        top = margin + row * (panel_height + margin)
+        painter.fillRect(
+            margin, top, width - 2 * margin, panel_height, gradient
+        )
+        for line in range(0, panel_height, 12):
+            painter.fillRect(
+                margin, top + line, (line * 7 + page * 31) % (width // 2),
+                4, QtGui.QColor(20, 20, 20)
+            )
+    painter.end()
+    buffer = QtCore.QBuffer()
+    buffer.open(QtCore.QIODevice.WriteOnly)
+    image.save(buffer, 'JPG', 85)
+    return bytes(buffer.data())
+
+
+def make_library(directory: str, chapters: int, pages: int,
+                 width: int = 1200, height: int = 1800) -> str:
+    """Generate the synthetic library.
+
+    ----------
+    # Returns
+    The path of its only comic.
+    """
+    comic_path = os.path.join(directory, 'Synthetic')
+    os.makedirs(comic_path, exist_ok=True)
+    for chapter in range(1, chapters + 1):
+        path = os.path.join(comic_path, f'Chapter {chapter}.cbz')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+            for page in range(1, pages + 1):
+                archive.writestr(
+                    f'{page:03d}.jpg',
+                    make_page(chapter, page, width, height)
+                )
+    return comic_path
+
+
+def percentiles(values: list) -> dict:
+    """Get the 50th, 90th and 99th percentiles and the maximum of values
+    (nearest rank)."""
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {}
+    for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+        index = min(int(fraction * len(values)), len(values) - 1)
+        result[name] = round(values[index], 1)
+    result['max'] = round(values[-1], 1)
+    return result
+
+
+class Replayer(QtCore.QObject):
+    """
+    Replayer class.
+
+    Sends the events of a session to the viewer, and measures the frames
+    and the chapter transitions.
+    """
+    def __init__(self, viewer, session: dict, speed: float = 1.0):
+        super().__init__()
+        self.viewer = viewer
+        self.events = session['events']
+        self.speed = speed
+        self.frames = []
+        self.first_open = None
+        self.transitions = []
+        self._index = 0
+        self._start = None
+        self._handlers = {
+            'key_press': viewer._image_viewer_key_press,
+            'key_release': viewer._image_viewer_key_release,
+            'wheel': viewer._image_viewer_wheel_event,
+            'mouse_press': viewer._image_viewer_mouse_press,
+        }
+        self._probe = QtCore.QTimer()
+        self._probe.setTimerType(QtCore.Qt.PreciseTimer)
+        self._probe.setInterval(int(FRAME_MS))
+        self._probe.timeout.connect(
+            lambda: self.frames.append(time.perf_counter())
+        )
+        # After the slot of the viewer, which displays the chapter
+        viewer.loader.loaded.connect(self._loaded)
+        viewer.loader.failed.connect(self._failed)
+
+    def start(self, comic, chapter_list: QtWidgets.QListWidget):
+        """Open the first chapter; the events follow once it is shown."""
+        self._probe.start()
+        self.viewer.chapter_clicked(comic, chapter_list)
+
+    def _loaded(self, load):
+        """Record a chapter transition."""
+        if load.archive is None or load.archive is not self.viewer.archive:
+            # Superseded by another chapter
+            return
+        if self.first_open is None:
+            self.first_open = self.viewer.first_page_ms
+            self._start = time.perf_counter()
+            self._schedule()
+        else:
+            self.transitions.append(self.viewer.first_page_ms)
+
+    def _failed(self, load, _error: Exception):
+        """Stop if the first chapter cannot be opened."""
+        if self.first_open is None:
+            self._probe.stop()
+            QtWidgets.QApplication.instance().quit()
+
+    def _schedule(self):
+        """Send the next event at its time."""
+        if self._index >= len(self.events):
+            QtCore.QTimer.singleShot(1000, self._finish)
+            return
+        due = self.events[self._index]['t'] / self.speed
+        # Late after a stall: the events due in the meantime follow at once
+        delay = due - (time.perf_counter() - self._start)
+        QtCore.QTimer.singleShot(max(int(delay * 1000), 0), self._send)
+
+    def _send(self):
+        """Send an event to the viewer."""
+        record = self.events[self._index]
+        self._index += 1
+        self._handlers[record['type']](
+            to_event(record, self.viewer.image_viewer.size())
+        )
+        self._schedule()
+
+    def _finish(self):
+        """Stop once the last chapter is loaded."""
+        if self.viewer.loader.is_loading():
+            QtCore.QTimer.singleShot(100, self._finish)
+            return
+        self._probe.stop()
+        QtWidgets.QApplication.instance().quit()
+
+    def report(self) -> dict:
+        """Get the frame times and the chapter transitions."""
+        intervals = [
+            (after - before) * 1000
+            for before, after in zip(self.frames, self.frames[1:])
+        ]
+        dropped = sum(
+            max(round(interval / FRAME_MS) - 1, 0) for interval in intervals
+        )
+        return {
+            'events': len(self.events),
+            'duration_s': round(
+                (self.frames[-1] - self.frames[0]) if self.frames else 0, 2
+            ),
+            'frames': len(intervals),
+            'frame_ms': percentiles(intervals),
+            'dropped_frames': dropped,
+            'first_open_ms': round(self.first_open or 0, 1),
+            'transitions': len(self.transitions),
+            'transition_ms': percentiles(self.transitions),
+        }
+
+
+def main(argv: list = None):
+    """Replay a session, and print the report."""
+    parser = argparse.ArgumentParser(
+        description='Replay an input session against a synthetic library.'
+    )
+    parser.add_argument('session', help='session file to replay')
+    parser.add_argument(
+        '--chapters', type=int, default=8,
+        help='chapters of the synthetic library (default: 8)'
+    )
+    parser.add_argument(
+        '--pages', type=int, default=24,
+        help='pages per chapter (default: 24)'
+    )
+    parser.add_argument(
+        '--speed', type=float, default=1.0,
+        help='replay speed (default: 1.0)'
+    )
+    parser.add_argument(
+        '--settings',
+        help='settings file to replay with (default: the default settings)'
+    )
+    parser.add_argument('--output', help='save the report to a JSON file')
+    parser.add_argument(
+        '--max-p99-ms', type=float,
+        help='fail if the 99th percentile of the frame times is above'
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        session = load_session(args.session)
+    except (OSError, ValueError) as error:
+        print(f'[ERROR] {error}')
+        return 1
+
+    # Headless, unless a platform is chosen
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    os.environ.pop('COMIC_READER_RECORD', None)
+    app = QtWidgets.QApplication(sys.argv[:1])
+    working_dir = tempfile.mkdtemp(prefix='comic_reader_replay_')
+    try:
+        print('[INFO] Generating the synthetic library...')
+        comic_path = make_library(
+            os.path.join(working_dir, 'comics'), args.chapters, args.pages
+        )
+        settings_path = os.path.join(working_dir, 'comic_reader.ini')
+        if args.settings:
+            shutil.copyfile(args.settings, settings_path)
+        settings = Settings(settings_path)
+        settings.settings.update({
+            'comics_dir': os.path.dirname(comic_path),
+            'trace': False,
+            'record_input': None,
+        })
+        storage.configure(settings, working_dir)
+        scheduler.configure(settings)
+
+        viewer = Viewer(working_dir, settings)
+        comic = Comic(comic_path)
+        chapter_list = QtWidgets.QListWidget()
+        for chapter in range(1, args.chapters + 1):
+            chapter_list.addItem(f'Chapter {chapter}.cbz')
+        chapter_list.setCurrentRow(
+            min(max(session.get('chapter_row') or 0, 0), args.chapters - 1)
+        )
+        replayer = Replayer(viewer, session, args.speed)
+        print(f"[INFO] Replaying {len(session['events'])} events...")
+        replayer.start(comic, chapter_list)
+        app.exec_()
+        report = replayer.report()
+    finally:
+        scheduler.cancel()
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+    frame_ms = report['frame_ms']
+    print('[INFO] Replay report')
+    print(f"- events: {report['events']} in {report['duration_s']} s")
+    print(f"- frames: {report['frames']}, frame time (ms): "
+          + ', '.join(f'{name} {value}' for name, value in frame_ms.items()))
+    print(f"- dropped frames: {report['dropped_frames']}")
+    print(f"- first chapter: {report['first_open_ms']} ms")
+    print(f"- chapter transitions: {report['transitions']}"
+          + ''.join(
+              f', {name} {value} ms'
+              for name, value in report['transition_ms'].items()
+          ))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+    if (
+        args.max_p99_ms is not None
+        and frame_ms.get('p99', 0) > args.max_p99_ms
+    ):
+        print(f"[ERROR] Frame time p99 {frame_ms['p99']} ms is above "
+              f'{args.max_p99_ms} ms.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
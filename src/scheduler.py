@@ -0,0 +1,232 @@
+"""
+Scheduler module.
+
+To run background jobs (thumbnails, indexing of the next chapters, hashing
+of the pages, cache pruning) without competing with reading.
+
+Jobs are queued by priority, and run by a small pool of worker threads,
+started with the first job. A job is a function, or a generator function
+whose steps (between two `yield`) are run one at a time: between two steps,
+a job can be cancelled, or put back in the queue behind a more urgent one.
+
+The viewer pauses the jobs while it loads a chapter, and holds them off
+while it scrolls: a worker finishes its current step, then waits until the
+viewer is idle again.
+"""
+
+import heapq
+import inspect
+import itertools
+import threading
+import time
+
+
+# Priorities of the jobs (lowest first)
+THUMBNAILS = 0
+INDEXING = 1
+HASHING = 2
+PRUNING = 3
+
+
+class Job:
+    """
+    Job class.
+
+    A background job, cancellable between two of its steps.
+    """
+    def __init__(self, name: str, priority: int, sequence: int,
+                 group: str, function, args: tuple):
+        self.name = name
+        self.priority = priority
+        self.sequence = sequence
+        self.group = group
+        self.function = function
+        self.args = args
+        self.cancelled = False
+        # Steps of a generator job, once started
+        self._steps = None
+
+    def cancel(self):
+        """Cancel the job (a running step finishes first)."""
+        self.cancelled = True
+
+    def step(self) -> bool:
+        """Run the next step of the job.
+
+        ----------
+        # Returns
+        True if the job is finished.
+        """
+        if self._steps is None:
+            result = self.function(*self.args)
+            if not inspect.isgenerator(result):
+                return True
+            self._steps = result
+        try:
+            next(self._steps)
+        except StopIteration:
+            return True
+        return False
+
+    def close(self):
+        """Stop a generator job (its `finally` blocks are run)."""
+        if self._steps is not None:
+            self._steps.close()
+
+    def __lt__(self, other) -> bool:
+        return (self.priority, self.sequence) < (
+            other.priority, other.sequence
+        )
+
+
+class BackgroundScheduler:
+    """
+    BackgroundScheduler class.
+
+    Runs prioritized, cancellable jobs on worker threads, while the viewer
+    is idle.
+    """
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self.finished = 0
+        self._queue = []
+        self._running = []
+        self._threads = []
+        self._sequence = itertools.count()
+        # Reasons to pause the jobs, and end of the current hold-off
+        self._reasons = set()
+        self._hold_until = 0.0
+        self._condition = threading.Condition()
+
+    def configure(self, settings):
+        """Read the background settings."""
+        background = settings.get('background') or {}
+        self.workers = max(background.get('workers', 1), 1)
+
+    def submit(self, name: str, function, *args, priority: int = INDEXING,
+               group: str = None) -> Job:
+        """Queue a job.
+
+        ----------
+        # Parameters
+        name: The name of the job, for the reports.
+        function: The function, or generator function, to run.
+        args: The arguments of the function.
+        priority: The priority of the job (lowest first).
+        group: The group of the job, to cancel related jobs together.
+
+        ----------
+        # Returns
+        The job, to cancel it.
+        """
+        with self._condition:
+            job = Job(
+                name, priority, next(self._sequence), group, function, args
+            )
+            heapq.heappush(self._queue, job)
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name=f'background-{len(self._threads)}',
+                    daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+        return job
+
+    def cancel(self, group: str = None):
+        """Cancel the jobs of a group, or all the jobs."""
+        with self._condition:
+            queued = []
+            for job in self._queue:
+                if group is None or job.group == group:
+                    job.cancel()
+                    job.close()
+                else:
+                    queued.append(job)
+            self._queue = queued
+            heapq.heapify(self._queue)
+            for job in self._running:
+                if group is None or job.group == group:
+                    job.cancel()
+
+    def pause(self, reason: str):
+        """Pause the jobs until `resume(reason)`."""
+        with self._condition:
+            self._reasons.add(reason)
+
+    def resume(self, reason: str):
+        """Resume the jobs paused for `reason`."""
+        with self._condition:
+            self._reasons.discard(reason)
+            self._condition.notify_all()
+
+    def hold(self, seconds: float):
+        """Hold the jobs off for `seconds` (e.g. during a scroll)."""
+        with self._condition:
+            self._hold_until = max(
+                self._hold_until, time.monotonic() + seconds
+            )
+
+    def state(self) -> dict:
+        """Get the state of the queue.
+
+        ----------
+        # Returns
+        A dictionary with the number of `queued` jobs, the names of the
+        `running` ones, the reasons they are `paused` for, and the number
+        of `finished` jobs.
+        """
+        with self._condition:
+            paused = sorted(self._reasons)
+            if self._hold_until > time.monotonic():
+                paused.append('hold')
+            return {
+                'queued': len(self._queue),
+                'running': [job.name for job in self._running],
+                'paused': paused,
+                'finished': self.finished,
+            }
+
+    def _next_job(self) -> Job:
+        """Wait for the viewer to be idle and for a job (condition held)."""
+        while True:
+            if self._reasons:
+                self._condition.wait()
+                continue
+            delay = self._hold_until - time.monotonic()
+            if delay > 0:
+                self._condition.wait(delay)
+                continue
+            if not self._queue:
+                self._condition.wait()
+                continue
+            job = heapq.heappop(self._queue)
+            if not job.cancelled:
+                return job
+
+    def _work(self):
+        """Run the jobs, one step at a time (in a worker thread)."""
+        while True:
+            with self._condition:
+                job = self._next_job()
+                self._running.append(job)
+            try:
+                is_finished = job.step()
+            except Exception as error:
+                print(f'[ERROR] Background job {job.name} failed: {error}')
+                is_finished = True
+            with self._condition:
+                self._running.remove(job)
+                if job.cancelled:
+                    job.close()
+                elif is_finished:
+                    self.finished += 1
+                else:
+                    # Back in the queue, at its place
+                    heapq.heappush(self._queue, job)
+                    self._condition.notify()
+
+
+scheduler = BackgroundScheduler()
@@ -0,0 +1,400 @@
+"""
+Server module.
+
+To read the library from other devices of the local network.
+
+The server exposes the library of `comics_dir` over HTTP:
+- `GET /comics`: the list of the comics,
+- `GET /comics/<comic>`: the list of the chapters of a comic,
+- `GET /comics/<comic>/<chapter>`: the list of the pages of a chapter,
+- `GET /comics/<comic>/<chapter>/<page>`: a page (by index).
+
+Pages are read from the archives on demand (never the whole archive), kept
+in a cache shared by all the requests, and served with ETag/Last-Modified
+validation and byte ranges. Requests are handled by a pool of threads.
+
+Usage:
+    python -m src.server [--host 0.0.0.0] [--port 8080] [comics_dir]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+try:
+    from .archive import ArchiveIndex, natural_key
+    from .settings import Settings
+except ImportError:
+    from archive import ArchiveIndex, natural_key
+    from settings import Settings
+
+
+CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.webm': 'video/webm',
+}
+
+
+class PageCache:
+    """
+    PageCache class.
+
+    Least recently used cache of pages, bounded in bytes, shared between
+    threads.
+    """
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        """Get a page, or None if it is not cached."""
+        with self._lock:
+            cached = self._pages.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pages.move_to_end(key)
+            return cached[0]
+
+    def put(self, key: tuple, value: object, size: int):
+        """Cache a page of `size` bytes, evicting the oldest ones."""
+        with self._lock:
+            if key in self._pages or size > self.cap:
+                return
+            self._pages[key] = (value, size)
+            self.size += size
+            while self.size > self.cap:
+                _, (_, evicted_size) = self._pages.popitem(last=False)
+                self.size -= evicted_size
+
+
+class Library:
+    """
+    Library class.
+
+    Read-only access to the comics, chapters and pages of `comics_dir`.
+    Nothing is written to the library (comics are not opened as `Comic`,
+    whose metadata file would be created), and the listings are cached for
+    `listing_ttl` seconds.
+    """
+    def __init__(self, comics_dir: str, cache_dir: str = None,
+                 cache_cap: int = 256 * 2**20, listing_ttl: float = 5.0):
+        self.comics_dir = comics_dir
+        self.index = ArchiveIndex(cache_dir)
+        self.pages = PageCache(cache_cap)
+        self.listing_ttl = listing_ttl
+        # Listings by directory, with their time
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def _listing(self, path: str, keep) -> list:
+        """List the entries of a directory kept by `keep(path, name)`, in
+        natural order (cached)."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._listings.get(path)
+        if cached is not None and now - cached[0] < self.listing_ttl:
+            return cached[1]
+        names = sorted(
+            (name for name in os.listdir(path) if keep(path, name)),
+            key=natural_key
+        )
+        with self._lock:
+            self._listings[path] = (now, names)
+        return names
+
+    def comics(self) -> list:
+        """List the comics."""
+        return self._listing(
+            self.comics_dir,
+            lambda path, name: (
+                not name.startswith('.')
+                and os.path.isdir(os.path.join(path, name))
+            )
+        )
+
+    def comic(self, name: str) -> str:
+        """Get the path of a comic, or None if it does not exist."""
+        if name not in self.comics():
+            return None
+        return os.path.join(self.comics_dir, name)
+
+    def chapters(self, comic_path: str) -> list:
+        """List the chapters of a comic."""
+        return self._listing(
+            comic_path, lambda path, name: name.endswith('.cbz')
+        )
+
+    def chapter_path(self, comic_path: str, chapter: str) -> str:
+        """Get the path of a chapter, or None if it does not exist."""
+        if chapter not in self.chapters(comic_path):
+            return None
+        return os.path.join(comic_path, chapter)
+
+    def page_names(self, path: str) -> list:
+        """List the pages of a chapter, in reading order."""
+        with self.index.open(path) as reader:
+            return reader.namelist()
+
+    def page(self, path: str, index: int) -> tuple:
+        """Read a page of a chapter.
+
+        ----------
+        # Returns
+        The name of the page, its data and the `os.stat` of the chapter.
+        Raises IndexError if there is no such page.
+        """
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns, index)
+        cached = self.pages.get(key)
+        if cached is not None:
+            return cached[0], cached[1], stat
+        with self.index.open(path) as reader:
+            name = reader.namelist()[index]
+            data = bytes(reader.read(name))
+        self.pages.put(key, (name, data), len(data))
+        return name, data, stat
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Handle the requests of the readers."""
+    server_version = 'ComicReader'
+    protocol_version = 'HTTP/1.1'
+    # Set by `make_server`
+    library = None
+
+    def do_GET(self):
+        """Handle GET requests."""
+        self._handle(send_body=True)
+
+    def do_HEAD(self):
+        """Handle HEAD requests."""
+        self._handle(send_body=False)
+
+    def log_message(self, format, *args):
+        """Log requests as the rest of the application does."""
+        print(f"[DEBUG] {self.address_string()} - {format % args}")
+
+    def _handle(self, send_body: bool):
+        """Route a request."""
+        parts = [
+            unquote(part) for part in self.path.split('?')[0].split('/')
+            if part
+        ]
+        if not parts or parts[0] != 'comics' or len(parts) > 4:
+            self._send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            if len(parts) == 1:
+                self._send_json(self.library.comics(), send_body)
+                return
+            comic_path = self.library.comic(parts[1])
+            if comic_path is None:
+                self._send_error(HTTPStatus.NOT_FOUND)
+                return
+            if len(parts) == 2:
+                self._send_json(self.library.chapters(comic_path), send_body)
+                return
+            path = self.library.chapter_path(comic_path, parts[2])
+            if path is None:
+                self._send_error(HTTPStatus.NOT_FOUND)
+                return
+            if len(parts) == 3:
+                base = '/' + '/'.join(quote(part) for part in parts)
+                self._send_json(
+                    [
+                        {'name': name, 'url': f'{base}/{index}'}
+                        for index, name in enumerate(
+                            self.library.page_names(path)
+                        )
+                    ],
+                    send_body
+                )
+                return
+            if not parts[3].isdigit():
+                self._send_error(HTTPStatus.NOT_FOUND)
+                return
+            name, data, stat = self.library.page(path, int(parts[3]))
+        except IndexError:
+            self._send_error(HTTPStatus.NOT_FOUND)
+            return
+        except (OSError, zipfile.BadZipFile):
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR)
+            return
+        self._send_page(name, data, stat, send_body)
+
+    def _send_json(self, value: object, send_body: bool):
+        """Send a JSON response."""
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_error(self, status: HTTPStatus):
+        """Send an empty error response."""
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _is_not_modified(self, etag: str, stat: os.stat_result) -> bool:
+        """Tell if the reader already has the current version of a page."""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(stat.st_mtime) <= since
+        return False
+
+    def _range(self, length: int) -> tuple:
+        """Get the byte range requested.
+
+        ----------
+        # Returns
+        (start, end) of the range (end included), None if the whole page is
+        requested, or False if the range cannot be satisfied.
+        """
+        header = self.headers.get('Range')
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+        if header is None or match is None or match.groups() == ('', ''):
+            # No range, or not a single range: the whole page is sent
+            return None
+        start, end = match.groups()
+        if start == '':
+            # Suffix range: the last bytes
+            start, end = max(length - int(end), 0), length - 1
+        else:
+            start = int(start)
+            end = min(int(end), length - 1) if end else length - 1
+        if start >= length or start > end:
+            return False
+        return start, end
+
+    def _send_page(self, name, data, stat, send_body: bool):
+        """Send a page, or a part of it."""
+        etag = '"' + hashlib.sha1(
+            f'{stat.st_size}-{stat.st_mtime_ns}-{name}'.encode('utf-8')
+        ).hexdigest()[:16] + '"'
+        headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+            'Cache-Control': 'max-age=3600',
+            'Accept-Ranges': 'bytes',
+        }
+        if self._is_not_modified(etag, stat):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            return
+        byte_range = self._range(len(data))
+        if byte_range is False:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{len(data)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if byte_range is None:
+            self.send_response(HTTPStatus.OK)
+            body = memoryview(data)
+        else:
+            start, end = byte_range
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header(
+                'Content-Range', f'bytes {start}-{end}/{len(data)}'
+            )
+            body = memoryview(data)[start:end + 1]
+        content_type = CONTENT_TYPES.get(
+            os.path.splitext(name)[1].lower(), 'application/octet-stream'
+        )
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+def make_server(library: Library, host: str = '127.0.0.1',
+                port: int = 8080) -> ThreadingHTTPServer:
+    """Create the server of a library (`port` 0 picks a free port)."""
+    handler = type('LibraryRequestHandler', (RequestHandler,), {
+        'library': library
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv: list = None):
+    """Serve the library from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Serve the library over HTTP.'
+    )
+    parser.add_argument(
+        'comics_dir', nargs='?',
+        help='comics directory (default: comics_dir of comic_reader.ini)'
+    )
+    parser.add_argument(
+        '--host', default='127.0.0.1',
+        help='address to listen on (default: 127.0.0.1, 0.0.0.0 for LAN)'
+    )
+    parser.add_argument(
+        '--port', type=int, default=8080,
+        help='port to listen on (default: 8080)'
+    )
+    parser.add_argument(
+        '--cache-mb', type=int, default=256,
+        help='size of the page cache (default: 256)'
+    )
+    args = parser.parse_args(argv)
+    working_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    comics_dir = args.comics_dir
+    if comics_dir is None:
+        comics_dir = Settings(
+            os.path.join(working_dir, 'comic_reader.ini')
+        )['comics_dir']
+    library = Library(
+        comics_dir,
+        os.path.join(working_dir, 'cache', 'index'),
+        args.cache_mb * 2**20
+    )
+    server = make_server(library, args.host, args.port)
+    print(f'[INFO] Serving {comics_dir} on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -43,10 +43,44 @@ class Settings:
                 'viewer': {
                     'width': 800,
                     'ui_scale': 1.0,
+                    'memory_cap_mb': 512,
+                    'continuous': False,
+                    'mode': 'scroll',
+                    'skip_filler': False,
+                    'crop_margins': False,
+                    'auto_levels': False,
+                    'compact_pixels': True,
                 },
                 'last_read': None,
                 'comics_dir': '/home/louis/Documents/Mangas/',
                 'orientation': 'horizontal',
+                'trace': False,
+                'startup': {
+                    'background_scan': True,
+                    'budget_ms': 1000
+                },
+                'storage': {
+                    'ttl': 30,
+                    'stage_archives': False,
+                    'remote': {
+                        'block_kb': 256,
+                        'cache_mb': 64,
+                        'connections': 4
+                    }
+                },
+                'background': {
+                    'workers': 1,
+                    'hash_pages': False,
+                    'cache_mb': 1024
+                },
+                'watchdog': {
+                    'enabled': True,
+                    'threshold_ms': 100
+                },
+                'instance': {
+                    'single': True,
+                    'tray': False
+                },
             }
             self.save()
         with open(self._path, 'r', encoding='utf-8') as file:
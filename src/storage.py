@@ -0,0 +1,580 @@
+"""
+Storage module.
+
+To access the library efficiently when it lives on a network file system
+(SMB, NFS), where every `listdir`, `stat` or small read is a round trip.
+
+- Directory listings are read with `os.scandir` (names and types in one
+  round trip) and cached for a few seconds (`storage.ttl`). The status of
+  an archive, which tells if its cached index is still valid, is always
+  read again, and metadata files are opened directly (a missing one costs
+  no extra `stat`).
+- The archives of the current and next chapters can be staged to the local
+  disk (`storage.stage_archives`), in the background, with large sequential
+  reads. Pages are then read from the local copy.
+- Libraries served over HTTP (`comics_dir` is a URL) are read with the
+  `remote` module.
+- A file system adding a latency to every operation (`storage.latency_ms`,
+  or `python -m src.storage --latency-ms 20`) shows the gains without a
+  real NAS.
+
+The module-level `storage` is configured from the settings at startup.
+
+Usage:
+    python -m src.storage [--latency-ms 20] [comics_dir]
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+try:
+    from .settings import Settings
+except ImportError:
+    from settings import Settings
+
+
+# Entry of a directory listing
+Entry = namedtuple('Entry', ['name', 'is_dir'])
+
+
+def is_url(path: str) -> bool:
+    """Tell if a path is the URL of a remote file."""
+    return path.startswith(('http://', 'https://'))
+
+
+def absolute(path: str) -> str:
+    """Get the absolute path of a file (URLs are absolute already)."""
+    return path if is_url(path) else os.path.abspath(path)
+
+
+def _usage(path: str) -> tuple:
+    """Get the size of a file or directory, and its last modification (of
+    its most recent file)."""
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
+    size = 0
+    mtime = os.stat(path).st_mtime
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+def prune_cache(directories: list, cap: int):
+    """Remove the least recently used entries (files or directories) of
+    cache directories, until they fit in `cap` bytes together.
+
+    A generator, one entry per step, to run as a background job.
+    """
+    entries = []
+    for directory in directories:
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                size, mtime = _usage(path)
+            except OSError:
+                continue
+            entries.append((mtime, size, path))
+            yield
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= cap:
+            break
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as error:
+            print(f'[WARNING] Cannot prune {path}: {error}')
+            continue
+        total -= size
+        removed += 1
+        yield
+    if removed:
+        print(f'[INFO] Cache pruned: {removed} entries removed, '
+              f'{total // 2**20} MiB left.')
+
+
+class LocalFileSystem:
+    """
+    LocalFileSystem class.
+
+    Direct access to the files, through the operating system.
+    """
+    def __init__(self, workers: int = 16):
+        self.workers = workers
+        self._executor = None
+
+    def scandir(self, path: str) -> list:
+        """List a directory, with the type of its entries."""
+        with os.scandir(path) as entries:
+            return [Entry(entry.name, entry.is_dir()) for entry in entries]
+
+    def stat(self, path: str, fresh: bool = False) -> os.stat_result:
+        """Get the status of a file (raises OSError if it does not exist).
+        Statuses are never cached here, whatever `fresh`."""
+        return os.stat(path)
+
+    def stats(self, paths: list) -> list:
+        """Get the status of several files at once (None for the missing
+        ones), overlapping their round trips."""
+        def stat(path):
+            try:
+                return self.stat(path)
+            except OSError:
+                return None
+
+        if len(paths) < 2:
+            return [stat(path) for path in paths]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='stat'
+            )
+        return list(self._executor.map(stat, paths))
+
+    def open(self, path: str, mode: str = 'r', **kwargs):
+        """Open a file, see `open`."""
+        return open(path, mode, **kwargs)
+
+    def invalidate(self, path: str = None):
+        """Forget the cached information of a path (or all of them)."""
+
+
+class LatencyFileSystem(LocalFileSystem):
+    """
+    LatencyFileSystem class.
+
+    Local file system adding a latency to each operation, and to each block
+    read, like a network file system.
+    """
+    def __init__(self, latency: float, block_size: int = 2**20,
+                 workers: int = 16):
+        super().__init__(workers)
+        self.latency = latency
+        self.block_size = block_size
+
+    def scandir(self, path: str) -> list:
+        time.sleep(self.latency)
+        return super().scandir(path)
+
+    def stat(self, path: str, fresh: bool = False) -> os.stat_result:
+        time.sleep(self.latency)
+        return super().stat(path)
+
+    def open(self, path: str, mode: str = 'r', **kwargs):
+        time.sleep(self.latency)
+        return _SlowFile(super().open(path, mode, **kwargs), self)
+
+
+class _SlowFile:
+    """File adding the latency of its file system to each block read."""
+    def __init__(self, file, filesystem: LatencyFileSystem):
+        self._file = file
+        self._filesystem = filesystem
+
+    def read(self, size: int = -1):
+        data = self._file.read(size)
+        blocks = -(-len(data) // self._filesystem.block_size)
+        time.sleep(self._filesystem.latency * max(blocks, 1))
+        return data
+
+    def __getattr__(self, name: str):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+class CachedFileSystem:
+    """
+    CachedFileSystem class.
+
+    Caches the directory listings of another file system for `ttl` seconds,
+    and the file statuses not asked `fresh` (the app checks archives against
+    fresh ones). Files opened for writing invalidate their entries.
+    """
+    def __init__(self, filesystem, ttl: float):
+        self.filesystem = filesystem
+        self.ttl = ttl
+        self._listings = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, cache: dict, path: str):
+        """Get a cached value, or None if it expired."""
+        with self._lock:
+            cached = cache.get(path)
+        if cached is None or time.monotonic() - cached[0] > self.ttl:
+            return None
+        return cached
+
+    def scandir(self, path: str) -> list:
+        cached = self._cached(self._listings, path)
+        if cached is not None:
+            return cached[1]
+        entries = self.filesystem.scandir(path)
+        with self._lock:
+            self._listings[path] = (time.monotonic(), entries)
+        return entries
+
+    def stat(self, path: str, fresh: bool = False) -> os.stat_result:
+        if fresh:
+            with self._lock:
+                self._stats.pop(path, None)
+        result = self.stats([path])[0]
+        if result is None:
+            raise FileNotFoundError(path)
+        return result
+
+    def stats(self, paths: list) -> list:
+        results = {}
+        missing = []
+        for path in paths:
+            cached = self._cached(self._stats, path)
+            if cached is None:
+                missing.append(path)
+            else:
+                results[path] = cached[1]
+        if missing:
+            now = time.monotonic()
+            statuses = self.filesystem.stats(missing)
+            with self._lock:
+                for path, status in zip(missing, statuses):
+                    self._stats[path] = (now, status)
+                    results[path] = status
+        return [results[path] for path in paths]
+
+    def open(self, path: str, mode: str = 'r', **kwargs):
+        if any(flag in mode for flag in 'wax+'):
+            self.invalidate(path)
+        return self.filesystem.open(path, mode, **kwargs)
+
+    def invalidate(self, path: str = None):
+        with self._lock:
+            if path is None:
+                self._listings.clear()
+                self._stats.clear()
+                return
+            self._stats.pop(path, None)
+            self._listings.pop(os.path.dirname(path), None)
+
+
+class ArchiveStager:
+    """
+    ArchiveStager class.
+
+    Copies archives to a local directory in the background, with large
+    sequential reads, and keeps the `keep` most recent copies.
+    """
+    def __init__(self, filesystem, staging_dir: str, keep: int = 3,
+                 block_size: int = 4 * 2**20):
+        self.filesystem = filesystem
+        self.staging_dir = staging_dir
+        self.keep = keep
+        self.block_size = block_size
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='staging'
+        )
+
+    def _staged_path(self, path: str) -> str:
+        """Get the path of the local copy of the current version of an
+        archive."""
+        # Not the cached status, which may predate a rewrite of the archive
+        stat = self.filesystem.stat(path, fresh=True)
+        identity = f'{absolute(path)}|{stat.st_size}|{stat.st_mtime_ns}'
+        digest = hashlib.sha1(identity.encode('utf-8')).hexdigest()
+        return os.path.join(self.staging_dir, f'{digest}.cbz')
+
+    def local_path(self, path: str) -> str:
+        """Get the local copy of an archive, or the archive itself if it is
+        not staged (yet)."""
+        try:
+            staged_path = self._staged_path(path)
+        except OSError:
+            return path
+        return staged_path if os.path.exists(staged_path) else path
+
+    def stage(self, path: str):
+        """Copy an archive to the local disk, in the background."""
+        with self._lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+        self._executor.submit(self._copy, path)
+
+    def _copy(self, path: str):
+        """Copy an archive (in the background thread)."""
+        try:
+            staged_path = self._staged_path(path)
+            if not os.path.exists(staged_path):
+                os.makedirs(self.staging_dir, exist_ok=True)
+                start = time.perf_counter()
+                with self.filesystem.open(path, 'rb') as source:
+                    with open(staged_path + '.tmp', 'wb') as target:
+                        shutil.copyfileobj(source, target, self.block_size)
+                os.replace(staged_path + '.tmp', staged_path)
+                print(f'[DEBUG] Staged {path} '
+                      f'({time.perf_counter() - start:.2f} s)')
+            else:
+                # Most recently used
+                os.utime(staged_path)
+            self._trim()
+        except OSError as error:
+            print(f'[WARNING] Cannot stage {path}: {error}')
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def _trim(self):
+        """Remove the least recently staged copies."""
+        copies = sorted(
+            (
+                os.path.join(self.staging_dir, name)
+                for name in os.listdir(self.staging_dir)
+                if name.endswith('.cbz')
+            ),
+            key=os.path.getmtime,
+            reverse=True
+        )
+        for copy in copies[self.keep:]:
+            try:
+                os.remove(copy)
+            except OSError:
+                # Still open (Windows), removed next time
+                pass
+
+
+class Storage:
+    """
+    Storage class.
+
+    Access to the files of the library, configured from the settings. URLs
+    (`http://`, `https://`) are read from a static HTTP server, see the
+    `remote` module.
+    """
+    def __init__(self):
+        self.filesystem = LocalFileSystem()
+        self.remote = None
+        self.stager = None
+        self.cache_dir = None
+        self._config = {}
+
+    def configure(self, settings, working_dir: str):
+        """Set the file system up from the `storage` setting."""
+        config = settings.get('storage') or {}
+        self._config = config
+        self.cache_dir = os.path.join(working_dir, 'cache')
+        filesystem = LocalFileSystem()
+        latency = config.get('latency_ms', 0)
+        if latency:
+            filesystem = LatencyFileSystem(latency / 1000)
+        ttl = config.get('ttl', 30)
+        if ttl:
+            filesystem = CachedFileSystem(filesystem, ttl)
+        self.filesystem = filesystem
+        self.remote = None
+        self.stager = None
+        if config.get('stage_archives', False):
+            self.stager = ArchiveStager(
+                self,
+                os.path.join(self.cache_dir, 'staging'),
+                config.get('staged_archives', 3)
+            )
+
+    def _filesystem(self, path: str):
+        """Get the file system of a path."""
+        if not is_url(path):
+            return self.filesystem
+        if self.remote is None:
+            try:
+                from .remote import HttpFileSystem
+            except ImportError:
+                from remote import HttpFileSystem
+            remote = self._config.get('remote') or {}
+            self.remote = CachedFileSystem(
+                HttpFileSystem(
+                    remote.get('block_kb', 256) * 1024,
+                    remote.get('cache_mb', 64) * 2**20,
+                    remote.get('connections', 4)
+                ),
+                self._config.get('ttl', 30)
+            )
+        return self.remote
+
+    def scandir(self, path: str) -> list:
+        """List a directory, with the type of its entries."""
+        return self._filesystem(path).scandir(path)
+
+    def listdir(self, path: str) -> list:
+        """List the names of the entries of a directory."""
+        return [entry.name for entry in self.scandir(path)]
+
+    def stat(self, path: str, fresh: bool = False) -> os.stat_result:
+        """Get the status of a file (raises OSError if it does not exist).
+        `fresh` bypasses the cached status (and refreshes it), to check
+        that a file did not change."""
+        return self._filesystem(path).stat(path, fresh)
+
+    def open(self, path: str, mode: str = 'r', **kwargs):
+        """Open a file, see `open`."""
+        return self._filesystem(path).open(path, mode, **kwargs)
+
+    def join(self, path: str, name: str) -> str:
+        """Get the path of an entry of a directory."""
+        if is_url(path):
+            return path.rstrip('/') + '/' + quote(name)
+        return os.path.join(path, name)
+
+    def basename(self, path: str) -> str:
+        """Get the name of a file or directory."""
+        if is_url(path):
+            return unquote(path.rstrip('/').rsplit('/', 1)[-1])
+        return os.path.basename(path)
+
+    def metadata_path(self, path: str) -> str:
+        """Get the path of the metadata file of a comic (kept locally for
+        the comics of a remote library)."""
+        if not is_url(path):
+            return os.path.join(path, '.metadata.json')
+        directory = os.path.join(
+            self.cache_dir or tempfile.gettempdir(), 'remote'
+        )
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(directory, f'{digest}.json')
+
+    def local_path(self, path: str) -> str:
+        """Get the local copy of an archive, if it is staged."""
+        if self.stager is None:
+            return path
+        return self.stager.local_path(path)
+
+    def stage(self, paths: list):
+        """Stage archives to the local disk, in the background."""
+        if self.stager is None:
+            return
+        for path in paths:
+            self.stager.stage(path)
+
+
+storage = Storage()
+
+
+def _browse(filesystem, comics_dir: str, comics: int) -> int:
+    """Browse the library: list the comics, then open a few of them (list
+    their chapters and read their metadata), twice.
+
+    ----------
+    # Returns
+    The number of chapters seen.
+    """
+    chapters = 0
+    for _ in range(2):
+        names = [
+            entry.name for entry in filesystem.scandir(comics_dir)
+            if entry.is_dir and not entry.name.startswith('.')
+        ]
+        for name in sorted(names)[:comics]:
+            path = os.path.join(comics_dir, name)
+            chapters += sum(
+                1 for entry in filesystem.scandir(path)
+                if entry.name.endswith('.cbz')
+            )
+            # Opened directly, like `Metadata.load`
+            try:
+                with filesystem.open(
+                    os.path.join(path, '.metadata.json'), 'rb'
+                ) as file:
+                    file.read()
+            except FileNotFoundError:
+                pass
+    return chapters
+
+
+def main(argv: list = None):
+    """Measure the access to the library, with an added latency."""
+    parser = argparse.ArgumentParser(
+        description='Measure the access to the library on a slow file '
+                    'system.'
+    )
+    parser.add_argument(
+        'comics_dir', nargs='?',
+        help='comics directory (default: comics_dir of comic_reader.ini)'
+    )
+    parser.add_argument(
+        '--latency-ms', type=float, default=20,
+        help='latency of each operation (default: 20)'
+    )
+    parser.add_argument(
+        '--comics', type=int, default=5,
+        help='number of comics opened (default: 5)'
+    )
+    args = parser.parse_args(argv)
+    working_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    comics_dir = args.comics_dir
+    if comics_dir is None:
+        comics_dir = Settings(
+            os.path.join(working_dir, 'comic_reader.ini')
+        )['comics_dir']
+    slow = LatencyFileSystem(args.latency_ms / 1000)
+    print(f'[INFO] Latency: {args.latency_ms} ms')
+    for label, filesystem in (
+        ('direct', slow),
+        ('cached', CachedFileSystem(slow, 30)),
+    ):
+        start = time.perf_counter()
+        chapters = _browse(filesystem, comics_dir, args.comics)
+        print(f'- browse ({label}): {time.perf_counter() - start:.3f} s, '
+              f'{chapters} chapters')
+    # A chapter read page by page, or staged first
+    chapter = None
+    for root, _, files in os.walk(comics_dir):
+        files = sorted(name for name in files if name.endswith('.cbz'))
+        if files:
+            chapter = os.path.join(root, files[0])
+            break
+    if chapter is None:
+        return
+    start = time.perf_counter()
+    with slow.open(chapter, 'rb') as file:
+        # Page faults of a memory-mapped archive, with the kernel read-ahead
+        while file.read(128 * 1024):
+            pass
+    print(f'- chapter read in place: {time.perf_counter() - start:.3f} s')
+    staging_dir = os.path.join(working_dir, 'cache', 'staging-benchmark')
+    stager = ArchiveStager(slow, staging_dir, keep=0)
+    start = time.perf_counter()
+    stager._copy(chapter)
+    print(f'- chapter staged: {time.perf_counter() - start:.3f} s')
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Tracing module.
+
+To record named timing spans of the chapter-open pipeline (archive open,
+extraction, decoding, scaling, layout, metadata save, first paint) and export
+them in the Chrome trace-event JSON format, readable by chrome://tracing or
+https://ui.perfetto.dev.
+
+Tracing is off by default. It is enabled by the `trace` setting or by the
+`COMIC_READER_TRACE` environment variable. When off, `span()` returns a shared
+no-op context manager, so instrumented code costs a single attribute lookup.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+ENV_VAR = 'COMIC_READER_TRACE'
+
+
+class _NullSpan:
+    """No-op span used when tracing is disabled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        """Ignore span arguments."""
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """Span measuring the time spent in a `with` block."""
+    def __init__(self, tracer, name: str, args: dict):
+        self._tracer = tracer
+        self._name = name
+        self._args = args
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._tracer.add(
+            self._name,
+            self._start,
+            time.perf_counter() - self._start,
+            **self._args
+        )
+        return False
+
+    def set(self, **args):
+        """Add arguments to the span (e.g. a size known at the end)."""
+        self._args.update(args)
+
+
+class Tracer:
+    """
+    Tracer class.
+
+    Collects complete ("X") trace events with microsecond timestamps.
+    """
+    def __init__(self, enabled: bool = False, path: str = None):
+        self.enabled = enabled
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    def configure(self, settings, working_dir: str):
+        """Enable tracing from the environment or the settings.
+
+        ----------
+        # Parameters
+        settings: The application settings (`trace` key).
+        working_dir: The directory where traces are exported by default.
+
+        `COMIC_READER_TRACE` may be `1` to enable tracing, or a path to
+        the JSON file to export to.
+        """
+        env = os.environ.get(ENV_VAR, '')
+        self.enabled = bool(env and env != '0') or bool(
+            settings.get('trace', False)
+        )
+        if env and env not in ('0', '1'):
+            self.path = env
+        else:
+            self.path = os.path.join(working_dir, 'trace.json')
+
+    def span(self, name: str, **args):
+        """Return a context manager recording a span named `name`."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def now(self) -> float:
+        """Return a timestamp usable as `start` for `add()`."""
+        return time.perf_counter()
+
+    def add(self, name: str, start: float, duration: float, **args):
+        """Record a span that started at `start` and lasted `duration`.
+
+        ----------
+        # Parameters
+        name: The name of the span.
+        start: The `time.perf_counter()` value at the start of the span.
+        duration: The duration of the span, in seconds.
+        args: Extra arguments shown in the trace viewer.
+        """
+        if not self.enabled:
+            return
+        event = {
+            'name': name,
+            'cat': 'comic_reader',
+            'ph': 'X',
+            'ts': (start - self._origin) * 1e6,
+            'dur': duration * 1e6,
+            'pid': self._pid,
+            'tid': threading.get_ident(),
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+
+    def clear(self):
+        """Drop all recorded events."""
+        with self._lock:
+            self.events = []
+
+    def export(self, path: str = None) -> str:
+        """Export recorded events as Chrome trace-event JSON.
+
+        ----------
+        # Returns
+        The path of the written file, or None if there was nothing to write.
+        """
+        path = path or self.path
+        with self._lock:
+            events = list(self.events)
+        if not events or path is None:
+            return None
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(
+                {'traceEvents': events, 'displayTimeUnit': 'ms'},
+                file
+            )
+        print(f'[INFO] Trace exported to {path}')
+        return path
+
+
+# Shared tracer of the application
+tracer = Tracer()
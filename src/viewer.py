@@ -10,6 +10,22 @@ import os
 import zipfile
 from PyQt5 import QtCore, QtWidgets, QtGui
 from .comic import Comic
+from .tracing import tracer
+from .storage import is_url, storage
+from .scheduler import HASHING, INDEXING, scheduler
+from . import duplicates
+from .memory import MemoryBudget
+from .page_index import PageIndex
+from .paged import PagedView
+from .archive import ArchiveIndex
+from .decoders import DecoderSelector, scaled_size, sniff_format, to_pixmap
+from .processing import PageProcessor
+from .minimap import Minimap
+from .loader import ChapterLoader
+from .hud import PerformanceHud, hit_rate
+from .recorder import InputRecorder, recording_path
+from .watchdog import watchdog
+from .animation import AnimatedPage, VideoPage, is_animated, is_video
 
 
 class Viewer:
@@ -109,8 +125,13 @@ class Viewer:
         self.bottom_button.clicked.connect(self.go_to_bottom)
         self.top_menu_layout.addWidget(self.bottom_button)
 
-        # Spacer
-        self.top_menu_layout.addStretch()
+        # Minimap: thumbnails of the pages, to jump to one
+        self.minimap = Minimap(
+            os.path.join(working_dir, 'cache', 'thumbnails'),
+            self._scale(60)
+        )
+        self.minimap.page_clicked.connect(self._minimap_clicked)
+        self.top_menu_layout.addWidget(self.minimap.widget, 1)
 
         # Previous button
         self.previous_button = QtWidgets.QPushButton()
@@ -144,17 +165,86 @@ class Viewer:
         self.scroller.setAlignment(QtCore.Qt.AlignCenter)
         # Add scroll area to layout
         self.image_viewer_layout.addWidget(self.scroller)
+        # Input events recorded for `python -m src.replay`, if enabled
+        record_path = recording_path(settings, working_dir)
+        self.recorder = InputRecorder(record_path) if record_path else None
+        # Performance overlay
+        self.hud = PerformanceHud(
+            self.image_viewer,
+            self.scroller.verticalScrollBar(),
+            self._hud_stats
+        )
 
-        # List of images
+        # Archive of the current chapter, and its images
+        self.archive_index = ArchiveIndex(
+            os.path.join(working_dir, 'cache', 'index')
+        )
+        self.archive = None
         self.scroller_images = []
+        # Chapters in the scroller (several in continuous mode), their
+        # archives, and the chapter in view
+        self.window_chapters = []
+        self.archives = {}
+        self.current_chapter = None
+        self._is_sliding = False
+        # Backends decoding the images
+        self.decoders = DecoderSelector(settings)
+        # Cropping and levels of the pages, in worker threads
+        self.processor = PageProcessor(self.decoders, settings)
+        self.processor.processed.connect(self._page_processed)
+        # Labels displaying the images, their (chapter, image) keys, and
+        # their width
+        self.image_layout = None
+        self.page_labels = []
+        self.page_keys = []
+        self.page_width = 0
+        # Index of each page key, rebuilt when stale
+        self._key_indexes = {}
+        # Page at the top of the viewport (key, fraction), to keep in place
+        # once the pages resized by processing are laid out again
+        self._relayout_anchor = None
+        # Memory used by the pixel data of the pages
+        self.memory = MemoryBudget(self._memory_cap())
+        # Pages found resident (or decoded again) when coming into view,
+        # and the pages in view
+        self.page_hits = 0
+        self.page_misses = 0
+        self._keys_in_view = set()
+        # Time from a chapter request to its pages in view (in ms)
+        self.first_page_ms = None
+        # Animated pages, played only while visible
+        self.animations = {}
+        # Offsets of the pages in the scroller
+        self.page_index = PageIndex()
+        # Paged mode: one page or spread at a time, instead of the scroller
+        self.paged = PagedView(
+            self.decoders,
+            self.memory,
+            self.settings['viewer'].get('paged_ahead', 2),
+            self.settings['viewer'].get('paged_behind', 1)
+        )
+        self.paged.widget.keyPressEvent = self._image_viewer_key_press
+        self.paged.widget.hide()
+        self.image_viewer_layout.addWidget(self.paged.widget)
+        self._wheel_delta = 0
+        self.scroller.verticalScrollBar().valueChanged.connect(
+            self._update_resident_pages
+        )
 
-        # Boolean to prevent changing multiple chapters at once
-        self.is_changing_chapter = False
-        self.changing_chapter_timer = QtCore.QTimer()
-        self.changing_chapter_timer.setInterval(1000)
-        self.changing_chapter_timer.timeout.connect(
-            self.changing_chapter_timeout
+        # Chapters are opened in a worker thread, only the latest chapter
+        # requested is displayed
+        self.loader = ChapterLoader(
+            self._open_archive, self._page_size, self._benchmark_decoders
+        )
+        self.loader.loaded.connect(self._chapter_loaded)
+        self.loader.failed.connect(self._chapter_failed)
+        # Continuous mode: the neighbouring chapters are opened in a worker
+        # too, so that scrolling never waits for them
+        self.extender = ChapterLoader(
+            self._open_archive, self._page_size, self._benchmark_decoders
         )
+        self.extender.loaded.connect(self._window_extended)
+        self.extender.failed.connect(self._chapter_failed)
 
         # Set theme
         self._set_theme()
@@ -166,105 +256,141 @@ class Viewer:
     def chapter_clicked(
             self,
             current_comic: Comic = None,
-            chapter_list: QtWidgets.QListWidget = None):
+            chapter_list: QtWidgets.QListWidget = None,
+            at_start: bool = False):
         """
         Load images for a chapter.
         Load all images next (scroll) to each other.
-        As the chapter is a .cbz file, we can use zipfile to
-        extract the images to a temporary directory.
+        As the chapter is a .cbz file, the images are read straight from
+        the memory-mapped archive.
+        The chapter is opened in a worker thread: a chapter clicked while
+        another one is loading cancels it. `at_start` opens the chapter at
+        its first page, instead of the last page read.
         """
         if current_comic is not None:
+            if (
+                self.current_comic is not None
+                and current_comic.path != self.current_comic.path
+            ):
+                # Pages are analyzed by (chapter, image), within a comic
+                self.processor.forget()
             self.current_comic = current_comic
         if chapter_list is not None:
             self.chapter_list = chapter_list
         chapter = self.chapter_list.currentItem().text()
         chapter_path = self.current_comic.get_chapter_path(chapter)
-        # Refresh metadata
-        self.current_comic.refresh()
-        # Save last chapter
-        self.current_comic.set_last_chapter(chapter)
-        # Create temporary directory
-        manga_name = self.current_comic.name
-        tmp_dir = os.path.join(self.working_dir, 'tmp', manga_name, chapter)
-        if not os.path.exists(tmp_dir):
-            os.makedirs(tmp_dir)
-        # Clear image viewer
-        self.scroller_images = []
-        # Extract images to a temporary directory
-        with zipfile.ZipFile(chapter_path, 'r') as zip_file:
-            for image in zip_file.namelist():
-                if (
-                    image.endswith('.png')
-                    or image.endswith('.jpg')
-                    or image.endswith('.jpeg')
-                    or image.endswith('.webp')
-                    or image.endswith('.webm')
-                ):
-                    zip_file.extract(
-                        image,
-                        tmp_dir
-                    )
-                    self.scroller_images.append(
-                        os.path.join(tmp_dir, image)
-                    )
+        if self.recorder is not None:
+            self.recorder.start(self.chapter_list.currentRow())
+        with tracer.span('metadata save', chapter=chapter):
+            # Refresh metadata
+            self.current_comic.refresh()
+            # Save last chapter
+            self.current_comic.set_last_chapter(chapter)
+        # Stop scrolling, and clear image viewer
+        if self.scroller_animation is not None:
+            self.scroller_animation.stop()
+        self._clear_pages()
+        self.minimap.clear()
+        self.page_width = self._scale(self.settings['viewer']['width'])
+        self.memory.cap = self._memory_cap()
+        self._stage_chapters(chapter)
+        self._set_title(chapter)
+        # Background jobs wait for the chapter
+        scheduler.pause('loading')
+        # Open the archive and read the size of the pages in the worker,
+        # images are read from the archive when displayed
+        self.loader.load(
+            chapter, chapter_path, at_start, not self._is_paged(),
+            filler=self._filler_pages(chapter)
+        )
+
+    def _chapter_loaded(self, load):
+        """Display a chapter opened in the worker thread."""
+        if not self.loader.finish(load):
+            return
+        chapter = load.chapter
+        self.archive = load.archive
+        self.archives[chapter] = self.archive
+        self.current_chapter = chapter
+        # Images, in reading order
+        self.scroller_images = self.archive.namelist()
+        self.minimap.set_chapter(self.archive)
+        # Decoders chosen on the first chapters opened
+        if load.decoders:
+            self.decoders.choose(load.decoders)
 
         # Load all images vertically
         image_widget = QtWidgets.QWidget()
-        image_layout = QtWidgets.QVBoxLayout()
-        width = self._scale(self.settings['viewer']['width'])
-        for image in self.scroller_images:
-            image_pixmap = QtGui.QPixmap(image)
-            # Fit image to width
-            image_pixmap = image_pixmap.scaledToWidth(width)
-            # Create label
-            image_label = QtWidgets.QLabel()
-            image_label.setPixmap(image_pixmap)
-            image_layout.addWidget(image_label)
+        self.image_layout = QtWidgets.QVBoxLayout()
+        image_widget.setLayout(self.image_layout)
+        if self._is_paged():
+            self._open_paged(chapter)
+        else:
+            self.paged.widget.hide()
+            self.scroller.show()
+            self._load_chapter_pages(chapter, load.sizes)
 
         # Set layout
-        image_widget.setLayout(image_layout)
-        self.scroller.setWidget(image_widget)
-        # Change window title
-        min_title = chapter[:-4].split(' ', 3)
-        min_title = min_title[0] + ' ' + min_title[1]
-        self.image_viewer.setWindowTitle(
-            f'{self.current_comic.name} - {min_title}'
-        )
+        with tracer.span('layout', nb_images=len(self.scroller_images)):
+            self.scroller.setWidget(image_widget)
+            self._rebuild_page_index()
+        # Record time until the chapter is first painted
+        if tracer.enabled:
+            self._trace_first_paint(image_widget, load.start, chapter)
         # Set focus on image viewer
         self.scroller.setFocus()
-        # Get last_position if any
+        # Get last page if any, else last_position if any
+        last_page = self.current_comic.get_chapter_last_page()
         last_position = self.current_comic.get_chapter_last_position()
-        if last_position is not None:
+        if load.at_start:
+            self.scroller.verticalScrollBar().setValue(0)
+            if self._is_paged():
+                self.paged.go_to_page(0)
+        elif last_page is not None:
+            self.go_to_page(*last_page)
+        elif last_position is not None:
             self.scroller.verticalScrollBar().setValue(last_position)
-        # Maximize image viewer
-        self.image_viewer.showMaximized()
+        # Maximize image viewer, unless it is already fullscreen
+        if not (
+            self.image_viewer.isVisible() and self.image_viewer.isFullScreen()
+        ):
+            self.image_viewer.showMaximized()
+        # Make sure the pages in view are resident
+        self._update_resident_pages()
+        self._update_minimap()
+        self.first_page_ms = (tracer.now() - load.start) * 1000
+        self._schedule_chapter_jobs(chapter)
+        scheduler.resume('loading')
 
         # Update chapter list
-        is_last_chapter = False
-        for index in range(self.chapter_list.count()):
-            # If chapter is last chapter
-            if self.chapter_list.item(index).text() == chapter:
-                is_last_chapter = True
-                self.chapter_list.item(index).setForeground(
-                    QtGui.QColor(255, 255, 255)
-                )
-            else:
-                # If is_last_chapter is False, set read chapters to gray
-                if not is_last_chapter:
-                    self.chapter_list.item(index).setForeground(
-                        QtGui.QColor(128, 128, 128)
-                    )
-                # If is_last_chapter is True, set unread chapters to white
-                else:
-                    self.chapter_list.item(index).setForeground(
-                        QtGui.QColor(255, 255, 255)
-                    )
+        self._mark_read_chapters(chapter)
         print("[DEBUG] Load images")
-        print(f"- chapter: {chapter_path}")
+        print(f"- chapter: {load.chapter_path}")
         print(f"- nb images: {len(self.scroller_images)}")
+        print(f"- resident memory: {self.memory.total() // 2**20} MiB")
+        tracer.add(
+            'chapter open',
+            load.start,
+            tracer.now() - load.start,
+            chapter=chapter,
+            nb_images=len(self.scroller_images)
+        )
+
+    def _chapter_failed(self, load, error: Exception):
+        """Report a chapter that could not be opened."""
+        if self.extender.finish(load):
+            print(f"[ERROR] Cannot add the chapter {load.chapter_path}: "
+                  f"{error}")
+            return
+        if not self.loader.finish(load):
+            return
+        scheduler.resume('loading')
+        print(f"[ERROR] Cannot open the chapter {load.chapter_path}: {error}")
 
     def _image_viewer_key_press(self, event):
         """Handle key press events."""
+        if self.recorder is not None:
+            self.recorder.record('key_press', event)
         # Handle Esc, Ctrl+W, Ctrl+Q -> close image viewer
         if (
             event.key() == QtCore.Qt.Key_Escape
@@ -345,9 +471,16 @@ class Viewer:
         # Handle S -> toggle scrollbar
         elif event.key() == QtCore.Qt.Key_S:
             self._toggle_scrollbar()
+        # Handle H -> toggle performance overlay
+        elif event.key() == QtCore.Qt.Key_H:
+            self._toggle_hud()
 
     def _image_viewer_mouse_press(self, event):
         """Handle mouse press events."""
+        if self.recorder is not None:
+            self.recorder.record(
+                'mouse_press', event, self.image_viewer.size()
+            )
         # Get position of mouse press depending of settings
         orientation = self.settings['orientation']
         pos = None
@@ -388,6 +521,8 @@ class Viewer:
 
     def _image_viewer_key_release(self, event):
         """Handle key release events."""
+        if self.recorder is not None:
+            self.recorder.record('key_release', event)
         # Handle Down, Up, Left, Right, PageUp, PageDown, Home, End
         # -> Save progression
         if (
@@ -407,10 +542,21 @@ class Viewer:
 
     def _image_viewer_wheel_event(self, event):
         """Handle mouse wheel events."""
+        if self.recorder is not None:
+            self.recorder.record('wheel', event)
         # Handle mouse wheel -> Save progression
         self._progression_chapter()
+        # Background jobs wait for the scroll to end
+        scheduler.hold(0.2)
         # Scroll
         speed = event.angleDelta().y()
+        # Paged mode: flip a page per wheel notch
+        if self._is_paged():
+            self._wheel_delta += speed
+            if abs(self._wheel_delta) >= 120:
+                self._scroll_update("-" if self._wheel_delta > 0 else "+")
+                self._wheel_delta = 0
+            return
         if speed > 0:
             # Update current chapter if needed
             has_chapter_changed = self._update_chapter_scroller("-")
@@ -447,52 +593,32 @@ class Viewer:
         # DEBUG
         if event:
             print("[DEBUG] previous_chapter |", event.key())
-        # If changing chapter, return
-        is_changing_chapter = self._changing_chapter()
-        if is_changing_chapter:
-            return
-        # Get current fullscreen state
-        state = self.image_viewer.windowState()
-        # If not first chapter, select previous chapter
+        # If not first chapter, select previous chapter (cancelling the
+        # chapter loading, if any)
         if self.chapter_list.currentRow() > 0:
             self.chapter_list.setCurrentRow(
                 self.chapter_list.currentRow() - 1
             )
-            self.chapter_clicked()
+            self.chapter_clicked(at_start=True)
         else:
             # Close window if first chapter
             self.close_image_viewer()
-        # Reset scroll position
-        self.scroller.verticalScrollBar().setValue(0)
-        # Set back to fullscreen if needed
-        if state == QtCore.Qt.WindowFullScreen:
-            self._toggle_fullscreen(force=True)
 
     def _next_chapter(self, event=None):
         """Select next chapter."""
         # DEBUG
         if event:
             print("[DEBUG] next_chapter |", event.key())
-        # If changing chapter, return
-        is_changing_chapter = self._changing_chapter()
-        if is_changing_chapter:
-            return
-        # Get current fullscreen state
-        state = self.image_viewer.windowState()
-        # If not last chapter, select next chapter
+        # If not last chapter, select next chapter (cancelling the chapter
+        # loading, if any)
         if self.chapter_list.currentRow() < self.chapter_list.count() - 1:
             self.chapter_list.setCurrentRow(
                 self.chapter_list.currentRow() + 1
             )
-            self.chapter_clicked()
+            self.chapter_clicked(at_start=True)
         else:
             # Close window if last chapter
             self.close_image_viewer()
-        # Reset scroll position
-        self.scroller.verticalScrollBar().setValue(0)
-        # Set back to fullscreen if needed
-        if state == QtCore.Qt.WindowFullScreen:
-            self._toggle_fullscreen(force=True)
 
     def _toggle_fullscreen(self, event=None, force: bool = None):
         """Toggle fullscreen."""
@@ -518,9 +644,17 @@ class Viewer:
             print("[DEBUG] toggle_top_menu |", event.key())
         if self.top_menu.isHidden():
             self.top_menu.show()
+            self._update_minimap()
         else:
             self.top_menu.hide()
 
+    def _toggle_hud(self, event=None):
+        """Toggle performance overlay."""
+        # DEBUG
+        if event:
+            print("[DEBUG] toggle_hud |", event.key())
+        self.hud.toggle()
+
     def close_image_viewer(self, event=None):
         """Close image viewer."""
         # DEBUG
@@ -528,7 +662,14 @@ class Viewer:
             print("[DEBUG] close_image_viewer |", event.key())
         # Save progression
         self._progression_chapter()
+        # Stop loading a chapter, if any
+        self.loader.cancel()
+        self.extender.cancel()
+        scheduler.resume('loading')
+        if self.recorder is not None:
+            self.recorder.save()
         # Close image viewer
+        self._stop_animations()
         self.image_viewer.hide()
 
     def go_to_top(self, event=None):
@@ -545,18 +686,6 @@ class Viewer:
             print("[DEBUG] got_to_bottom |", event.key())
         self._scroll_animation("bottom")
 
-    # ------------------------------------------------------------------------
-    # ---------------------------------Timers---------------------------------
-    # ------------------------------------------------------------------------
-
-    def changing_chapter_timeout(self, event=None):
-        """Handle changing chapter timeout."""
-        # DEBUG
-        if event:
-            print("[DEBUG] changing_chapter_timeout |", event.key())
-        self.changing_chapter_timer.stop()
-        self.is_changing_chapter = False
-
     # ------------------------------------------------------------------------
     # -------------------------------Functions--------------------------------
     # ------------------------------------------------------------------------
@@ -564,6 +693,8 @@ class Viewer:
     def set_settings(self, settings: dict):
         """Set settings."""
         self.settings = settings
+        self.decoders.settings = settings
+        self.processor.configure(settings)
 
     def _set_theme(self):
         """Set theme."""
@@ -588,18 +719,6 @@ class Viewer:
             duration = self.settings['page']['duration']
         self._scroll_animation(direction, step, duration)
 
-    def _changing_chapter(self) -> bool:
-        """Handle changing chapter."""
-        # Handle changing chapter
-        if not self.is_changing_chapter:
-            self.is_changing_chapter = True
-            # Stopping scrolling
-            if self.scroller_animation is not None:
-                self.scroller_animation.stop()
-            self.changing_chapter_timer.start()
-            return False
-        return True
-
     def _scroll_animation(
             self,
             direction: str,
@@ -607,6 +726,19 @@ class Viewer:
             force_duration: int = None
     ):
         """Scroll content smoothly using a QPropertyAnimation."""
+        # Paged mode: flip pages instead
+        if self._is_paged():
+            if direction in ("+", "-"):
+                self.paged.flip(1 if direction == "+" else -1)
+                self._toggle_mouse_cursor(force=False)
+            elif direction == "top":
+                self.paged.go_to_page(0)
+            elif direction == "bottom":
+                self.paged.go_to_page(len(self.paged.images) - 1)
+            self._update_minimap()
+            # Background jobs wait for the flip
+            scheduler.hold(0.2)
+            return
         # Step
         step = self._scale(self.settings['scroll']['step'])
         if force_step is not None:
@@ -639,10 +771,36 @@ class Viewer:
         self.scroller_animation.setStartValue(current_scroll_position)
         self.scroller_animation.setEndValue(new_scroll_position)
         self.scroller_animation.start()
+        # Background jobs wait for the scroll to end
+        scheduler.hold((duration + 200) / 1000)
 
     def _update_chapter_scroller(self, direction) -> bool:
         """Update current chapter depending on scroll position."""
+        # The chapter is loading: it has no scroll position yet
+        if self.loader.is_loading():
+            return True
         scroller = self.scroller.verticalScrollBar()
+        # In paged mode, change chapter from the first/last spread
+        if self._is_paged():
+            if direction == "-" and self.paged.at_start():
+                self._previous_chapter()
+                return True
+            if direction == "+" and self.paged.at_end():
+                self._next_chapter()
+                return True
+            return False
+        # In continuous mode, add the previous/next chapter to the scroller
+        if self._is_continuous():
+            if (
+                direction == "-" and scroller.value() == 0
+                and self._extend_window(at_end=False)
+            ):
+                return False
+            if (
+                direction == "+" and scroller.value() == scroller.maximum()
+                and self._extend_window(at_end=True)
+            ):
+                return False
         # If scroll is at the top, read previous chapter
         if (direction == "-" and scroller.value() == 0):
             self._previous_chapter()
@@ -655,14 +813,734 @@ class Viewer:
 
     def _progression_chapter(self):
         """Keep track of progression."""
-        # Get current position
-        current_position = self.scroller.verticalScrollBar().value()
-        # Update progression
-        self.current_comic.set_chapter_last_position(current_position)
-        # Save
-        self.current_comic.save()
+        # The chapter is loading: keep its last position
+        if self.loader.is_loading():
+            return
+        # Get current position, relative to the current chapter
+        chapter_top = self.page_index.offset_of(
+            self._chapter_start(self.current_chapter)
+        ) - self.page_index.offset_of(0)
+        current_position = (
+            self.scroller.verticalScrollBar().value() - chapter_top
+        )
+        current_page = list(self.current_page())
+        with tracer.span('metadata save', position=current_position):
+            # Update and save progression
+            self.current_comic.set_chapter_progression(
+                current_position, current_page
+            )
         print("[DEBUG] Progression")
         print(f"- Current position: {current_position}")
+        print(f"- Current page: {current_page}")
+
+    def current_page(self) -> tuple:
+        """Get the page at the top of the viewport.
+
+        ----------
+        # Returns
+        The index of the page in the current chapter, and the fraction of
+        the page scrolled past.
+        """
+        if self._is_paged():
+            return self.paged.page(), 0.0
+        index, fraction = self.page_index.page_at(
+            self.scroller.verticalScrollBar().value()
+        )
+        if not self.page_keys:
+            return 0, 0.0
+        if self._page_key(index)[0] != self.current_chapter:
+            # End of the previous chapter, still at the top of the viewport
+            return 0, 0.0
+        return index - self._chapter_start(self.current_chapter), fraction
+
+    def go_to_page(self, index: int, fraction: float = 0.0):
+        """Scroll to a position in a page.
+
+        ----------
+        # Parameters
+        index: The index of the page in the current chapter.
+        fraction: The fraction of the page to scroll past.
+        """
+        if self._is_paged():
+            self.paged.go_to_page(index)
+            return
+        self.scroller.verticalScrollBar().setValue(
+            self.page_index.offset_of(
+                self._chapter_start(self.current_chapter) + index,
+                fraction
+            )
+        )
+
+    def _benchmark_decoders(self, archive) -> dict:
+        """Benchmark the decoders on a page of each format with no decoder
+        chosen yet (in the loader thread).
+
+        ----------
+        # Returns
+        The decoder chosen for each of these formats.
+        """
+        samples = [
+            archive.read(image)
+            for image in self.decoders.uncalibrated(archive.namelist())
+        ]
+        if not samples:
+            return {}
+        with tracer.span('decoders calibration'):
+            return self.decoders.benchmark(samples, self.page_width)
+
+    def _filler_pages(self, chapter: str) -> set:
+        """Get the filler pages of a chapter, if they are skipped."""
+        if not self.settings['viewer'].get('skip_filler', False):
+            return frozenset()
+        return frozenset(self.current_comic.get_filler_pages(chapter))
+
+    def _open_archive(self, chapter_path: str, filler: set):
+        """Open the archive of a chapter, without its `filler` pages (in the
+        loader thread)."""
+        # Local copy of the archive, if staged
+        archive = self.archive_index.open(storage.local_path(chapter_path))
+        # Keep at least one page
+        if filler and len(filler) < len(archive.entries):
+            archive.entries = {
+                name: entry for name, entry in archive.entries.items()
+                if name not in filler
+            }
+        return archive
+
+    def _stage_chapters(self, chapter: str):
+        """Stage the archives of a chapter and of the next one to the local
+        disk, if enabled."""
+        row = self._chapter_row(chapter)
+        if row < 0:
+            return
+        storage.stage([
+            self.current_comic.get_chapter_path(
+                self.chapter_list.item(index).text()
+            )
+            for index in (row, row + 1)
+            if 0 <= index < self.chapter_list.count()
+        ])
+
+    def _memory_cap(self) -> int:
+        """Get the memory cap of the pages, in bytes."""
+        return int(
+            self.settings['viewer'].get('memory_cap_mb', 512) * 2**20
+        )
+
+    def _page_key(self, index: int) -> tuple:
+        """Get the (chapter, image) key of a page."""
+        return self.page_keys[index]
+
+    def _page_position(self, key: tuple) -> int:
+        """Get the index of a page from its key (-1 if not in the
+        scroller)."""
+        index = self._key_indexes.get(key, -1)
+        if not 0 <= index < len(self.page_keys) or (
+            self.page_keys[index] != key
+        ):
+            # Pages were added or removed since the last lookup
+            self._key_indexes = {
+                page_key: position
+                for position, page_key in enumerate(self.page_keys)
+            }
+            index = self._key_indexes.get(key, -1)
+        return index
+
+    def _clear_pages(self):
+        """Forget the pages and close the archives of the chapters."""
+        self._stop_animations()
+        self.animations = {}
+        self.extender.cancel()
+        self.processor.cancel()
+        self._relayout_anchor = None
+        self._keys_in_view = set()
+        self.paged.clear()
+        self.memory.clear()
+        for archive in self.archives.values():
+            archive.close()
+        self.archives = {}
+        self.window_chapters = []
+        self.page_labels = []
+        self.page_keys = []
+
+    def _load_chapter_pages(
+            self,
+            chapter: str,
+            sizes: list,
+            at_end: bool = True) -> int:
+        """Add the pages of a chapter to the layout. Only their size is
+        known: they are decoded when they come into view.
+
+        ----------
+        # Parameters
+        chapter: The chapter, whose archive is already open.
+        sizes: The sizes of the pages (None if unknown), read by the loader.
+        at_end: Add the pages after (or before) the pages in the layout.
+
+        ----------
+        # Returns
+        The height added to the layout.
+        """
+        archive = self.archives[chapter]
+        position = len(self.page_labels) if at_end else 0
+        spacing = max(self.image_layout.spacing(), 0)
+        height = 0
+        for offset, image in enumerate(archive.namelist()):
+            index = position + offset
+            # Create label, sized once so that it keeps its place in the
+            # layout when its pixel data is evicted
+            image_label = QtWidgets.QLabel()
+            self.page_labels.insert(index, image_label)
+            self.page_keys.insert(index, (chapter, image))
+            size = sizes[offset]
+            if size is None:
+                size = self._materialize_page(index)
+            image_label.setFixedSize(size)
+            self.image_layout.insertWidget(index, image_label)
+            height += size.height() + spacing
+            # Stay under the memory cap while loading
+            self._enforce_memory_cap({index})
+        if at_end:
+            self.window_chapters.append(chapter)
+        else:
+            self.window_chapters.insert(0, chapter)
+        return height
+
+    def _page_size(self, image: str, data) -> QtCore.QSize:
+        """Get the size of a page without decoding it (None if unknown)."""
+        if is_video(image):
+            return QtCore.QSize(self.page_width, self.page_width * 9 // 16)
+        size = scaled_size(data, self.page_width)
+        return size if size.isValid() else None
+
+    def _rebuild_page_index(self):
+        """Lay the pages out, and index their offsets."""
+        self.image_layout.activate()
+        self.scroller.widget().adjustSize()
+        self.page_index.build(
+            [label.height() for label in self.page_labels],
+            self.page_labels[0].y() if self.page_labels else 0,
+            max(self.image_layout.spacing(), 0)
+        )
+
+    def _materialize_page(self, index: int, data=None) -> QtCore.QSize:
+        """Decode and scale a page, then display it in its label.
+
+        ----------
+        # Returns
+        The size of the page.
+        """
+        key = self._page_key(index)
+        chapter, image = key
+        label = self.page_labels[index]
+        if data is None:
+            with tracer.span('extract', entry=image):
+                data = self.archives[chapter].read(image)
+        # Videos are played in their label once visible
+        if is_video(image):
+            self.animations[key] = VideoPage(label, data)
+            self.memory.add(key, self.animations[key].nbytes())
+            return QtCore.QSize(self.page_width, self.page_width * 9 // 16)
+        # Pages already analyzed are decoded and processed in a worker
+        if self.processor.enabled() and self.processor.is_known(key):
+            self.processor.submit(key, data, None, self.page_width)
+            self.memory.add(key, label.width() * label.height() * 4)
+            return label.size()
+        # Decode and fit image to width
+        image = self.decoders.decode(data, self.page_width)
+        image_pixmap = to_pixmap(image)
+        label.setPixmap(image_pixmap)
+        self.memory.add(
+            key,
+            image_pixmap.width() * image_pixmap.height()
+            * image_pixmap.depth() // 8
+        )
+        # Animated images show their first frame until visible
+        if sniff_format(data) in ('gif', 'webp') and is_animated(data):
+            self.animations[key] = AnimatedPage(
+                label,
+                data,
+                int(
+                    self.settings['viewer'].get('animation_cache_mb', 64)
+                    * 2**20
+                )
+            )
+            self.memory.add(key, self.animations[key].nbytes())
+        elif self.processor.enabled() and not image.isNull():
+            self.processor.submit(key, data, image, self.page_width)
+        return image_pixmap.size()
+
+    def _page_processed(self, key: tuple, image: QtGui.QImage,
+                        generation: int):
+        """Display a page processed in a worker thread."""
+        if (
+            generation != self.processor.generation
+            or image.width() != self.page_width
+            or not self.memory.is_resident(key)
+        ):
+            return
+        index = self._page_position(key)
+        if index < 0:
+            return
+        label = self.page_labels[index]
+        image_pixmap = to_pixmap(image)
+        label.setPixmap(image_pixmap)
+        self.memory.add(
+            key,
+            image_pixmap.width() * image_pixmap.height()
+            * image_pixmap.depth() // 8
+        )
+        if label.size() != image_pixmap.size():
+            if self._relayout_anchor is None:
+                # Lay the pages out once for all the pages processed in
+                # the meantime
+                top_page, fraction = self.page_index.page_at(
+                    self.scroller.verticalScrollBar().value()
+                )
+                self._relayout_anchor = (self._page_key(top_page), fraction)
+                QtCore.QTimer.singleShot(0, self._relayout)
+            label.setFixedSize(image_pixmap.size())
+
+    def _relayout(self):
+        """Lay the resized pages out, keeping the page at the top of the
+        viewport in place."""
+        anchor, self._relayout_anchor = self._relayout_anchor, None
+        if anchor is None or not self.page_labels:
+            return
+        self._rebuild_page_index()
+        index = self._page_position(anchor[0])
+        if index >= 0:
+            self.scroller.verticalScrollBar().setValue(
+                self.page_index.offset_of(index, anchor[1])
+            )
+
+    def _evict_page(self, index: int):
+        """Release the pixel data of a page, keeping its placeholder."""
+        animation = self.animations.pop(self._page_key(index), None)
+        if animation is not None:
+            animation.stop()
+        self.page_labels[index].clear()
+        self.memory.remove(self._page_key(index))
+
+    def _stop_animations(self):
+        """Stop all the animations (e.g. when the viewer is hidden)."""
+        for animation in self.animations.values():
+            animation.stop()
+
+    def _enforce_memory_cap(self, protected: set):
+        """Evict pages until the memory cap is respected."""
+        protected_keys = {self._page_key(index) for index in protected}
+        for key in self.memory.victims(protected_keys):
+            self._evict_page(self._page_position(key))
+
+    def _visible_pages(self, margin: int = 1) -> set:
+        """Get the pages in (or `margin` screens around) the viewport."""
+        viewport_height = self.scroller.viewport().height()
+        top = (
+            self.scroller.verticalScrollBar().value()
+            - margin * viewport_height
+        )
+        bottom = top + (1 + 2 * margin) * viewport_height
+        return set(self.page_index.pages_between(top, bottom - 1))
+
+    def _materialize_pages(self, indexes: list):
+        """Materialize pages, the entries of each chapter read together so
+        that compressed ones are inflated (or remote ones fetched) in
+        parallel."""
+        by_chapter = {}
+        for index in indexes:
+            by_chapter.setdefault(self._page_key(index)[0], []).append(index)
+        for chapter, chapter_indexes in by_chapter.items():
+            if len(chapter_indexes) == 1:
+                self._materialize_page(chapter_indexes[0])
+                continue
+            # Pages are decoded as soon as their entry is read, while the
+            # next ones are still being read
+            names = [self._page_key(index)[1] for index in chapter_indexes]
+            entries = self.archives[chapter].read_many(names)
+            for index, (_, data) in zip(chapter_indexes, entries):
+                self._materialize_page(index, data)
+
+    def _update_resident_pages(self, _value: int = None):
+        """Re-materialize pages coming into view, evict the others."""
+        if not self.page_labels:
+            return
+        if self._is_continuous():
+            self._slide_window()
+        visible = self._visible_pages()
+        keys_in_view = set()
+        missing = []
+        for index in sorted(visible):
+            key = self._page_key(index)
+            keys_in_view.add(key)
+            # Pages already in view at the last frame are not counted
+            is_coming = key not in self._keys_in_view
+            if self.memory.is_resident(key):
+                self.memory.touch(key)
+                self.page_hits += is_coming
+            else:
+                missing.append(index)
+                self.page_misses += is_coming
+        self._materialize_pages(missing)
+        self._keys_in_view = keys_in_view
+        # Play only the animations in the viewport
+        on_screen = {
+            self._page_key(index)
+            for index in self._visible_pages(margin=0)
+        }
+        for key, animation in self.animations.items():
+            if key in on_screen:
+                animation.start()
+            else:
+                animation.stop()
+            # Frames are cached while playing
+            self.memory.resize(key, animation.nbytes())
+        self._enforce_memory_cap(visible)
+        self._update_minimap()
+
+    def _schedule_chapter_jobs(self, chapter: str):
+        """Index the archives of the other chapters of the comic (and hash
+        their pages, if enabled) in background jobs, the next chapters
+        first."""
+        scheduler.cancel('comic')
+        row = self._chapter_row(chapter)
+        rows = sorted(
+            range(self.chapter_list.count()),
+            key=lambda index: (abs(index - row), index < row)
+        )
+        paths = [
+            self.current_comic.get_chapter_path(
+                self.chapter_list.item(index).text()
+            )
+            for index in rows
+        ]
+        scheduler.submit(
+            'indexing',
+            self._index_chapters,
+            paths[1:],
+            priority=INDEXING,
+            group='comic'
+        )
+        background = self.settings.get('background') or {}
+        if (
+            not background.get('hash_pages', False)
+            or is_url(self.current_comic.path)
+        ):
+            return
+        if duplicates.np is None:
+            print('[WARNING] Please install numpy and Pillow from pip to '
+                  'hash the pages.')
+            return
+        finder = duplicates.DuplicateFinder(
+            os.path.dirname(self.current_comic.path),
+            os.path.join(self.working_dir, 'cache', 'hashes')
+        )
+        scheduler.submit(
+            'hashing',
+            finder.hash_chapters,
+            paths,
+            priority=HASHING,
+            group='comic'
+        )
+
+    def _index_chapters(self, paths: list):
+        """Index the archives of chapters, so that they open faster, one
+        per step (in a background job)."""
+        for path in paths:
+            try:
+                self.archive_index.open(storage.local_path(path)).close()
+            except (OSError, zipfile.BadZipFile) as error:
+                print(f'[WARNING] Cannot index {path}: {error}')
+            yield
+
+    def _hud_stats(self) -> list:
+        """Get the figures of the performance overlay."""
+        first_page = '-'
+        if self.first_page_ms is not None:
+            first_page = f'{self.first_page_ms:.0f} ms'
+        if self.loader.is_loading():
+            first_page = f'loading {self.loader.current.chapter}'
+        stats = [
+            ('First page', first_page),
+            ('Processing queue', self.processor.pending()),
+            ('Page cache', hit_rate(self.page_hits, self.page_misses)),
+            ('Index cache', hit_rate(
+                self.archive_index.hits, self.archive_index.misses
+            )),
+        ]
+        if storage.remote is not None:
+            blocks = storage.remote.filesystem.blocks
+            stats.append(
+                ('Remote blocks', hit_rate(blocks.hits, blocks.misses))
+            )
+        stats.append((
+            'Memory',
+            f'{self.memory.total() // 2**20} / {self.memory.cap // 2**20} MiB'
+        ))
+        state = scheduler.state()
+        background = f"{state['queued']} queued"
+        if state['running']:
+            background += f", running {', '.join(state['running'])}"
+        if state['paused']:
+            background += f", paused ({', '.join(state['paused'])})"
+        stats.append(('Background', background))
+        stalls, longest = watchdog.summary()
+        stats.append(('GUI stalls', f'{stalls}, longest {longest} ms'))
+        return stats
+
+    def _update_minimap(self):
+        """Highlight the current page in the minimap, if shown."""
+        if self.top_menu.isHidden():
+            return
+        current_page, _ = self.current_page()
+        self.minimap.start(current_page)
+        self.minimap.set_current(current_page)
+
+    def _minimap_clicked(self, index: int):
+        """Jump to the page clicked in the minimap."""
+        self.go_to_page(index)
+        self._update_minimap()
+        self._progression_chapter()
+
+    # ------------------------------------------------------------------------
+    # ---------------------------------Paged mode-----------------------------
+    # ------------------------------------------------------------------------
+
+    def _is_paged(self) -> bool:
+        """Tell if the chapter is read one page (or spread) at a time."""
+        return self.settings['viewer'].get('mode', 'scroll') in (
+            'page', 'spread'
+        )
+
+    def _open_paged(self, chapter: str):
+        """Display a chapter in the paged view."""
+        self.scroller.hide()
+        self.paged.widget.show()
+        self.paged.ahead = self.settings['viewer'].get('paged_ahead', 2)
+        self.paged.behind = self.settings['viewer'].get('paged_behind', 1)
+        self.paged.set_chapter(
+            chapter,
+            self.archive,
+            self.settings['viewer'].get('mode') == 'spread'
+        )
+        self.paged.show_current()
+        self.paged.widget.setFocus()
+
+    # ------------------------------------------------------------------------
+    # --------------------------Continuous scrolling--------------------------
+    # ------------------------------------------------------------------------
+
+    def _is_continuous(self) -> bool:
+        """Tell if chapters follow each other in the scroller."""
+        return self.settings['viewer'].get('continuous', False)
+
+    def _chapter_row(self, chapter: str) -> int:
+        """Get the row of a chapter in the chapter list (-1 if none)."""
+        for index in range(self.chapter_list.count()):
+            if self.chapter_list.item(index).text() == chapter:
+                return index
+        return -1
+
+    def _chapter_start(self, chapter: str) -> int:
+        """Get the index of the first page of a chapter in the scroller."""
+        for index, (page_chapter, _) in enumerate(self.page_keys):
+            if page_chapter == chapter:
+                return index
+        return 0
+
+    def _slide_window(self):
+        """Follow the chapter in view, and slide the window of chapters.
+
+        The next chapter is appended when the end of the scroller comes
+        near, and chapters too far behind (or ahead) are dropped.
+        """
+        if self._is_sliding:
+            return
+        self._is_sliding = True
+        try:
+            scrollbar = self.scroller.verticalScrollBar()
+            viewport_height = self.scroller.viewport().height()
+            # Chapter crossing the middle of the viewport
+            index, _ = self.page_index.page_at(
+                scrollbar.value() + viewport_height // 2
+            )
+            chapter = self._page_key(index)[0]
+            if chapter != self.current_chapter:
+                self._cross_chapter(chapter)
+            # Append next chapter when approaching the end
+            if scrollbar.value() >= scrollbar.maximum() - 2 * viewport_height:
+                self._extend_window(at_end=True)
+            # Dropping pages above the viewport moves the content: wait for
+            # the scroll animation to end
+            if (
+                self.scroller_animation is not None
+                and self.scroller_animation.state()
+                == QtCore.QAbstractAnimation.Running
+            ):
+                return
+            behind = self.settings['viewer'].get('chapters_behind', 1)
+            position = self.window_chapters.index(self.current_chapter)
+            while position > behind:
+                self._drop_chapter(self.window_chapters[0], at_end=False)
+                position -= 1
+            while len(self.window_chapters) - 1 - position > 1:
+                self._drop_chapter(self.window_chapters[-1], at_end=True)
+        finally:
+            self._is_sliding = False
+
+    def _cross_chapter(self, chapter: str):
+        """Make the chapter coming into view the current chapter."""
+        self.current_chapter = chapter
+        self.archive = self.archives[chapter]
+        self.scroller_images = self.archive.namelist()
+        self.minimap.set_chapter(self.archive)
+        self._update_minimap()
+        self.chapter_list.setCurrentRow(self._chapter_row(chapter))
+        with tracer.span('metadata save', chapter=chapter):
+            self.current_comic.set_last_chapter(chapter)
+        self._set_title(chapter)
+        self._mark_read_chapters(chapter)
+        print("[DEBUG] Cross chapter")
+        print(f"- chapter: {chapter}")
+
+    def _neighbour_chapter(self, at_end: bool) -> str:
+        """Get the chapter after (or before) the window of chapters (None
+        if there is none)."""
+        if not self.window_chapters:
+            return None
+        if at_end:
+            row = self._chapter_row(self.window_chapters[-1]) + 1
+        else:
+            row = self._chapter_row(self.window_chapters[0]) - 1
+        if row < 0 or row >= self.chapter_list.count():
+            return None
+        return self.chapter_list.item(row).text()
+
+    def _extend_window(self, at_end: bool) -> bool:
+        """Add the chapter after (or before) the window of chapters. It is
+        opened in a worker, its pages are added once it is loaded.
+
+        ----------
+        # Returns
+        True if a chapter is being added.
+        """
+        if self.extender.is_loading():
+            return True
+        chapter = self._neighbour_chapter(at_end)
+        if chapter is None:
+            return False
+        self._stage_chapters(chapter)
+        self.extender.load(
+            chapter,
+            self.current_comic.get_chapter_path(chapter),
+            at_end=at_end,
+            filler=self._filler_pages(chapter)
+        )
+        return True
+
+    def _window_extended(self, load):
+        """Add the pages of a chapter opened in the worker thread."""
+        if not self.extender.finish(load):
+            return
+        # The window changed in the meantime (e.g. another chapter opened)
+        if load.chapter != self._neighbour_chapter(load.at_end):
+            load.archive.close()
+            return
+        chapter = load.chapter
+        self.archives[chapter] = load.archive
+        if load.decoders:
+            self.decoders.choose(load.decoders)
+        height = self._load_chapter_pages(chapter, load.sizes, load.at_end)
+        self._rebuild_page_index()
+        # Keep the pages in view in place
+        if not load.at_end:
+            scrollbar = self.scroller.verticalScrollBar()
+            scrollbar.setValue(scrollbar.value() + height)
+        self._update_resident_pages()
+        print("[DEBUG] Extend window")
+        print(f"- chapter: {load.chapter_path}")
+        print(f"- window: {self.window_chapters}")
+
+    def _drop_chapter(self, chapter: str, at_end: bool):
+        """Remove the pages of a chapter at an end of the window."""
+        spacing = max(self.image_layout.spacing(), 0)
+        index = len(self.page_keys) - 1 if at_end else 0
+        removed = 0
+        while self.page_keys and self._page_key(index)[0] == chapter:
+            self._evict_page(index)
+            label = self.page_labels.pop(index)
+            self.page_keys.pop(index)
+            removed += label.height() + spacing
+            self.image_layout.removeWidget(label)
+            label.deleteLater()
+            index = len(self.page_keys) - 1 if at_end else 0
+        self.window_chapters.remove(chapter)
+        self.processor.forget(chapter)
+        self.archives.pop(chapter).close()
+        self.memory.clear(chapter)
+        self._rebuild_page_index()
+        # Keep the pages in view in place
+        if not at_end:
+            scrollbar = self.scroller.verticalScrollBar()
+            scrollbar.setValue(scrollbar.value() - removed)
+
+    def memory_usage(self) -> dict:
+        """Get the memory used by the pixel data of the pages.
+
+        ----------
+        # Returns
+        A dictionary with the `total` bytes resident, the `cap`, and the
+        bytes resident per `chapters` and per `pages`.
+        """
+        return self.memory.usage()
+
+    def _set_title(self, chapter: str):
+        """Show the comic and the chapter in the window title."""
+        min_title = chapter[:-4].split(' ', 3)
+        min_title = min_title[0] + ' ' + min_title[1]
+        self.image_viewer.setWindowTitle(
+            f'{self.current_comic.name} - {min_title}'
+        )
+
+    def _mark_read_chapters(self, chapter: str):
+        """Set the chapters before `chapter` to gray in the chapter list."""
+        is_last_chapter = False
+        for index in range(self.chapter_list.count()):
+            # If chapter is last chapter
+            if self.chapter_list.item(index).text() == chapter:
+                is_last_chapter = True
+                self.chapter_list.item(index).setForeground(
+                    QtGui.QColor(255, 255, 255)
+                )
+            else:
+                # If is_last_chapter is False, set read chapters to gray
+                if not is_last_chapter:
+                    self.chapter_list.item(index).setForeground(
+                        QtGui.QColor(128, 128, 128)
+                    )
+                # If is_last_chapter is True, set unread chapters to white
+                else:
+                    self.chapter_list.item(index).setForeground(
+                        QtGui.QColor(255, 255, 255)
+                    )
+
+    def _trace_first_paint(
+            self,
+            image_widget: QtWidgets.QWidget,
+            start: float,
+            chapter: str):
+        """Record a 'first paint' span when the chapter is first painted."""
+        def paint_event(event):
+            QtWidgets.QWidget.paintEvent(image_widget, event)
+            # Only the first paint is of interest
+            del image_widget.paintEvent
+            tracer.add(
+                'first paint',
+                start,
+                tracer.now() - start,
+                chapter=chapter
+            )
+        image_widget.paintEvent = paint_event
 
     def _set_maximized(self):
         """Set window maximized."""
@@ -0,0 +1,184 @@
+"""
+Watchdog module.
+
+To find the code paths freezing the GUI (a long chapter open, a metadata
+write blocked on a network share, ...).
+
+A timer of the GUI thread beats every 50 ms. A watchdog thread checks the
+beats: when the event loop has not turned for longer than the threshold
+(`watchdog.threshold_ms`, 100 ms by default), it samples the Python stack of
+the GUI thread (`sys._current_frames()`) until the loop turns again. Each
+stall is logged with the stack sampled the most, and stalls are aggregated
+by stack in a report printed on exit (and added to the trace, if tracing is
+enabled). While the app is hidden in the tray, the watchdog is paused, so
+that neither the timer nor the thread wake the idle process.
+
+The module-level `watchdog` is configured and started at startup.
+"""
+
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from PyQt5 import QtCore
+try:
+    from .tracing import tracer
+except ImportError:
+    from tracing import tracer
+
+
+# Interval of the beats of the GUI thread, and of the checks, in seconds
+BEAT_INTERVAL = 0.05
+CHECK_INTERVAL = 0.02
+
+
+class StallWatchdog:
+    """
+    StallWatchdog class.
+
+    Detects the stalls of the GUI thread, and aggregates them by stack.
+    """
+    def __init__(self, threshold_ms: int = 100, depth: int = 12):
+        self.enabled = False
+        self.threshold = threshold_ms / 1000
+        self.depth = depth
+        # Stalls by stack: count, total and longest duration (in ms)
+        self.stalls = {}
+        self._beat = time.perf_counter()
+        self._gui_thread = None
+        self._timer = None
+        self._thread = None
+        self._stopped = threading.Event()
+        # Cleared while paused
+        self._active = threading.Event()
+        self._lock = threading.Lock()
+
+    def configure(self, settings):
+        """Read the watchdog settings."""
+        config = settings.get('watchdog') or {}
+        self.enabled = config.get('enabled', True)
+        self.threshold = config.get('threshold_ms', 100) / 1000
+
+    def start(self):
+        """Start watching the GUI thread (from the GUI thread)."""
+        if not self.enabled or self._thread is not None:
+            return
+        self._gui_thread = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._timer = QtCore.QTimer()
+        self._timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self._timer.setInterval(int(BEAT_INTERVAL * 1000))
+        self._timer.timeout.connect(self._heartbeat)
+        self._timer.start()
+        self._stopped.clear()
+        self._active.set()
+        self._thread = threading.Thread(
+            target=self._watch, name='watchdog', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching."""
+        if self._thread is None:
+            return
+        self._timer.stop()
+        self._stopped.set()
+        # Wake the thread if it is paused
+        self._active.set()
+        self._thread.join()
+        self._thread = None
+
+    def pause(self):
+        """Stop the beats and the checks, e.g. while the app is hidden (from
+        the GUI thread)."""
+        if self._thread is None:
+            return
+        self._active.clear()
+        self._timer.stop()
+
+    def resume(self):
+        """Watch again after `pause` (from the GUI thread)."""
+        if self._thread is None or self._active.is_set():
+            return
+        self._beat = time.perf_counter()
+        self._timer.start()
+        self._active.set()
+
+    def _heartbeat(self):
+        """Record that the event loop turned (in the GUI thread)."""
+        self._beat = time.perf_counter()
+
+    def _stack(self, frame) -> tuple:
+        """Get the innermost frames of a stack, outermost first."""
+        return tuple(
+            f'{os.path.basename(summary.filename)}:{summary.lineno} '
+            f'{summary.name}'
+            for summary in traceback.extract_stack(frame, self.depth)
+        )
+
+    def _watch(self):
+        """Sample the stack of the GUI thread while it is stalled (in the
+        watchdog thread)."""
+        start = None
+        samples = Counter()
+        while not self._stopped.wait(CHECK_INTERVAL):
+            if not self._active.is_set():
+                # Paused: a stall in progress is not one of the GUI
+                start = None
+                samples = Counter()
+                self._active.wait()
+                continue
+            beat = self._beat
+            if time.perf_counter() - beat - BEAT_INTERVAL > self.threshold:
+                if start is None:
+                    start = beat + BEAT_INTERVAL
+                frame = sys._current_frames().get(self._gui_thread)
+                if frame is not None:
+                    samples[self._stack(frame)] += 1
+                del frame
+            elif start is not None:
+                # The loop turned again, at the last beat
+                self._record(start, beat - start, samples)
+                start = None
+                samples = Counter()
+
+    def _record(self, start: float, duration: float, samples: Counter):
+        """Log a stall, and add it to the report."""
+        stack = samples.most_common(1)[0][0] if samples else ('unknown',)
+        milliseconds = round(duration * 1000)
+        with self._lock:
+            count, total, longest = self.stalls.get(stack, (0, 0, 0))
+            self.stalls[stack] = (
+                count + 1, total + milliseconds, max(longest, milliseconds)
+            )
+        print(f'[WARNING] GUI stalled for {milliseconds} ms in {stack[-1]}')
+        tracer.add('stall', start, duration, stack=' < '.join(stack[::-1]))
+
+    def summary(self) -> tuple:
+        """Get the number of stalls, and the longest one (in ms)."""
+        with self._lock:
+            stalls = list(self.stalls.values())
+        return (
+            sum(count for count, _, _ in stalls),
+            max((longest for _, _, longest in stalls), default=0)
+        )
+
+    def report(self, limit: int = 10):
+        """Print the stacks stalling the GUI the longest, in total."""
+        with self._lock:
+            stalls = sorted(
+                self.stalls.items(), key=lambda item: item[1][1], reverse=True
+            )
+        if not stalls:
+            return
+        print('[INFO] GUI stalls, by stack')
+        for stack, (count, total, longest) in stalls[:limit]:
+            print(f'- {count} stalls, {total} ms in total, '
+                  f'longest {longest} ms:')
+            for line in stack[::-1]:
+                print(f'    {line}')
+
+
+watchdog = StallWatchdog()
@@ -0,0 +1,56 @@
+"""
+Tests of the archive module.
+"""
+
+import zipfile
+
+from src.archive import ArchiveIndex, CbzReader, is_page
+from src.server import CONTENT_TYPES
+
+
+# A 1x1 GIF
+GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04'
+    b'\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D'
+    b'\x01\x00;'
+)
+
+
+def make_cbz(path, compression=zipfile.ZIP_STORED):
+    """Write a chapter with a GIF page between two other pages."""
+    with zipfile.ZipFile(path, 'w', compression) as archive:
+        archive.writestr('1.png', b'\x89PNG\r\n\x1a\n')
+        archive.writestr('2.gif', GIF)
+        archive.writestr('10.jpg', b'\xff\xd8\xff')
+        archive.writestr('info.txt', b'not a page')
+
+
+def test_gif_is_page():
+    assert is_page('2.gif')
+    assert is_page('2.GIF')
+    assert CONTENT_TYPES['.gif'] == 'image/gif'
+
+
+def test_open_cbz_with_gif(tmp_path):
+    for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        path = str(tmp_path / f'chapter-{compression}.cbz')
+        make_cbz(path, compression)
+        reader = CbzReader(path)
+        try:
+            assert reader.pages() == ['1.png', '2.gif', '10.jpg']
+            assert bytes(reader.read('2.gif')) == GIF
+        finally:
+            reader.close()
+
+
+def test_index_keeps_gif(tmp_path):
+    path = str(tmp_path / 'chapter.cbz')
+    make_cbz(path)
+    # Indexed, then re-opened from the cached index
+    for _ in range(2):
+        reader = ArchiveIndex(str(tmp_path / 'cache')).open(path)
+        try:
+            assert reader.namelist() == ['1.png', '2.gif', '10.jpg']
+            assert bytes(reader.read('2.gif')) == GIF
+        finally:
+            reader.close()